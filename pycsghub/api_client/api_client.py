@@ -6,7 +6,7 @@ from typing import Any, Dict, List, Optional, Union
 
 from huggingface_hub.utils import filter_repo_objects
 
-from pycsghub.commit_ops import build_payload, CommitOperationAdd, CommitOperationDelete
+from pycsghub.commit_ops import CommitOperationAdd, CommitOperationDelete
 from pycsghub.csghub_api import CsgHubApi
 from pycsghub.file_download import file_download as csghub_file_download
 from pycsghub.snapshot_download import snapshot_download as csghub_snapshot_download
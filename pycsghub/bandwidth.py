@@ -0,0 +1,135 @@
+import asyncio
+import contextlib
+import logging
+import re
+import threading
+import time
+import weakref
+from typing import AsyncGenerator, Dict, Generator, Optional, Union
+from urllib.parse import urlparse
+
+from pycsghub.constants import BANDWIDTH_LIMIT, MAX_CONNECTIONS_PER_HOST
+
+logger = logging.getLogger(__name__)
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(size: Union[int, str, None]) -> Optional[int]:
+    """Parse a byte size such as `1048576`, `512K`, `50M` or `1G`, `None`, empty or 0 mean no size."""
+    if size is None or isinstance(size, int):
+        return size or None
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$', size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {size}, expected a number of bytes with an optional K, M or G suffix")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]) or None
+
+
+class TokenBucket:
+    """Token bucket of `rate` bytes per second, bursting up to one second of traffic.
+
+    A transfer takes its bytes from the bucket after reading or before sending them, the bucket may go into debt
+    and the caller waits until the debt is paid back.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, size: int) -> float:
+        """Take size bytes from the bucket and return the seconds to wait before transferring them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= size
+            return max(0.0, -self._tokens / self.rate)
+
+    def consume(self, size: int):
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+_bucket: Optional[TokenBucket] = None
+_host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+# asyncio semaphores only work within their event loop, so asyncio transfers have their own slots per loop
+_async_host_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = \
+    weakref.WeakKeyDictionary()
+_max_connections_per_host: Optional[int] = None
+_lock = threading.Lock()
+
+
+def set_bandwidth_limit(limit: Union[int, str, None]):
+    """Cap the bytes per second transferred by all downloads and uploads of the process, `None` removes the cap."""
+    global _bucket
+    rate = parse_size(limit)
+    _bucket = TokenBucket(rate) if rate else None
+
+
+def set_max_connections_per_host(max_connections: Optional[int]):
+    """Cap the concurrent transfer requests to one host, `None` or 0 removes the cap."""
+    global _max_connections_per_host
+    with _lock:
+        _max_connections_per_host = max_connections or None
+        _host_semaphores.clear()
+        _async_host_semaphores.clear()
+
+
+def throttle(size: int):
+    """Wait until size bytes may be transferred under the bandwidth limit."""
+    bucket = _bucket
+    if bucket is not None:
+        bucket.consume(size)
+
+
+async def athrottle(size: int):
+    """Asyncio variant of `throttle`."""
+    bucket = _bucket
+    if bucket is not None:
+        delay = bucket.reserve(size)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+@contextlib.contextmanager
+def host_connection(url: str) -> Generator[None, None, None]:
+    """Hold one of the connection slots of the host of url while transferring."""
+    if _max_connections_per_host is None:
+        yield
+        return
+    host = urlparse(url).netloc
+    with _lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = _host_semaphores[host] = threading.BoundedSemaphore(_max_connections_per_host)
+    with semaphore:
+        yield
+
+
+@contextlib.asynccontextmanager
+async def ahost_connection(url: str) -> AsyncGenerator[None, None]:
+    """Asyncio variant of `host_connection`, the connection slots are counted per event loop."""
+    max_connections = _max_connections_per_host
+    if max_connections is None:
+        yield
+        return
+    host = urlparse(url).netloc
+    loop = asyncio.get_running_loop()
+    with _lock:
+        semaphores = _async_host_semaphores.setdefault(loop, {})
+        semaphore = semaphores.get(host)
+        if semaphore is None:
+            semaphore = semaphores[host] = asyncio.Semaphore(max_connections)
+    async with semaphore:
+        yield
+
+
+try:
+    set_bandwidth_limit(BANDWIDTH_LIMIT)
+except ValueError as e:
+    # a malformed CSGHUB_BANDWIDTH_LIMIT must not make the SDK unusable
+    logger.warning(f"ignored CSGHUB_BANDWIDTH_LIMIT: {e}, transfers are not throttled")
+set_max_connections_per_host(MAX_CONNECTIONS_PER_HOST)
@@ -3,16 +3,120 @@ import json
 import logging
 import os
 import tempfile
-from shutil import move, rmtree
-from typing import Dict, Union
+import threading
+import time
+from shutil import copyfile, move, rmtree
+from typing import Dict, List, Optional, Set, Union
+
+from pycsghub.constants import (CACHE_BLOB_PRUNE_GRACE,
+                                CACHE_INDEX_COMPACT_ENTRIES,
+                                CACHE_INDEX_FLUSH_ENTRIES,
+                                CACHE_INDEX_FLUSH_INTERVAL)
+from pycsghub.utils import compute_hash
 
 logger = logging.getLogger(__name__)
 
+# ioctl request to clone a file on copy-on-write file systems (btrfs, xfs), see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dst: str):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+
+
+def link_blob(blob_path: str, dst: str):
+    """Materialize a cached blob at dst without copying its content when possible.
+
+    A reflink is tried first, it shares the content copy-on-write so dst can be modified safely. Then a hardlink
+    and a relative symlink, dst shares the blob and must not be modified in place. A plain copy is the last resort.
+
+    Args:
+        blob_path (str): The content addressed blob.
+        dst (str): The location to materialize, an existing file is replaced.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        _reflink(blob_path, dst)
+        return
+    except (ImportError, OSError):
+        if os.path.lexists(dst):
+            os.remove(dst)
+    try:
+        os.link(blob_path, dst)
+        return
+    except FileNotFoundError:
+        # the blob was pruned, do not leave a dangling symlink
+        raise
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(blob_path, os.path.dirname(dst)), dst)
+        return
+    except OSError:
+        pass
+    copyfile(blob_path, dst)
+
+
+def prune_blobs(cache_root: str) -> int:
+    """Remove the blobs no longer linked by the snapshot of any repo in cache_root.
+
+    Blobs are kept as long as a snapshot hardlinks or symlinks them, removing a snapshot makes its blobs prunable.
+    Blobs stored or linked in the last `CACHE_BLOB_PRUNE_GRACE` seconds are kept too, a download running
+    concurrently may be linking them. A working file symlinked to a pruned blob (local_dir on another file system)
+    is left dangling, hardlinked working files keep their content.
+
+    Args:
+        cache_root (str): The csghub local cache root.
+
+    Returns:
+        int: The number of removed blobs.
+    """
+    blobs_location = os.path.join(cache_root, FileSystemCache.BLOBS_DIR_NAME)
+    if not os.path.isdir(blobs_location):
+        return 0
+    linked_paths = set()
+    linked_inodes = set()
+    for root, dirs, files in os.walk(cache_root):
+        if root == cache_root and FileSystemCache.BLOBS_DIR_NAME in dirs:
+            dirs.remove(FileSystemCache.BLOBS_DIR_NAME)
+        if FileSystemCache.SNAPSHOTS_DIR_NAME not in os.path.relpath(root, cache_root).split(os.sep):
+            continue
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                linked_paths.add(os.path.realpath(path))
+            else:
+                st = os.stat(path)
+                linked_inodes.add((st.st_dev, st.st_ino))
+    removed = 0
+    # linking a blob or moving it into the store updates its ctime
+    changed_before = time.time() - CACHE_BLOB_PRUNE_GRACE
+    with os.scandir(blobs_location) as entries:
+        for entry in entries:
+            st = entry.stat(follow_symlinks=False)
+            if (os.path.realpath(entry.path) in linked_paths
+                    or (st.st_dev, st.st_ino) in linked_inodes
+                    or st.st_ctime > changed_before):
+                continue
+            os.remove(entry.path)
+            removed += 1
+    logger.info('pruned %d unused blobs from %s', removed, blobs_location)
+    return removed
+
+
 class FileSystemCache(object):
     KEY_FILE_NAME = '.msc'
+    KEY_JOURNAL_FILE_NAME = '.msc.journal'
     MODEL_META_FILE_NAME = '.mdl'
     MODEL_META_MODEL_ID = 'id'
     MODEL_VERSION_FILE_NAME = '.mv'
+    BLOBS_DIR_NAME = 'blobs'
+    SNAPSHOTS_DIR_NAME = 'snapshots'
+    REFS_DIR_NAME = 'refs'
     """Local file cache.
     """
 
@@ -29,33 +133,139 @@ class FileSystemCache(object):
         """
         os.makedirs(cache_root_location, exist_ok=True)
         self.cache_root_location = cache_root_location
+        self._lock = threading.RLock()
         self.load_cache()
 
     def get_root_location(self):
         return self.cache_root_location
 
+    @property
+    def cached_files(self) -> List[Dict]:
+        """All cache keys as a list, kept for backward compatibility, lookups should use the index."""
+        with self._lock:
+            return [key for revisions in self._index.values() for key in revisions.values()]
+
+    @cached_files.setter
+    def cached_files(self, keys: List[Dict]):
+        # index of cache keys: {path: {revision: key}}
+        self._index: Dict[str, Dict[str, Dict]] = {}
+        for key in keys:
+            if not isinstance(key, dict) or 'Path' not in key:
+                logger.warning("Ignoring invalid cache key %s", key)
+                continue
+            self._add_key(key)
+
+    def _add_key(self, key: Dict):
+        self._index.setdefault(key['Path'], {})[key.get('Revision')] = key
+
+    def _find_key(self, path: str, revision: Optional[str] = None) -> Optional[Dict]:
+        """Find the cache key of path, if revision is given, one revision must be a prefix of the other."""
+        with self._lock:
+            return self._find_key_locked(path, revision)
+
+    def _find_key_locked(self, path: str, revision: Optional[str]) -> Optional[Dict]:
+        revisions = self._index.get(path)
+        if not revisions:
+            return None
+        if revision is None:
+            return next(iter(revisions.values()))
+        key = revisions.get(revision)
+        if key is not None:
+            return key
+        # a path usually has a single cached revision
+        for cached_revision, key in revisions.items():
+            if cached_revision is not None and (
+                    cached_revision.startswith(revision) or revision.startswith(cached_revision)):
+                return key
+        return None
+
     def load_cache(self):
-        self.cached_files = []
-        cache_keys_file_path = os.path.join(self.cache_root_location,
-                                            FileSystemCache.KEY_FILE_NAME)
-        if os.path.exists(cache_keys_file_path):
-            try:
-                with open(cache_keys_file_path, 'r', encoding='utf-8') as f:
-                    self.cached_files = json.load(f)
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                logger.warning(
-                    "Failed to load cache file %s, it may be in an old format. "
-                    "Resetting cache index.", cache_keys_file_path)
-                self.cached_files = []
+        """Load the index snapshot `.msc` and replay the journal written since the last compaction."""
+        with self._lock:
+            self._pending = []
+            self._last_flush = time.monotonic()
+            self._journal_entries = 0
+            self.cached_files = []
+            cache_keys_file_path = os.path.join(self.cache_root_location,
+                                                FileSystemCache.KEY_FILE_NAME)
+            if os.path.exists(cache_keys_file_path):
+                try:
+                    with open(cache_keys_file_path, 'r', encoding='utf-8') as f:
+                        self.cached_files = json.load(f)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logger.warning(
+                        "Failed to load cache file %s, it may be in an old format. "
+                        "Resetting cache index.", cache_keys_file_path)
+                    self.cached_files = []
+            self._replay_journal()
+
+    def _replay_journal(self):
+        journal_file_path = os.path.join(self.cache_root_location,
+                                         FileSystemCache.KEY_JOURNAL_FILE_NAME)
+        if not os.path.exists(journal_file_path):
+            return
+        with open(journal_file_path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    op, key = entry['op'], entry['key']
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    # a torn line left by a crash while appending, the file it refers to is downloaded again
+                    logger.warning("Ignoring invalid cache journal entry in %s", journal_file_path)
+                    continue
+                if op == 'put':
+                    self._add_key(key)
+                elif op == 'del':
+                    self._discard_key(key)
+                self._journal_entries += 1
+
+    def _record(self, op: str, key: Dict):
+        """Queue an index change for the journal, pending changes are group committed."""
+        self._pending.append(json.dumps({'op': op, 'key': key}, ensure_ascii=False))
+        if (len(self._pending) >= CACHE_INDEX_FLUSH_ENTRIES
+                or time.monotonic() - self._last_flush >= CACHE_INDEX_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Append pending index changes to the journal, compact it into `.msc` once it grows too long."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            journal_file_path = os.path.join(self.cache_root_location,
+                                             FileSystemCache.KEY_JOURNAL_FILE_NAME)
+            with open(journal_file_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(line + '\n' for line in self._pending))
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_entries += len(self._pending)
+            self._pending = []
+            if self._journal_entries >= CACHE_INDEX_COMPACT_ENTRIES:
+                self.save_cached_files()
+
+    def close(self):
+        """Flush pending index changes, call it once the download is finished."""
+        self.flush()
 
     def save_cached_files(self):
         """Save cache metadata."""
-        cache_keys_file_path = os.path.join(self.cache_root_location,
-                                            FileSystemCache.KEY_FILE_NAME)
-        fd, fn = tempfile.mkstemp()
-        with open(fd, 'w', encoding='utf-8') as f:
-            json.dump(self.cached_files, f, ensure_ascii=False)
-        move(fn, cache_keys_file_path)
+        with self._lock:
+            cache_keys_file_path = os.path.join(self.cache_root_location,
+                                                FileSystemCache.KEY_FILE_NAME)
+            # same directory as the index so that the rename is atomic
+            fd, fn = tempfile.mkstemp(dir=self.cache_root_location, prefix=FileSystemCache.KEY_FILE_NAME)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.cached_files, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(fn, cache_keys_file_path)
+            # the snapshot covers every journaled change, replaying a journal left by a crash here is harmless
+            journal_file_path = os.path.join(self.cache_root_location,
+                                             FileSystemCache.KEY_JOURNAL_FILE_NAME)
+            if os.path.exists(journal_file_path):
+                os.remove(journal_file_path)
+            self._pending = []
+            self._journal_entries = 0
 
     def get_file(self, key):
         """Check the key is in the cache, if exist, return the file, otherwise return None.
@@ -86,16 +296,23 @@ class FileSystemCache(object):
         Args:
             key (dict): The cache key.
         """
-        if key in self.cached_files:
-            self.cached_files.remove(key)
-            self.save_cached_files()
+        with self._lock:
+            if self._discard_key(key):
+                self._record('del', key)
+
+    def _discard_key(self, key: Dict) -> bool:
+        revisions = self._index.get(key.get('Path'))
+        if revisions is not None and revisions.get(key.get('Revision')) == key:
+            del revisions[key.get('Revision')]
+            if not revisions:
+                del self._index[key['Path']]
+            return True
+        return False
 
     def exists(self, key):
-        for cache_file in self.cached_files:
-            if cache_file == key:
-                return True
-
-        return False
+        with self._lock:
+            revisions = self._index.get(key.get('Path'))
+            return revisions is not None and revisions.get(key.get('Revision')) == key
 
     def clear_cache(self):
         """Remove all files and metadata from the cache
@@ -111,8 +328,20 @@ class FileSystemCache(object):
 
 class ModelFileSystemCache(FileSystemCache):
     """Local cache file layout
+       cache_root/blobs/<sha256>: file contents shared by all repos and revisions
+       cache_root/owner/model_name/snapshots/<commit id>/individual cached files linked to the blobs
+       cache_root/owner/model_name/refs/<branch or tag>: the commit id the revision resolved to when last downloaded
        cache_root/owner/model_name/individual cached files and cache index file '.mcs'
-       Save only one version for each file.
+       Save only one version for each file in the model dir (or local_dir), other revisions are
+       restored from their snapshot without downloading.
+
+       Snapshot files and the files of the model dir (or local_dir) are reflinked to the blobs when the file
+       system supports it, otherwise hardlinked or symlinked, so a file of the cache is stored once. Linked files
+       share the blob with every repo and revision that has the same content: they must not be modified in
+       place, replace them with a new file instead.
+
+       When a branch or tag moves to a new commit, the snapshot of its previous commit is removed with the
+       blobs no other snapshot links, see `save_ref`. `remove_snapshot` removes any other revision.
     """
 
     def __init__(self, cache_root, owner=None, name=None, local_dir: Union[str, None] = None):
@@ -140,6 +369,7 @@ class ModelFileSystemCache(FileSystemCache):
             self.save_model_meta()
         self.cached_model_revision = self.load_model_version()
         self.local_dir = local_dir
+        self.blobs_location = os.path.join(cache_root, FileSystemCache.BLOBS_DIR_NAME)
 
     def get_root_location(self):
         if self.local_dir is not None:
@@ -197,14 +427,13 @@ class ModelFileSystemCache(FileSystemCache):
         Returns:
             path: the full path of the file.
         """
-        for cached_file in self.cached_files:
-            if file_path == cached_file['Path']:
-                cached_file_path = os.path.join(self.cache_root_location,
-                                                cached_file['Path'])
-                if os.path.exists(cached_file_path):
-                    return cached_file_path
-                else:
-                    self.remove_key(cached_file)
+        for cached_file in list(self._index.get(file_path, {}).values()):
+            cached_file_path = os.path.join(self.cache_root_location,
+                                            cached_file['Path'])
+            if os.path.exists(cached_file_path):
+                return cached_file_path
+            else:
+                self.remove_key(cached_file)
 
         return None
 
@@ -218,15 +447,14 @@ class ModelFileSystemCache(FileSystemCache):
         Returns:
             path: the full path of the file.
         """
-        for cached_file in self.cached_files:
-            if file_path == cached_file['Path'] and \
-               (cached_file['Revision'].startswith(commit_id) or commit_id.startswith(cached_file['Revision'])):
-                cached_file_path = os.path.join(self.cache_root_location,
-                                                cached_file['Path'])
-                if os.path.exists(cached_file_path):
-                    return cached_file_path
-                else:
-                    self.remove_key(cached_file)
+        cached_file = self._find_key(file_path, commit_id)
+        if cached_file is not None:
+            cached_file_path = os.path.join(self.cache_root_location,
+                                            cached_file['Path'])
+            if os.path.exists(cached_file_path):
+                return cached_file_path
+            else:
+                self.remove_key(cached_file)
 
         return None
 
@@ -240,15 +468,13 @@ class ModelFileSystemCache(FileSystemCache):
             str: The file path.
         """
         cache_key = self.__get_cache_key(model_file_info)
-        for cached_file in self.cached_files:
-            if cached_file == cache_key:
-                orig_path = os.path.join(self.cache_root_location,
-                                         cached_file['Path'])
-                if os.path.exists(orig_path):
-                    return orig_path
-                else:
-                    self.remove_key(cached_file)
-                    break
+        if super().exists(cache_key):
+            orig_path = os.path.join(self.cache_root_location,
+                                     cache_key['Path'])
+            if os.path.exists(orig_path):
+                return orig_path
+            else:
+                self.remove_key(cache_key)
 
         return None
 
@@ -259,9 +485,75 @@ class ModelFileSystemCache(FileSystemCache):
         }
         return cache_key
 
+    def get_blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blobs_location, sha256)
+
+    def get_ref(self, revision: str) -> Optional[str]:
+        """The commit id a branch or tag resolved to when it was last downloaded.
+
+        Args:
+            revision (str): The branch or tag name.
+
+        Returns:
+            str: The commit id, None if the revision was never downloaded.
+        """
+        ref_path = os.path.join(self.cache_root_location, FileSystemCache.REFS_DIR_NAME, revision.replace('/', '--'))
+        if not os.path.exists(ref_path):
+            return None
+        with open(ref_path, 'r') as f:
+            return f.read().strip() or None
+
+    def save_ref(self, revision: str, commit_id: str) -> Optional[str]:
+        """Point a branch or tag to the commit id it resolved to.
+
+        Args:
+            revision (str): The branch or tag name.
+            commit_id (str): The commit id of the downloaded snapshot.
+
+        The snapshot the revision pointed to before is removed, with the blobs no other snapshot links, unless
+        another branch or tag still points to it. Snapshots downloaded by commit id have no ref and are kept.
+
+        Returns:
+            str: The commit id the revision pointed to before, None if there was none.
+        """
+        previous = self.get_ref(revision)
+        if previous == commit_id:
+            return previous
+        refs_location = os.path.join(self.cache_root_location, FileSystemCache.REFS_DIR_NAME)
+        os.makedirs(refs_location, exist_ok=True)
+        fd, fn = tempfile.mkstemp(dir=refs_location, prefix='.ref')
+        with open(fd, 'w') as f:
+            f.write(commit_id)
+        os.replace(fn, os.path.join(refs_location, revision.replace('/', '--')))
+        if previous is not None and previous not in self.__ref_commit_ids():
+            self.remove_snapshot(previous)
+        return previous
+
+    def __ref_commit_ids(self) -> Set[str]:
+        refs_location = os.path.join(self.cache_root_location, FileSystemCache.REFS_DIR_NAME)
+        commit_ids = set()
+        with os.scandir(refs_location) as entries:
+            for entry in entries:
+                if not entry.name.startswith('.ref'):
+                    commit_ids.add(self.get_ref(entry.name))
+        return commit_ids
+
+    def get_snapshot_path(self, model_file_info) -> str:
+        """The snapshot of a file, the revision of model_file_info must be a commit id, not a branch."""
+        revision = model_file_info['Revision'].replace('/', '--')
+        return os.path.join(self.cache_root_location, FileSystemCache.SNAPSHOTS_DIR_NAME,
+                            revision, model_file_info['Path'])
+
+    def __get_file_path(self, model_file_info) -> str:
+        if self.local_dir is not None:
+            return os.path.join(self.local_dir, model_file_info['Path'])
+        return os.path.join(self.cache_root_location, model_file_info['Path'])
+
     def exists(self, model_file_info):
         """Check the file is cached or not.
 
+        A file of another revision is restored from the snapshot of the requested revision if there is one.
+
         Args:
             model_file_info (CachedFileInfo): The cached file info
 
@@ -269,22 +561,77 @@ class ModelFileSystemCache(FileSystemCache):
             bool: If exists return True otherwise False
         """
         key = self.__get_cache_key(model_file_info)
-        is_exists = False
-        for cached_key in self.cached_files:
-            if cached_key['Path'] == key['Path'] and (
-                    cached_key['Revision'].startswith(key['Revision'])
-                    or key['Revision'].startswith(cached_key['Revision'])):
-                is_exists = True
-                break
-        file_path = os.path.join(self.cache_root_location, model_file_info['Path'])
-        if self.local_dir is not None:
-            file_path = os.path.join(self.local_dir, model_file_info['Path'])
+        is_exists = self._find_key(key['Path'], key['Revision']) is not None
+        file_path = self.__get_file_path(model_file_info)
         if is_exists:
             if os.path.exists(file_path):
                 return True
             else:
                 self.remove_key(model_file_info)  # someone may manual delete the file
-        return False
+        return self.__restore_from_snapshot(model_file_info)
+
+    def is_available(self, model_file_info, sha256: Optional[str] = None) -> bool:
+        """Check the file would be found by `exists` or `put_file_from_blob`, without restoring or linking it.
+
+        Args:
+            model_file_info (CachedFileInfo): The cached file info
+            sha256 (str, optional): The sha256 (LFS oid) of the file content.
+
+        Returns:
+            bool: True if the file does not have to be downloaded.
+        """
+        key = self.__get_cache_key(model_file_info)
+        if (self._find_key(key['Path'], key['Revision']) is not None
+                and os.path.exists(self.__get_file_path(model_file_info))):
+            return True
+        if os.path.exists(self.get_snapshot_path(model_file_info)):
+            return True
+        return sha256 is not None and os.path.exists(self.get_blob_path(sha256))
+
+    def remove_snapshot(self, revision: str) -> int:
+        """Remove the snapshot of revision and prune the blobs it was the last one to link.
+
+        Args:
+            revision (str): The commit id of the snapshot.
+
+        Returns:
+            int: The number of removed blobs.
+        """
+        snapshot_location = os.path.join(self.cache_root_location, FileSystemCache.SNAPSHOTS_DIR_NAME,
+                                         revision.replace('/', '--'))
+        if os.path.isdir(snapshot_location):
+            rmtree(snapshot_location)
+        return prune_blobs(os.path.dirname(self.blobs_location))
+
+    def __restore_from_snapshot(self, model_file_info) -> bool:
+        snapshot_path = self.get_snapshot_path(model_file_info)
+        if not os.path.exists(snapshot_path):
+            return False
+        self.remove_if_exists(model_file_info)
+        link_blob(os.path.realpath(snapshot_path), self.__get_file_path(model_file_info))
+        cache_key = self.__get_cache_key(model_file_info)
+        with self._lock:
+            self._add_key(cache_key)
+            self._record('put', cache_key)
+        return True
+
+    def put_blob(self, location: str, sha256: str) -> str:
+        """Move a file into the blob store, it is dropped if the blob is already there.
+
+        Args:
+            location (str): The file to store.
+            sha256 (str): The sha256 of the file.
+
+        Returns:
+            str: The path of the blob.
+        """
+        blob_path = self.get_blob_path(sha256)
+        if os.path.exists(blob_path):
+            os.remove(location)
+        else:
+            os.makedirs(self.blobs_location, exist_ok=True)
+            move(location, blob_path)
+        return blob_path
 
     def remove_if_exists(self, model_file_info):
         """We in cache, remove it.
@@ -292,36 +639,58 @@ class ModelFileSystemCache(FileSystemCache):
         Args:
             model_file_info (ModelFileInfo): The model file information from server.
         """
-        for cached_file in self.cached_files:
-            if cached_file['Path'] == model_file_info['Path']:
-                self.remove_key(cached_file)
-                file_path = os.path.join(self.cache_root_location, cached_file['Path'])
-                if self.local_dir is not None:
-                    file_path = os.path.join(self.local_dir, cached_file['Path'])
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                break
-
-    def put_file(self, model_file_info, model_file_location):
+        cached_file = self._find_key(model_file_info['Path'])
+        if cached_file is not None:
+            self.remove_key(cached_file)
+            file_path = self.__get_file_path(cached_file)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def put_file(self, model_file_info, model_file_location, sha256: Optional[str] = None):
         """Put model on model_file_location to cache, the model first download to /tmp, and move to cache.
 
+        The content is moved to the blob store, then linked into the revision snapshot and the model dir.
+
         Args:
             model_file_info (str): The file description returned by get_model_files.
             model_file_location (str): The location of the temporary file.
+            sha256 (str, optional): The sha256 of the file, computed from the file if not given.
 
         Returns:
             str: The location of the cached file.
         """
-        self.remove_if_exists(model_file_info)
-        cache_key = self.__get_cache_key(model_file_info)  
-        cache_full_path = os.path.join(self.cache_root_location, cache_key['Path'])
-        if self.local_dir is not None:
-            cache_full_path = os.path.join(self.local_dir, cache_key['Path'])
-        cache_file_dir = os.path.dirname(cache_full_path)
-        if not os.path.exists(cache_file_dir):
-            os.makedirs(cache_file_dir, exist_ok=True)
+        if sha256 is None:
+            sha256 = compute_hash(model_file_location)
         # We can't make operation transaction
-        move(model_file_location, cache_full_path)
-        self.cached_files.append(cache_key)
-        self.save_cached_files()
+        blob_path = self.put_blob(model_file_location, sha256)
+        return self.__link_file(model_file_info, blob_path)
+
+    def put_file_from_blob(self, model_file_info, sha256: str) -> Optional[str]:
+        """Put a file to cache from an existing blob of any repo or revision, without downloading it.
+
+        Args:
+            model_file_info (str): The file description returned by get_model_files.
+            sha256 (str): The sha256 (LFS oid) of the file content.
+
+        Returns:
+            str: The location of the cached file, None if the content is not in the blob store.
+        """
+        blob_path = self.get_blob_path(sha256)
+        if not os.path.exists(blob_path):
+            return None
+        try:
+            return self.__link_file(model_file_info, blob_path)
+        except FileNotFoundError:
+            # pruned since the check above
+            return None
+
+    def __link_file(self, model_file_info, blob_path: str) -> str:
+        self.remove_if_exists(model_file_info)
+        cache_key = self.__get_cache_key(model_file_info)
+        cache_full_path = self.__get_file_path(cache_key)
+        link_blob(blob_path, self.get_snapshot_path(cache_key))
+        link_blob(blob_path, cache_full_path)
+        with self._lock:
+            self._add_key(cache_key)
+            self._record('put', cache_key)
         return cache_full_path
\ No newline at end of file
@@ -22,6 +22,7 @@ from pycsghub.cmd.repo_types import RepoType
 from pycsghub.constants import DEFAULT_CSGHUB_DOMAIN, DEFAULT_REVISION, REPO_SOURCE_CSG
 from pycsghub.api_client import get_csghub_api
 from .utils import print_download_result, disable_xnet
+from .bandwidth import set_bandwidth_limit, set_max_connections_per_host
 from .lfs import LfsEnableCommand, LfsUploadCommand
 from .upload_large_folder.main import upload_large_folder_internal
 
@@ -63,6 +64,12 @@ OPTIONS = {
                                        help="Show what would be downloaded or uploaded without performing actions."),
     "force_download"    : typer.Option("--force-download", help="Download even if files are already cached."),
     "max_workers"       : typer.Option("-mw", "--max-workers", help="Maximum workers used for downloading."),
+    "max_bandwidth"     : typer.Option("--max-bandwidth",
+                                       help="Bytes per second shared by all transfers (e.g. 50M). "
+                                            "Defaults to $CSGHUB_BANDWIDTH_LIMIT, unlimited if unset."),
+    "max_connections_per_host": typer.Option("--max-connections-per-host",
+                                             help="Concurrent transfer requests per host. "
+                                                  "Defaults to $CSGHUB_MAX_CONNECTIONS_PER_HOST, unlimited if unset."),
     "version"           : typer.Option(None, "-V", "--version", callback=version_callback, is_eager=True,
                                        help="Show the version and exit."),
     "limit"             : typer.Option("--limit", help="Number of items to list"),
@@ -93,6 +100,15 @@ OPTIONS = {
     ),
 }
 
+def _set_transfer_limits(max_bandwidth: Optional[str], max_connections_per_host: Optional[int]):
+    if max_bandwidth is not None:
+        try:
+            set_bandwidth_limit(max_bandwidth)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--max-bandwidth")
+    if max_connections_per_host is not None:
+        set_max_connections_per_host(max_connections_per_host)
+
 @app.command(name="download", help="Download model/dataset/space/code/mcp from OpenCSG Hub", no_args_is_help=True)
 def download(
     repo_id: Annotated[str, OPTIONS["repoID"]],
@@ -115,7 +131,10 @@ def download(
     dry_run: Annotated[Optional[bool], OPTIONS["dry_run"]] = False,
     force_download: Annotated[Optional[bool], OPTIONS["force_download"]] = False,
     max_workers: Annotated[Optional[int], OPTIONS["max_workers"]] = 8,
+    max_bandwidth: Annotated[Optional[str], OPTIONS["max_bandwidth"]] = None,
+    max_connections_per_host: Annotated[Optional[int], OPTIONS["max_connections_per_host"]] = None,
 ):
+    _set_transfer_limits(max_bandwidth, max_connections_per_host)
     api = get_csghub_api(repo_type=repo_type, token=token, endpoint=endpoint)
     
     # Handle single/multiple file args similar to HF
@@ -320,7 +339,10 @@ def upload_large_folder(
     num_workers: Annotated[int, OPTIONS["num_workers"]] = None,
     print_report: Annotated[bool, OPTIONS["print_report"]] = False,
     print_report_every: Annotated[int, OPTIONS["print_report_every"]] = 60,
+    max_bandwidth: Annotated[Optional[str], OPTIONS["max_bandwidth"]] = None,
+    max_connections_per_host: Annotated[Optional[int], OPTIONS["max_connections_per_host"]] = None,
 ):
+    _set_transfer_limits(max_bandwidth, max_connections_per_host)
     upload_large_folder_internal(
         repo_id=repo_id,
         local_path=local_path,
@@ -1,6 +1,6 @@
-import requests
 from pycsghub.utils import (build_csg_headers,
-                            get_endpoint)
+                            get_endpoint,
+                            get_session)
 
 def list(
     user_name: str,
@@ -16,7 +16,7 @@ def list(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.get(url, params=data, headers=headers)
+    response = get_session(action_endpoint).get(url, params=data, headers=headers)
     response.raise_for_status()
     instances = response.json()['data']
     print(f"{'ID':<10}{'Name':<40}{'Model':<50}{'Status':<10}")
@@ -39,7 +39,7 @@ def start(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.put(url, headers=headers)
+    response = get_session(action_endpoint).put(url, headers=headers)
     result = response.json()
     print(result)
 
@@ -54,6 +54,6 @@ def stop(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.put(url, headers=headers)
+    response = get_session(action_endpoint).put(url, headers=headers)
     result = response.json()
     print(result)
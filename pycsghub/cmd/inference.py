@@ -1,6 +1,6 @@
-import requests
 from pycsghub.utils import (build_csg_headers,
-                            get_endpoint)
+                            get_endpoint,
+                            get_session)
 
 
 def list(
@@ -18,7 +18,7 @@ def list(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.get(url, params=data, headers=headers)
+    response = get_session(action_endpoint).get(url, params=data, headers=headers)
     response.raise_for_status()
     instances = response.json()['data']
     print(f"{'ID':<10}{'Name':<40}{'Model':<50}{'Status':<10}")
@@ -41,7 +41,7 @@ def detail(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.get(url, headers=headers)
+    response = get_session(action_endpoint).get(url, headers=headers)
     response.raise_for_status()
     return response.status_code
 
@@ -57,7 +57,7 @@ def start(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.put(url, headers=headers)
+    response = get_session(action_endpoint).put(url, headers=headers)
     result = response.json()
     print(result)
 
@@ -72,6 +72,6 @@ def stop(
     headers = build_csg_headers(token=token, headers={
         "Content-Type": "application/json"
     })
-    response = requests.put(url, headers=headers)
+    response = get_session(action_endpoint).put(url, headers=headers)
     result = response.json()
     print(result)
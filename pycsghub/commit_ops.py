@@ -1,8 +1,13 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Union, List
+from typing import Iterator, Optional, Union, List, Tuple
 import base64
+import json
+import os
+
+# multiple of 3 bytes, so that every chunk is base64 encoded without padding
+COMMIT_CONTENT_CHUNK_SIZE = 3 * 256 * 1024
 
 
 @dataclass
@@ -25,22 +30,85 @@ def to_base64_content(path_or_fileobj: Union[str, Path, bytes]) -> str:
     return base64.b64encode(data).decode('utf-8')
 
 
-def build_payload(operations: List[Union[CommitOperationAdd, CommitOperationDelete]], commit_message: str) -> dict:
+class CommitBody:
+    """JSON body of a commit request, streamed with the content of the added files base64 encoded chunk by chunk.
+
+    The body is `{"message": ..., "files": [{"path": ..., "action": ..., "content": ...}, ...]}`, `content` is
+    only sent for files with a content: a path, read while the body is sent, or bytes. Only one chunk of one file
+    is held in memory at a time. The length is known upfront so the body is sent with a Content-Length, and it is
+    iterated again when the request is retried.
+    """
+
+    def __init__(self, message: str, files: List[Tuple[str, str, Optional[Union[str, Path, bytes]]]]):
+        """
+        Args:
+            message (str): The commit message.
+            files (List[Tuple[str, str, Optional[Union[str, Path, bytes]]]]): (path in repo, action, content) of the
+                files of the commit, `None` content for deletions.
+        """
+        self.message = message
+        self.files = files
+        # file contents are sent with the size they have now, so that the body matches its Content-Length
+        self._sizes = [
+            None if content is None else
+            os.path.getsize(content) if isinstance(content, (str, Path)) else len(content)
+            for _, _, content in files
+        ]
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self._json_parts()) + sum(
+            4 * ((size + 2) // 3) for size in self._sizes if size is not None)
+
+    def __iter__(self) -> Iterator[bytes]:
+        parts = iter(self._json_parts())
+        yield next(parts)
+        for (_, _, content), size in zip(self.files, self._sizes):
+            if size is not None:
+                yield from _iter_base64(content, size)
+                yield next(parts)
+
+    def _json_parts(self) -> List[bytes]:
+        # the json around the file contents, the contents go after each part but the last one
+        parts = []
+        current = '{"message": %s, "files": [' % json.dumps(self.message)
+        for i, (path, action, content) in enumerate(self.files):
+            current += '%s{"path": %s, "action": %s' % (', ' if i else '', json.dumps(path), json.dumps(action))
+            if content is None:
+                current += '}'
+            else:
+                parts.append((current + ', "content": "').encode('utf-8'))
+                current = '"}'
+        parts.append((current + ']}').encode('utf-8'))
+        return parts
+
+
+def _iter_base64(content: Union[str, Path, bytes], size: int) -> Iterator[bytes]:
+    if not isinstance(content, (str, Path)):
+        for offset in range(0, size, COMMIT_CONTENT_CHUNK_SIZE):
+            yield base64.b64encode(content[offset:offset + COMMIT_CONTENT_CHUNK_SIZE])
+        return
+    with open(content, 'rb') as f:
+        remaining = size
+        while remaining > 0:
+            chunk = f.read(min(COMMIT_CONTENT_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"file {content} was truncated while being committed")
+            remaining -= len(chunk)
+            yield base64.b64encode(chunk)
+
+
+def build_payload(
+    operations: List[Union[CommitOperationAdd, CommitOperationDelete]],
+    commit_message: str,
+) -> CommitBody:
+    """Build the streamed commit request body of `operations`, see `CommitBody`.
+
+    It returns a `CommitBody` instead of the dict returned before: send it as the request `data`, not `json`.
+    """
     files = []
     for op in operations:
         if isinstance(op, CommitOperationAdd):
-            files.append({
-                'path': op.path_in_repo,
-                'action': 'create',
-                'content': to_base64_content(op.path_or_fileobj),
-            })
+            files.append((op.path_in_repo, 'create', op.path_or_fileobj))
         else:
-            files.append({
-                'path': op.path_in_repo,
-                'action': 'delete',
-            })
-    return {
-        'message': commit_message,
-        'files': files,
-    }
-
+            files.append((op.path_in_repo, 'delete', None))
+    return CommitBody(message=commit_message, files=files)
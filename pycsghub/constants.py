@@ -1,7 +1,54 @@
+import logging
 import os
+
+
+def _env_int(name: str, default: str) -> int:
+    """Integer environment variable, a malformed value falls back to the default instead of failing the import."""
+    value = os.environ.get(name, default)
+    try:
+        return int(value)
+    except ValueError:
+        logging.getLogger(__name__).warning("ignored invalid %s=%r, using %s", name, value, default)
+        return int(default)
+
+
 API_FILE_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 API_FILE_DOWNLOAD_TIMEOUT = 5
 API_FILE_DOWNLOAD_RETRY_TIMES = 5
+# files larger than one segment are fetched as parallel byte ranges when the server supports it
+API_FILE_DOWNLOAD_SEGMENT_SIZE = 64 * 1024 * 1024
+API_FILE_DOWNLOAD_MAX_CONNECTIONS = 4
+API_FILE_DOWNLOAD_MAX_WORKERS = 8
+# interrupted downloads are resumed from '<resume dir>/<sha256 of url>.incomplete' and its '.json' sidecar
+API_FILE_DOWNLOAD_RESUME_DIR_NAME = '.incomplete'
+API_FILE_DOWNLOAD_STATE_SAVE_INTERVAL = 1.0
+# in-flight files of the asyncio download backend
+API_ASYNC_DOWNLOAD_CONCURRENCY = 256
+
+DOWNLOAD_BACKEND_THREAD = "thread"
+DOWNLOAD_BACKEND_ASYNC = "async"
+
+# bytes per second shared by all transfers of the process (e.g. 50M), and concurrent transfer requests per host,
+# see pycsghub.bandwidth
+BANDWIDTH_LIMIT = os.environ.get('CSGHUB_BANDWIDTH_LIMIT')
+MAX_CONNECTIONS_PER_HOST = _env_int('CSGHUB_MAX_CONNECTIONS_PER_HOST', '0')
+
+# changes to the cache index are appended to a journal in groups, and compacted into the index file
+CACHE_INDEX_FLUSH_ENTRIES = 64
+CACHE_INDEX_FLUSH_INTERVAL = 1.0
+CACHE_INDEX_COMPACT_ENTRIES = 4096
+# seconds a blob is kept after it was stored or linked even if no snapshot links it, a concurrent download may link it
+CACHE_BLOB_PRUNE_GRACE = 600
+
+# user level sha256/git-sha1 cache of local files keyed by device, inode, size and mtime, see pycsghub.hash_cache,
+# defaults to '<default cache dir>/hashes.sqlite'
+HASH_CACHE_PATH = os.environ.get('CSGHUB_HASH_CACHE')
+HASH_CACHE_FILE_NAME = 'hashes.sqlite'
+
+# pooled http sessions shared by all hub requests, see utils.get_session
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = _env_int('CSGHUB_HTTP_POOL_MAXSIZE', '32')
+HTTP_RETRY_TIMES = 3
 
 REPO_TYPE_DATASET = "dataset"
 REPO_TYPE_MODEL = "model"
@@ -101,3 +148,6 @@ GIT_HIDDEN_DIR = ".git"
 GIT_ATTRIBUTES_FILE = ".gitattributes"
 
 LFS_MULTIPART_UPLOAD_COMMAND = "lfs-multipart-upload"
+# concurrent part uploads of one object in the git-lfs multipart transfer agent
+LFS_UPLOAD_PART_WORKERS = _env_int('CSGHUB_LFS_UPLOAD_PART_WORKERS', '8')
+LFS_UPLOAD_PART_RETRY_TIMES = 4
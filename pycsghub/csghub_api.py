@@ -1,7 +1,7 @@
 import logging
-from typing import Dict
-from pycsghub.utils import (build_csg_headers, get_endpoint, model_id_to_group_owner_name)
-import requests
+from typing import Dict, Union
+from pycsghub.commit_ops import CommitBody
+from pycsghub.utils import (build_csg_headers, get_endpoint, get_session, model_id_to_group_owner_name)
 import base64
 from pycsghub.constants import GIT_ATTRIBUTES_CONTENT, DEFAULT_REVISION, DEFAULT_LICENCE, REPO_TYPE_SPACE
 
@@ -31,7 +31,7 @@ class CsgHubApi:
         action_endpoint = get_endpoint(endpoint=endpoint)
         req_headers = build_csg_headers(token=token)
         fetch_url = f"{action_endpoint}/api/v1/{repo_type}s/{repo_id}/preupload/{revision}"
-        response = requests.post(fetch_url, headers=req_headers, json=payload)
+        response = get_session(action_endpoint).post(fetch_url, headers=req_headers, json=payload)
         if response.status_code != 200:
             logger.error(f"fetch upload modes from {fetch_url} response: {response.text}")
         response.raise_for_status()
@@ -58,7 +58,7 @@ class CsgHubApi:
         req_headers = build_csg_headers(token=token)
         batch_url = f"{action_endpoint}/{repo_type}s/{repo_id}.git/info/lfs/objects/batch"
         params = {"upload_id": upload_id}
-        response = requests.post(batch_url, headers=req_headers, params=params, json=payload)
+        response = get_session(action_endpoint).post(batch_url, headers=req_headers, params=params, json=payload)
         if response.status_code != 200:
             logger.error(f"fetch LFS {local_file} batch info from {batch_url} response: {response.text}")
         response.raise_for_status()
@@ -69,7 +69,7 @@ class CsgHubApi:
     
     def create_commit(
         self,
-        payload: Dict,
+        payload: Union[Dict, CommitBody],
         repo_id: str,
         repo_type: str,
         revision: str,
@@ -81,11 +81,17 @@ class CsgHubApi:
     ):
         """
         Creates a commit in the given repo, deleting & uploading files as needed.
+
+        A `CommitBody` payload is streamed, the file contents are read and encoded while the request is sent.
         """
         action_endpoint = get_endpoint(endpoint=endpoint)
         req_headers = build_csg_headers(token=token)
         commit_url = f"{action_endpoint}/api/v1/{repo_type}s/{repo_id}/commit/{revision}"
-        response = requests.post(url=commit_url, headers=req_headers, json=payload)
+        if isinstance(payload, CommitBody):
+            req_headers = build_csg_headers(token=token, headers={"Content-Type": "application/json"})
+            response = get_session(action_endpoint).post(url=commit_url, headers=req_headers, data=payload)
+        else:
+            response = get_session(action_endpoint).post(url=commit_url, headers=req_headers, json=payload)
         if response.status_code != 200:
             logger.error(f"create files commit on {commit_url} response: {response.text}")
         response.raise_for_status()
@@ -110,7 +116,7 @@ class CsgHubApi:
             "Content-Type": "application/json"
         })
         action_url = f"{action_endpoint}/api/v1/{repo_type}s/{repo_id}/branches"
-        response = requests.get(action_url, headers=req_headers)
+        response = get_session(action_endpoint).get(action_url, headers=req_headers)
         logger.debug(f"fetch {repo_type} {repo_id} branches on {action_url} response: {response.text}")
         
         if response.status_code != 200:
@@ -151,7 +157,7 @@ class CsgHubApi:
             "content": GIT_ATTRIBUTES_CONTENT_BASE64
         }
         
-        response = requests.post(action_url, json=data, headers=req_headers)
+        response = get_session(action_endpoint).post(action_url, json=data, headers=req_headers)
         if response.status_code != 200:
             logger.error(f"create new branch {revision} for {repo_type} {repo_id} on {action_endpoint} response: {response.text}")
         response.raise_for_status()
@@ -195,7 +201,7 @@ class CsgHubApi:
             else:
                 raise ValueError(f"no any space resource found for create {repo_type} {repo_id}")
         
-        response = requests.post(action_url, json=data, headers=req_headers)
+        response = get_session(action_endpoint).post(action_url, json=data, headers=req_headers)
         if response.status_code != 200:
             logger.error(f"create new {repo_type} {repo_id} on {action_endpoint} response: {response.text}")
         response.raise_for_status()
@@ -217,7 +223,7 @@ class CsgHubApi:
         }
         action_url = f"{action_endpoint}/api/v1/space_resources"
         params = {"deploy_type": "0"}
-        response = requests.get(action_url, params=params, headers=req_headers)
+        response = get_session(action_endpoint).get(action_url, params=params, headers=req_headers)
         if response.status_code != 200:
             logger.error(f"query space resources on {action_endpoint} response: {response.text}")
         response.raise_for_status()
@@ -1,28 +1,47 @@
+import asyncio
+import hashlib
+import json
+import re
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import partial
 from http.cookiejar import CookieJar
 from pathlib import Path
-from typing import Optional, Union, List, Dict
+from typing import Optional, Union, List, Dict, Tuple
+import httpx
 import requests
 from huggingface_hub.utils import filter_repo_objects
 from requests.adapters import Retry
 from tqdm import tqdm
 from pycsghub import utils
+from pycsghub.bandwidth import ahost_connection, athrottle, host_connection, throttle
 from pycsghub.cache import ModelFileSystemCache
 from pycsghub.utils import (build_csg_headers,
                             get_cache_dir,
                             model_id_to_group_owner_name,
                             pack_repo_file_info,
                             get_file_download_url,
-                            get_endpoint)
+                            get_endpoint,
+                            get_repo_file_sha256s, get_repo_file_sizes,
+                            get_session)
 from pycsghub.constants import (API_FILE_DOWNLOAD_RETRY_TIMES,
                                 API_FILE_DOWNLOAD_TIMEOUT,
                                 API_FILE_DOWNLOAD_CHUNK_SIZE,
+                                API_FILE_DOWNLOAD_SEGMENT_SIZE,
+                                API_FILE_DOWNLOAD_MAX_CONNECTIONS,
+                                API_FILE_DOWNLOAD_RESUME_DIR_NAME,
+                                API_FILE_DOWNLOAD_STATE_SAVE_INTERVAL,
                                 DEFAULT_REVISION)
-from pycsghub.errors import FileDownloadError
+from pycsghub.errors import FileDownloadError, FileIntegrityError
 import os
 from pycsghub.errors import InvalidParameter
 from pycsghub.errors import NotSupportError
+from pycsghub.upload_large_folder.fixes import WeakFileLock
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 def try_to_load_from_cache():
@@ -60,6 +79,9 @@ def file_download(
         dry_run: Optional[bool] = False,
         force_download: Optional[bool] = False,
         quiet: Optional[bool] = False,
+        segment_size: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        verify: Optional[bool] = False,
 ) -> str:
     if cache_dir is None:
         cache_dir = get_cache_dir(repo_type=repo_type)
@@ -100,6 +122,7 @@ def file_download(
         # todo need to add cookies？
         repo_info = utils.get_repo_info(repo_id=repo_id,
                                         revision=revision,
+                                        files_metadata=True,
                                         token=token,
                                         endpoint=download_endpoint,
                                         repo_type=repo_type,
@@ -117,33 +140,43 @@ def file_download(
         if file_name not in model_files:
             raise InvalidParameter('file {} not in repo {}'.format(file_name, repo_id))
 
-        with tempfile.TemporaryDirectory(dir=temporary_cache_dir) as temp_cache_dir:
-            repo_file_info = pack_repo_file_info(file_name, revision)
-            if force_download or not cache.exists(repo_file_info):
-                # get download url
-                url = get_file_download_url(
-                    repo_id=repo_id,
-                    file_path=file_name,
-                    revision=revision,
-                    endpoint=download_endpoint,
-                    repo_type=repo_type,
-                    source=source)
-                # todo support parallel download api
-                http_get(
-                    url=url,
-                    local_dir=temp_cache_dir,
-                    file_name=file_name,
-                    headers=headers,
-                    cookies=cookies,
-                    token=token,
-                    quiet=quiet)
-
-                # todo using hash to check file integrity
-                temp_file = os.path.join(temp_cache_dir, file_name)
-                cache.put_file(repo_file_info, temp_file)
-                print(f"Saved file to '{temp_file}'")
-            else:
-                print(f'File {file_name} already in {cache.get_root_location()}, skip downloading!')
+        try:
+            with tempfile.TemporaryDirectory(dir=temporary_cache_dir) as temp_cache_dir:
+                repo_file_info = pack_repo_file_info(file_name, repo_info.sha)
+                sha256 = get_repo_file_sha256s(repo_info).get(file_name)
+                if force_download or not (cache.exists(repo_file_info) or (
+                        sha256 is not None and cache.put_file_from_blob(repo_file_info, sha256))):
+                    # get download url
+                    url = get_file_download_url(
+                        repo_id=repo_id,
+                        file_path=file_name,
+                        revision=revision,
+                        endpoint=download_endpoint,
+                        repo_type=repo_type,
+                        source=source)
+                    file_sha256 = http_get(
+                        url=url,
+                        local_dir=temp_cache_dir,
+                        file_name=file_name,
+                        headers=headers,
+                        cookies=cookies,
+                        token=token,
+                        quiet=quiet,
+                        segment_size=segment_size,
+                        max_connections=max_connections,
+                        expected_sha256=sha256 if verify else None,
+                        resume_dir=temporary_cache_dir,
+                        expected_size=get_repo_file_sizes(repo_info).get(file_name) or None)
+
+                    temp_file = os.path.join(temp_cache_dir, file_name)
+                    cache.put_file(repo_file_info, temp_file, sha256=file_sha256)
+                    print(f"Saved file to '{temp_file}'")
+                else:
+                    print(f'File {file_name} already in {cache.get_root_location()}, skip downloading!')
+        finally:
+            cache.close()
+        if revision and revision != repo_info.sha:
+            cache.save_ref(revision, repo_info.sha)
         cache.save_model_version(revision_info={'Revision': revision})
         return os.path.join(cache.get_root_location(), file_name)
 
@@ -154,7 +187,12 @@ def http_get(*,
              headers: dict = None,
              cookies: CookieJar = None,
              token: str = None,
-             quiet: bool = False) -> None:
+             quiet: bool = False,
+             segment_size: Optional[int] = None,
+             max_connections: Optional[int] = None,
+             expected_sha256: Optional[str] = None,
+             resume_dir: Optional[str] = None,
+             expected_size: Optional[int] = None) -> str:
     '''
     download core API，using python request to download file to local cache dirs
     :param token: csghub token
@@ -163,12 +201,77 @@ def http_get(*,
     :param file_name: file name to download
     :param headers: http headers
     :param cookies: http cookies
-    :return: None
+    :param segment_size: bytes per range request when the file is downloaded in segments
+    :param max_connections: concurrent range requests per file, 1 disables segmented download
+    :param expected_sha256: the file is rejected if its sha256 differs, e.g. the LFS oid
+    :param resume_dir: dir of the `.incomplete` file of the url and its sidecar, an interrupted download is
+        resumed from them by the next call, even from another process. Defaults to `local_dir/.incomplete`
+    :param expected_size: size of the file if known, files of at most one segment are streamed without probing
+        the server for range support
+    :return: sha256 of the file, computed while downloading
     '''
-    tempfile_mgr = partial(tempfile.NamedTemporaryFile, mode='wb', dir=local_dir, delete=False)
     get_headers = build_csg_headers(token=token, headers=headers)
-    total_content_length = 0
-    with tempfile_mgr() as temp_file:
+    segment_size = segment_size or API_FILE_DOWNLOAD_SEGMENT_SIZE
+    max_connections = max_connections or API_FILE_DOWNLOAD_MAX_CONNECTIONS
+    resume_dir = resume_dir or os.path.join(local_dir, API_FILE_DOWNLOAD_RESUME_DIR_NAME)
+    os.makedirs(resume_dir, exist_ok=True)
+    incomplete_path = os.path.join(resume_dir, hashlib.sha256(url.encode()).hexdigest() + '.incomplete')
+    # a process downloading the same url holds the lock until the file is moved to local_dir
+    with WeakFileLock(incomplete_path + '.lock'):
+        state = _load_download_state(incomplete_path)
+        probe = None
+        # os.pwrite is not available on windows
+        if max_connections > 1 and hasattr(os, 'pwrite') and (expected_size is None or expected_size > segment_size):
+            probe = _probe_range_support(url=url, headers=get_headers, cookies=cookies)
+        if probe is not None and probe[0] > segment_size:
+            total_content_length, etag = probe
+            if state is None or state['size'] != total_content_length or state['etag'] != etag:
+                state = {'etag': etag, 'size': total_content_length, 'ranges': []}
+            file_sha256 = _http_get_segmented(url=url,
+                                              file_name=file_name,
+                                              headers=get_headers,
+                                              cookies=cookies,
+                                              quiet=quiet,
+                                              segment_size=segment_size,
+                                              max_connections=max_connections,
+                                              incomplete_path=incomplete_path,
+                                              state=state)
+        else:
+            file_sha256 = _http_get_stream(url=url,
+                                           file_name=file_name,
+                                           headers=get_headers,
+                                           cookies=cookies,
+                                           quiet=quiet,
+                                           incomplete_path=incomplete_path,
+                                           state=state)
+        _remove_download_state(incomplete_path)
+        _check_sha256(incomplete_path, file_name, file_sha256, expected_sha256)
+        # fix folder recursive issue
+        os.makedirs(os.path.dirname(os.path.join(local_dir, file_name)), exist_ok=True)
+        os.replace(incomplete_path, os.path.join(local_dir, file_name))
+    return file_sha256
+
+
+def _http_get_stream(*,
+                     url: str,
+                     file_name: str,
+                     headers: dict,
+                     cookies: CookieJar,
+                     quiet: bool,
+                     incomplete_path: str,
+                     state: Optional[dict]) -> str:
+    '''
+    download the file as a single stream appended to the incomplete file, the completed prefix recorded in the
+    sidecar is resumed with Range/If-Range
+    :return: sha256 of the file
+    '''
+    get_headers = dict(headers)
+    total_content_length = None
+    sha256 = _ResumableSha256()
+    with open(incomplete_path, 'a+b') as temp_file:
+        temp_file.seek(0)
+        temp_file.truncate(_covered_until(state['ranges'], 0) if state is not None else 0)
+        temp_file.seek(0, os.SEEK_END)
         # retry sleep 0.5s, 1s, 2s, 4s
         retry = Retry(total=API_FILE_DOWNLOAD_RETRY_TIMES, backoff_factor=1, allowed_methods=['GET'])
         while True:
@@ -176,52 +279,468 @@ def http_get(*,
                 downloaded_size = temp_file.tell()
                 if downloaded_size > 0:
                     get_headers['Range'] = 'bytes=%d-' % downloaded_size
-                r = requests.get(url, headers=get_headers, stream=True,
-                                 cookies=cookies, timeout=API_FILE_DOWNLOAD_TIMEOUT)
-                r.raise_for_status()
-                accept_ranges = r.headers.get('Accept-Ranges')
-                content_length = r.headers.get('Content-Length')
-                if accept_ranges == 'bytes':
-                    if downloaded_size == 0:
+                    if state is not None:
+                        # the server sends the whole file if it changed since the partial download
+                        get_headers['If-Range'] = state['etag']
+                with host_connection(url), get_session(url).get(url, headers=get_headers, stream=True, cookies=cookies,
+                                                                timeout=API_FILE_DOWNLOAD_TIMEOUT) as r:
+                    r.raise_for_status()
+                    if downloaded_size > 0 and r.status_code == 206:
+                        total_content_length = _parse_content_range_total(r.headers.get('Content-Range'))
+                    else:
+                        if downloaded_size > 0:
+                            temp_file.seek(0)
+                            temp_file.truncate(0)
+                            downloaded_size = temp_file.tell()
+                        content_length = r.headers.get('Content-Length')
                         total_content_length = int(content_length) if content_length is not None else None
-                else:
-                    if downloaded_size > 0:
-                        temp_file.truncate(0)
-                        downloaded_size = temp_file.tell()
-                    total_content_length = int(content_length) if content_length is not None else None
-
-                progress = None
-                if not quiet:
-                    progress = tqdm(
-                        unit='B',
-                        unit_scale=True,
-                        unit_divisor=1024,
-                        total=total_content_length,
-                        initial=downloaded_size,
-                        desc="Downloading {}".format(file_name),
-                    )
-                for chunk in r.iter_content(chunk_size=API_FILE_DOWNLOAD_CHUNK_SIZE):
-                    if chunk:
+                        etag = _strong_etag(r.headers.get('ETag'))
+                        state = {'etag': etag, 'size': total_content_length, 'ranges': []} if etag else None
+                    sha256.seek(temp_file, downloaded_size)
+
+                    progress = None
+                    if not quiet:
+                        progress = tqdm(
+                            unit='B',
+                            unit_scale=True,
+                            unit_divisor=1024,
+                            total=total_content_length,
+                            initial=downloaded_size,
+                            desc="Downloading {}".format(file_name),
+                        )
+                    last_save = time.monotonic()
+                    try:
+                        for chunk in r.iter_content(chunk_size=API_FILE_DOWNLOAD_CHUNK_SIZE):
+                            if chunk:
+                                if progress is not None:
+                                    progress.update(len(chunk))
+                                temp_file.write(chunk)
+                                sha256.update(chunk)
+                                throttle(len(chunk))
+                                if state is not None and \
+                                        time.monotonic() - last_save >= API_FILE_DOWNLOAD_STATE_SAVE_INTERVAL:
+                                    temp_file.flush()
+                                    state['ranges'] = [[0, temp_file.tell() - 1]]
+                                    _save_download_state(incomplete_path, state)
+                                    last_save = time.monotonic()
+                    finally:
                         if progress is not None:
-                            progress.update(len(chunk))
-                        temp_file.write(chunk)
-                if progress is not None:
-                    progress.close()
+                            progress.close()
                 break
             except Exception as e:
                 retry = retry.increment('GET', url, error=e)
                 retry.sleep()
+            finally:
+                if state is not None and temp_file.tell() > 0:
+                    temp_file.flush()
+                    state['ranges'] = [[0, temp_file.tell() - 1]]
+                    _save_download_state(incomplete_path, state)
+
+    downloaded_length = os.path.getsize(incomplete_path)
+    if total_content_length is not None and total_content_length != downloaded_length:
+        os.remove(incomplete_path)
+        _remove_download_state(incomplete_path)
+        msg = 'File %s download incomplete, content_length: %s but the file downloaded length: %s, please download again' % (
+            file_name, total_content_length, downloaded_length)
+        raise FileDownloadError(msg)
+    return sha256.hexdigest()
+
+
+class _ResumableSha256:
+    '''
+    sha256 of a file written sequentially, the file prefix is hashed again when a resumed download does not
+    start where hashing stopped
+    '''
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._size = 0
+
+    def seek(self, file, offset: int):
+        if offset == self._size:
+            return
+        self._hash = hashlib.sha256()
+        self._size = 0
+        position = file.tell()
+        file.seek(0)
+        while self._size < offset:
+            data = file.read(min(API_FILE_DOWNLOAD_CHUNK_SIZE, offset - self._size))
+            if not data:
+                break
+            self.update(data)
+        file.seek(position)
+
+    def update(self, data: bytes):
+        self._hash.update(data)
+        self._size += len(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class _SegmentedSha256:
+    '''
+    sha256 of a file downloaded as out of order segments, each finished segment is hashed in file order as soon
+    as all previous segments are finished, reading it back from the page cache
+    '''
+
+    def __init__(self, fd: int, segments: List[tuple]):
+        self._fd = fd
+        self._segments = segments
+        self._hash = hashlib.sha256()
+        self._finished = set()
+        self._next = 0
+        self._hashing = False
+        self._lock = threading.Lock()
+
+    def segment_finished(self, index: int):
+        with self._lock:
+            self._finished.add(index)
+            if self._hashing:
+                # the hashing thread picks this segment up once it reaches it
+                return
+            self._hashing = True
+        while True:
+            with self._lock:
+                if self._next not in self._finished:
+                    self._hashing = False
+                    return
+                start, end = self._segments[self._next]
+            offset = start
+            while offset <= end:
+                data = os.pread(self._fd, min(API_FILE_DOWNLOAD_CHUNK_SIZE, end + 1 - offset), offset)
+                if not data:
+                    raise FileDownloadError('Unexpected end of file at %d while hashing' % offset)
+                self._hash.update(data)
+                offset += len(data)
+            with self._lock:
+                self._next += 1
+
+    def hexdigest(self) -> str:
+        if self._next != len(self._segments):
+            raise FileDownloadError('Only %d of %d segments were hashed' % (self._next, len(self._segments)))
+        return self._hash.hexdigest()
+
+
+def _check_sha256(temp_file_name: str, file_name: str, file_sha256: str, expected_sha256: Optional[str]):
+    if expected_sha256 is not None and file_sha256 != expected_sha256:
+        os.remove(temp_file_name)
+        msg = 'File %s integrity check failed, expected sha256: %s but the file downloaded sha256: %s, ' \
+              'please download again' % (file_name, expected_sha256, file_sha256)
+        raise FileIntegrityError(msg)
+
+
+async def ahttp_get(*,
+                    client: httpx.AsyncClient,
+                    url: str,
+                    local_dir: str,
+                    file_name: str,
+                    headers: dict = None,
+                    token: str = None,
+                    quiet: bool = False,
+                    expected_sha256: Optional[str] = None) -> str:
+    '''
+    asyncio download API, stream the file through a shared httpx client to local cache dirs
+    :param client: httpx async client, see utils.new_async_client
+    :param url: url to download
+    :param local_dir: local dir to download
+    :param file_name: file name to download
+    :param headers: http headers
+    :param token: csghub token
+    :param expected_sha256: the file is rejected if its sha256 differs, e.g. the LFS oid
+    :return: sha256 of the file, computed while downloading
+    '''
+    get_headers = {k: v for k, v in build_csg_headers(token=token, headers=headers).items() if v is not None}
+    # httpx decompresses by default, but content length and ranges refer to the raw bytes
+    get_headers['Accept-Encoding'] = 'identity'
+    # file writes and hashing run in worker threads, the event loop only drives the transfers
+    fd, temp_file_name = await asyncio.to_thread(tempfile.mkstemp, dir=local_dir)
+    total_content_length = None
+    sha256 = _ResumableSha256()
+    try:
+        with open(fd, 'w+b') as temp_file:
+            # retry sleep 0.5s, 1s, 2s, 4s
+            retry = Retry(total=API_FILE_DOWNLOAD_RETRY_TIMES, backoff_factor=1, allowed_methods=['GET'])
+            while True:
+                try:
+                    downloaded_size = temp_file.tell()
+                    if downloaded_size > 0:
+                        get_headers['Range'] = 'bytes=%d-' % downloaded_size
+                    async with ahost_connection(url), client.stream('GET', url, headers=get_headers) as r:
+                        r.raise_for_status()
+                        content_length = r.headers.get('Content-Length')
+                        if downloaded_size > 0 and r.status_code != 206:
+                            temp_file.seek(0)
+                            temp_file.truncate(0)
+                            downloaded_size = 0
+                        if downloaded_size == 0:
+                            total_content_length = int(content_length) if content_length is not None else None
+                        await asyncio.to_thread(sha256.seek, temp_file, downloaded_size)
 
-    downloaded_length = os.path.getsize(temp_file.name)
+                        progress = None
+                        if not quiet:
+                            progress = tqdm(
+                                unit='B',
+                                unit_scale=True,
+                                unit_divisor=1024,
+                                total=total_content_length,
+                                initial=downloaded_size,
+                                desc="Downloading {}".format(file_name),
+                            )
+                        try:
+                            async for chunk in r.aiter_bytes(chunk_size=API_FILE_DOWNLOAD_CHUNK_SIZE):
+                                if progress is not None:
+                                    progress.update(len(chunk))
+                                await asyncio.to_thread(_write_chunk, temp_file, sha256, chunk)
+                                await athrottle(len(chunk))
+                        finally:
+                            if progress is not None:
+                                progress.close()
+                    break
+                except Exception as e:
+                    retry = retry.increment('GET', url, error=e)
+                    await asyncio.sleep(retry.get_backoff_time())
+    except BaseException:
+        os.remove(temp_file_name)
+        raise
+
+    return await asyncio.to_thread(_finish_async_download, temp_file_name, local_dir, file_name,
+                                   total_content_length, sha256, expected_sha256)
+
+
+def _write_chunk(temp_file, sha256: _ResumableSha256, chunk: bytes):
+    temp_file.write(chunk)
+    sha256.update(chunk)
+
+
+def _finish_async_download(temp_file_name: str, local_dir: str, file_name: str, total_content_length: Optional[int],
+                           sha256: _ResumableSha256, expected_sha256: Optional[str]) -> str:
+    downloaded_length = os.path.getsize(temp_file_name)
     if total_content_length is not None and total_content_length != downloaded_length:
-        os.remove(temp_file.name)
+        os.remove(temp_file_name)
         msg = 'File %s download incomplete, content_length: %s but the file downloaded length: %s, please download again' % (
             file_name, total_content_length, downloaded_length)
         raise FileDownloadError(msg)
-    # fix folder recursive issue
+    file_sha256 = sha256.hexdigest()
+    _check_sha256(temp_file_name, file_name, file_sha256, expected_sha256)
     os.makedirs(os.path.dirname(os.path.join(local_dir, file_name)), exist_ok=True)
-    os.replace(temp_file.name, os.path.join(local_dir, file_name))
-    return
+    os.replace(temp_file_name, os.path.join(local_dir, file_name))
+    return file_sha256
+
+
+def _probe_range_support(*,
+                         url: str,
+                         headers: dict,
+                         cookies: CookieJar = None) -> Optional[Tuple[int, Optional[str]]]:
+    '''
+    request the first byte of the file to check whether the server serves byte ranges
+    :return: the total file size and the strong ETag if ranges are supported, otherwise None
+    '''
+    probe_headers = dict(headers)
+    probe_headers['Range'] = 'bytes=0-0'
+    try:
+        with host_connection(url), get_session(url).get(url, headers=probe_headers, stream=True,
+                                                        cookies=cookies, timeout=API_FILE_DOWNLOAD_TIMEOUT) as r:
+            if r.status_code != 206 or r.headers.get('Accept-Ranges', 'bytes') != 'bytes':
+                return None
+            total_content_length = _parse_content_range_total(r.headers.get('Content-Range'))
+            if total_content_length is None:
+                return None
+            return total_content_length, _strong_etag(r.headers.get('ETag'))
+    except requests.RequestException as e:
+        logger.debug(f"range probe for {url} failed, fallback to single stream download: {e}")
+        return None
+
+
+def _parse_content_range_total(content_range: Optional[str]) -> Optional[int]:
+    # Content-Range: bytes 0-0/12345
+    match = re.match(r'^bytes\s+\d+-\d+/(\d+)$', (content_range or '').strip())
+    return int(match.group(1)) if match is not None else None
+
+
+def _strong_etag(etag: Optional[str]) -> Optional[str]:
+    # If-Range only accepts strong validators
+    if not etag or etag.startswith('W/'):
+        return None
+    return etag
+
+
+def _load_download_state(incomplete_path: str) -> Optional[dict]:
+    '''
+    load the sidecar of an incomplete download: {'etag': str, 'size': int, 'ranges': [[start, end], ...]}
+    '''
+    if not os.path.exists(incomplete_path):
+        return None
+    try:
+        with open(incomplete_path + '.json', 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('etag') and isinstance(state.get('ranges'), list):
+            return state
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def _save_download_state(incomplete_path: str, state: dict):
+    state_path = incomplete_path + '.json'
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def _remove_download_state(incomplete_path: str):
+    if os.path.exists(incomplete_path + '.json'):
+        os.remove(incomplete_path + '.json')
+
+
+def _covered_until(ranges: List[List[int]], start: int) -> int:
+    '''
+    :return: the first offset from start that is not covered by the completed ranges
+    '''
+    offset = start
+    for range_start, range_end in sorted(ranges):
+        if range_start > offset:
+            break
+        offset = max(offset, range_end + 1)
+    return offset
+
+
+def _http_get_segmented(*,
+                        url: str,
+                        file_name: str,
+                        headers: dict,
+                        cookies: CookieJar,
+                        quiet: bool,
+                        segment_size: int,
+                        max_connections: int,
+                        incomplete_path: str,
+                        state: dict) -> str:
+    '''
+    download the file as parallel byte ranges, each range is written at its own offset of the preallocated
+    incomplete file, the ranges completed by a previous call are skipped
+    :return: sha256 of the file
+    '''
+    total_content_length = state['size']
+    segments = [(start, min(start + segment_size, total_content_length) - 1)
+                for start in range(0, total_content_length, segment_size)]
+    # next offset to download of each segment
+    offsets = [min(_covered_until(state['ranges'], start), end + 1) for start, end in segments]
+    segment_headers = dict(headers)
+    if state['etag'] is not None:
+        segment_headers['If-Range'] = state['etag']
+    progress = None
+    if not quiet:
+        progress = tqdm(
+            unit='B',
+            unit_scale=True,
+            unit_divisor=1024,
+            total=total_content_length,
+            initial=sum(offset - start for (start, _), offset in zip(segments, offsets)),
+            desc="Downloading {}".format(file_name),
+        )
+    state_lock = threading.Lock()
+    last_save = time.monotonic()
+
+    def _save_state():
+        if state['etag'] is None:
+            return
+        state['ranges'] = [[start, offset - 1] for (start, _), offset in zip(segments, offsets) if offset > start]
+        _save_download_state(incomplete_path, state)
+
+    def _on_progress(index: int, offset: int, size: int):
+        nonlocal last_save
+        with state_lock:
+            offsets[index] = offset
+            if progress is not None:
+                progress.update(size)
+            if time.monotonic() - last_save >= API_FILE_DOWNLOAD_STATE_SAVE_INTERVAL:
+                _save_state()
+                last_save = time.monotonic()
+
+    fd = os.open(incomplete_path, os.O_RDWR | os.O_CREAT, 0o644)
+    sha256 = _SegmentedSha256(fd, segments)
+
+    def _download(index: int):
+        _download_segment(url=url,
+                          fd=fd,
+                          start=offsets[index],
+                          end=segments[index][1],
+                          headers=segment_headers,
+                          cookies=cookies,
+                          on_progress=partial(_on_progress, index))
+        sha256.segment_finished(index)
+
+    try:
+        os.ftruncate(fd, total_content_length)
+        with ThreadPoolExecutor(max_workers=min(max_connections, len(segments))) as executor:
+            futures = [executor.submit(_download, index)
+                       for index, (_, end) in enumerate(segments) if offsets[index] <= end]
+            try:
+                for index, (_, end) in enumerate(segments):
+                    if offsets[index] > end:
+                        sha256.segment_finished(index)
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        # keep the progress of an interrupted download for the next call
+        with state_lock:
+            _save_state()
+        os.close(fd)
+        if progress is not None:
+            progress.close()
+
+    downloaded_length = os.path.getsize(incomplete_path)
+    if total_content_length != downloaded_length:
+        os.remove(incomplete_path)
+        _remove_download_state(incomplete_path)
+        msg = 'File %s download incomplete, content_length: %s but the file downloaded length: %s, please download again' % (
+            file_name, total_content_length, downloaded_length)
+        raise FileDownloadError(msg)
+    return sha256.hexdigest()
+
+
+def _download_segment(*,
+                      url: str,
+                      fd: int,
+                      start: int,
+                      end: int,
+                      headers: dict,
+                      cookies: CookieJar,
+                      on_progress) -> None:
+    '''
+    download bytes [start, end] of the file into fd, resume from the last written offset on retry
+    :param on_progress: called with the next offset to download and the size of each written chunk
+    '''
+    segment_headers = dict(headers)
+    offset = start
+    # retry sleep 0.5s, 1s, 2s, 4s
+    retry = Retry(total=API_FILE_DOWNLOAD_RETRY_TIMES, backoff_factor=1, allowed_methods=['GET'])
+    while offset <= end:
+        try:
+            segment_headers['Range'] = 'bytes=%d-%d' % (offset, end)
+            with host_connection(url), get_session(url).get(url, headers=segment_headers, stream=True, cookies=cookies,
+                                                            timeout=API_FILE_DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise FileDownloadError('Server ignored range request %s for %s' % (segment_headers['Range'], url))
+                for chunk in r.iter_content(chunk_size=API_FILE_DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        chunk = chunk[:end + 1 - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        on_progress(offset, len(chunk))
+                        throttle(len(chunk))
+                        if offset > end:
+                            break
+            if offset <= end:
+                raise FileDownloadError('Segment bytes=%d-%d of %s ended at %d' % (start, end, url, offset))
+        except Exception as e:
+            retry = retry.increment('GET', url, error=e)
+            retry.sleep()
 
 
 if __name__ == '__main__':
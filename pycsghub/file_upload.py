@@ -1,8 +1,7 @@
 import os
-import requests
 from typing import Optional
 from pycsghub.constants import (DEFAULT_REVISION)
-from pycsghub.utils import (build_csg_headers, get_endpoint, get_repo_url_prefix)
+from pycsghub.utils import (build_csg_headers, get_endpoint, get_repo_url_prefix, get_session)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -27,7 +26,7 @@ def http_upload_file(
     post_headers = build_csg_headers(token=token)
     file_data = {'file': open(file_path, 'rb')}
     form_data = {'file_path': destination_path, 'branch': revision, 'message': (commit_message or ('upload ' + os.path.basename(file_path)))}
-    response = requests.post(http_url, headers=post_headers, data=form_data, files=file_data)
+    response = get_session(http_endpoint).post(http_url, headers=post_headers, data=form_data, files=file_data)
     exist_msg = "GIT-ERR-20"
     if response.status_code == 200:
         logger.info(f"file '{file_path}' upload successfully.")
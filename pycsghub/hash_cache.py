@@ -0,0 +1,111 @@
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from pycsghub.constants import HASH_CACHE_FILE_NAME, HASH_CACHE_PATH
+from pycsghub.utils import get_default_cache_dir
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    PRIMARY KEY (dev, inode)
+)
+"""
+
+
+class HashCache:
+    """Persistent sha256/git-sha1 cache of local files shared by every upload run of the user.
+
+    A file is identified by its device and inode, the cached hashes are only valid while its size and mtime_ns are
+    unchanged. One row is kept per file, a modified file replaces its row. The cache is a best effort: any sqlite
+    error disables it for the process and the files are hashed again.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            self._conn = conn
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"hash cache {self.path} is disabled: {e}")
+
+    def get(self, st: os.stat_result) -> Optional[Tuple[str, str]]:
+        """Return the cached (sha256, sha1) of the file with stat result `st`, `None` if unknown or modified."""
+        if self._conn is None:
+            return None
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT sha256, sha1 FROM hashes WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                    (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns),
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None
+        return None if row is None else (row[0], row[1])
+
+    def put(self, path: Union[str, Path], st: os.stat_result, sha256: str, sha1: str) -> None:
+        """Remember the hashes of `path` computed from the content it had at stat result `st`.
+
+        Nothing is stored if the file changed while it was hashed.
+        """
+        if self._conn is None:
+            return
+        try:
+            current = os.stat(path)
+        except OSError:
+            return
+        if (current.st_dev, current.st_ino, current.st_size, current.st_mtime_ns) != (
+                st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns):
+            return
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO hashes (dev, inode, size, mtime_ns, sha256, sha1) VALUES (?, ?, ?, ?, ?, ?)",
+                    (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, sha256, sha1),
+                )
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _disable(self, error: Exception) -> None:
+        logger.warning(f"hash cache {self.path} is disabled: {error}")
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+        self._conn = None
+
+
+_hash_cache: Optional[HashCache] = None
+_hash_cache_lock = threading.Lock()
+
+
+def get_hash_cache() -> HashCache:
+    """Get the process wide hash cache, opened at `CSGHUB_HASH_CACHE` or `~/.cache/csg/hashes.sqlite`."""
+    global _hash_cache
+    with _hash_cache_lock:
+        if _hash_cache is None:
+            _hash_cache = HashCache(HASH_CACHE_PATH or os.path.join(get_default_cache_dir(), HASH_CACHE_FILE_NAME))
+        return _hash_cache
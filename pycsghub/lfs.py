@@ -2,11 +2,15 @@ import json
 import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Optional
 import logging
-from .constants import LFS_MULTIPART_UPLOAD_COMMAND
-from huggingface_hub.utils._lfs import SliceFileObj
 import requests
+from requests.adapters import Retry
+from .constants import LFS_MULTIPART_UPLOAD_COMMAND, LFS_UPLOAD_PART_RETRY_TIMES, LFS_UPLOAD_PART_WORKERS
+from huggingface_hub.utils._lfs import SliceFileObj
+from .bandwidth import host_connection, throttle
+from .utils import get_session
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +56,48 @@ def read_msg() -> Optional[Dict]:
 
     return msg
 
+class ThrottledSliceFileObj(SliceFileObj):
+    """SliceFileObj whose reads are paced by the process wide bandwidth limit."""
+
+    def read(self, n: int = -1):
+        data = super().read(n)
+        throttle(len(data))
+        return data
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Connection errors, timeouts, 429 and 5xx are retried, other errors such as an expired presigned url are not."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def upload_part(filepath: str, presigned_url: str, part_number: int, chunk_size: int) -> Dict:
+    """Upload one part of a multipart object with its own file handle, retrying transient failures."""
+    # retry sleep 1s, 2s, 4s, 8s
+    retry = Retry(total=LFS_UPLOAD_PART_RETRY_TIMES, backoff_factor=1, allowed_methods=['PUT'])
+    while True:
+        try:
+            with open(filepath, "rb") as file, ThrottledSliceFileObj(
+                file,
+                seek_from=(part_number - 1) * chunk_size,
+                read_limit=chunk_size,
+            ) as data, host_connection(presigned_url):
+                r = get_session(presigned_url).put(presigned_url, data=data)
+                if r.status_code != 200:
+                    logger.error(f"Failed to upload part {part_number} on {presigned_url} :{r.status_code} {r.text}")
+                r.raise_for_status()
+                return {
+                    "etag": r.headers.get("etag"),
+                    "partNumber": part_number,
+                }
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+            retry = retry.increment('PUT', presigned_url, error=e)
+            retry.sleep()
+
+
 class LfsUploadCommand:
 
     def run(self) -> None:
@@ -99,38 +145,39 @@ class LfsUploadCommand:
                 }
             )
 
+            # git-lfs parallelizes objects only, the parts of one object are uploaded concurrently
+            file_size = os.path.getsize(filepath)
             parts = []
-            with open(filepath, "rb") as file:
-                for i, presigned_url in enumerate(presigned_urls):
-                    with SliceFileObj(
-                        file,
-                        seek_from=i * chunk_size,
-                        read_limit=chunk_size,
-                    ) as data:
-                        r = requests.put(presigned_url, data=data)
-                        if r.status_code != 200:
-                            logger.error(f"Failed to upload part {i} on {presigned_url} :{r.status_code} {r.text}")
-                            
-                        r.raise_for_status()
-                        parts.append(
-                            {
-                                "etag": r.headers.get("etag"),
-                                "partNumber": i + 1,
-                            }
-                        )
+            bytes_so_far = 0
+            if presigned_urls:
+                get_session(presigned_urls[0], pool_maxsize=LFS_UPLOAD_PART_WORKERS)
+            with ThreadPoolExecutor(max_workers=LFS_UPLOAD_PART_WORKERS) as executor:
+                futures = {
+                    executor.submit(upload_part, filepath, presigned_url, i + 1, chunk_size): i
+                    for i, presigned_url in enumerate(presigned_urls)
+                }
+                try:
+                    for future in as_completed(futures):
+                        parts.append(future.result())
+                        part_size = max(0, min(chunk_size, file_size - futures[future] * chunk_size))
+                        bytes_so_far += part_size
                         # In order to support progress reporting while data is uploading / downloading,
                         # the transfer process should post messages to stdout
                         write_msg(
                             {
                                 "event": "progress",
                                 "oid": oid,
-                                "bytesSoFar": (i + 1) * chunk_size,
-                                "bytesSinceLast": chunk_size,
+                                "bytesSoFar": bytes_so_far,
+                                "bytesSinceLast": part_size,
                             }
                         )
-                        # Not precise but that's ok.
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            parts.sort(key=lambda part: part["partNumber"])
 
-            r = requests.post(
+            r = get_session(completion_url).post(
                 completion_url,
                 json={
                     "oid": oid,
@@ -4,7 +4,6 @@ from typing import Optional
 import subprocess
 from typing import List, Optional, Union
 from pathlib import Path
-import requests
 import base64
 import shutil
 import re
@@ -18,6 +17,7 @@ from pycsghub.constants import (GIT_HIDDEN_DIR, GIT_ATTRIBUTES_FILE)
 from pycsghub.utils import (build_csg_headers,
                             model_id_to_group_owner_name,
                             get_endpoint,
+                            get_session,
                             get_repo_url_prefix,
                             get_repo_git_prefix)
 import logging
@@ -196,7 +196,7 @@ class Repository:
         headers = build_csg_headers(token=self.token, headers={
             "Content-Type": "application/json"
         })
-        response = requests.get(url, headers=headers)
+        response = get_session(action_endpoint).get(url, headers=headers)
         if response.status_code != 200:
             return False, False
         
@@ -228,7 +228,7 @@ class Repository:
         headers = build_csg_headers(token=self.token, headers={
             "Content-Type": "application/json"
         })
-        response = requests.post(url, json=data, headers=headers)
+        response = get_session(action_endpoint).post(url, json=data, headers=headers)
         if response.status_code != 200:
             logger.info(f"create branch on {url} response: {response.text}")
         response.raise_for_status()
@@ -261,7 +261,7 @@ class Repository:
         headers = build_csg_headers(token=self.token, headers={
             "Content-Type": "application/json"
         })
-        response = requests.post(url, json=data, headers=headers)
+        response = get_session(action_endpoint).post(url, json=data, headers=headers)
         exist_msg = "duplicate key value violates unique constraint"
         if response.status_code != 200 and exist_msg not in response.text :
             logger.error(f"create repo on {url} response: {response.text}")
@@ -1,9 +1,11 @@
+import asyncio
 import logging
+import math
 import os
 import tempfile
 from http.cookiejar import CookieJar
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, NamedTuple, Optional, Union
 
 try:
     from huggingface_hub.file_download import DryRunFileInfo
@@ -11,21 +13,35 @@ except ImportError:
     # Fallback for newer huggingface_hub versions where DryRunFileInfo might be moved or removed
     # Or define a dummy if it's just for type hinting or simple usage
     from collections import namedtuple
-    DryRunFileInfo = namedtuple('DryRunFileInfo', ['path', 'size', 'hash'])
+    DryRunFileInfo = namedtuple('DryRunFileInfo',
+                                ['commit_hash', 'file_size', 'filename', 'local_path', 'is_cached', 'will_download'])
 
 from huggingface_hub.utils import filter_repo_objects
 
 from pycsghub import utils
 from pycsghub.cache import ModelFileSystemCache
-from pycsghub.constants import DEFAULT_REVISION, REPO_TYPE_MODEL, REPO_TYPES
+from pycsghub.constants import (API_ASYNC_DOWNLOAD_CONCURRENCY, API_FILE_DOWNLOAD_MAX_CONNECTIONS,
+                                API_FILE_DOWNLOAD_MAX_WORKERS, DEFAULT_REVISION, DOWNLOAD_BACKEND_ASYNC, DOWNLOAD_BACKEND_THREAD, REPO_TYPE_MODEL, REPO_TYPES)
 from pycsghub.errors import NotSupportError
-from pycsghub.file_download import http_get
-from pycsghub.utils import get_cache_dir, get_endpoint, get_file_download_url, model_id_to_group_owner_name, \
-    pack_repo_file_info
+from pycsghub.file_download import ahttp_get, http_get
+from pycsghub.utils import get_cache_dir, get_endpoint, get_file_download_url, get_repo_file_sha256s, \
+    get_repo_file_sizes, get_session, model_id_to_group_owner_name, new_async_client, pack_repo_file_info
 
 logger = logging.getLogger(__name__)
 
 
+class _SnapshotPlan(NamedTuple):
+    cache: ModelFileSystemCache
+    download_endpoint: str
+    temporary_cache_dir: str
+    # commit id the revision resolved to, cached files and snapshots are keyed by it
+    commit_id: str
+    repo_files: List[str]
+    # sha256 (LFS oid) of the repo files that have one
+    repo_file_sha256s: Dict[str, str]
+    repo_file_sizes: Dict[str, int]
+
+
 def snapshot_download(
         repo_id: str,
         *,
@@ -43,83 +59,79 @@ def snapshot_download(
         source: Optional[str] = None,
         dry_run: Optional[bool] = False,
         force_download: Optional[bool] = False,
-        max_workers: Optional[int] = 8,
+        max_workers: Optional[int] = None,
         quiet: Optional[bool] = False,
+        segment_size: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        backend: Optional[str] = DOWNLOAD_BACKEND_THREAD,
+        verify: Optional[bool] = False,
 ) -> str:
+    """Download all files of a repo revision.
+
+    `backend="thread"` downloads files with `max_workers` threads (8 by default), `backend="async"` runs
+    `asnapshot_download` in a new event loop (use `asnapshot_download` directly from async code) with at most
+    `max_workers` files in flight. The async backend downloads each file with a single request, so
+    `segment_size` and `max_connections` are only accepted with the thread backend.
+    Files are started largest first, and files much larger than their share of the snapshot get more range
+    connections, so that the last worker does not finish long after the others.
+    With `verify=True` the sha256 computed while downloading LFS files is checked against their LFS oid.
+    """
+    if backend == DOWNLOAD_BACKEND_ASYNC:
+        if segment_size is not None or max_connections is not None:
+            raise ValueError("segment_size and max_connections are not supported by the async download backend")
+        return asyncio.run(asnapshot_download(
+                repo_id,
+                repo_type=repo_type,
+                revision=revision,
+                cache_dir=cache_dir,
+                local_dir=local_dir,
+                local_files_only=local_files_only,
+                cookies=cookies,
+                allow_patterns=allow_patterns,
+                ignore_patterns=ignore_patterns,
+                headers=headers,
+                endpoint=endpoint,
+                token=token,
+                source=source,
+                dry_run=dry_run,
+                force_download=force_download,
+                quiet=quiet,
+                max_concurrency=max_workers,
+                verify=verify))
+    if backend != DOWNLOAD_BACKEND_THREAD:
+        raise ValueError(f"Invalid download backend: {backend}. Accepted backends are: "
+                         f"{DOWNLOAD_BACKEND_THREAD}, {DOWNLOAD_BACKEND_ASYNC}")
+
+    plan = _prepare_snapshot(
+            repo_id,
+            repo_type=repo_type,
+            revision=revision,
+            cache_dir=cache_dir,
+            local_dir=local_dir,
+            local_files_only=local_files_only,
+            allow_patterns=allow_patterns,
+            ignore_patterns=ignore_patterns,
+            endpoint=endpoint,
+            token=token,
+            source=source,
+            dry_run=dry_run,
+            force_download=force_download)
+    if not isinstance(plan, _SnapshotPlan):
+        return plan
+    cache, download_endpoint, temporary_cache_dir, commit_id, repo_files, repo_file_sha256s, repo_file_sizes = plan
     if repo_type is None:
         repo_type = REPO_TYPE_MODEL
-    if repo_type not in REPO_TYPES:
-        raise ValueError(f"Invalid repo type: {repo_type}. Accepted repo types are: {str(REPO_TYPES)}")
-    
-    if cache_dir is None:
-        cache_dir = get_cache_dir(repo_type=repo_type)
-    if isinstance(cache_dir, Path):
-        cache_dir = str(cache_dir)
-    
-    temporary_cache_dir = os.path.join(cache_dir, 'temp')
-    os.makedirs(temporary_cache_dir, exist_ok=True)
-    
-    if local_dir is None:
-        local_dir = os.path.join(os.getcwd(), repo_id)
-    if isinstance(local_dir, Path):
-        local_dir = str(local_dir)
-    
-    group_or_owner, name = model_id_to_group_owner_name(repo_id)
-    # name = name.replace('.', '___')
-    
-    cache = ModelFileSystemCache(cache_dir, group_or_owner, name, local_dir=local_dir)
-    
-    if local_files_only:
-        if len(cache.cached_files) == 0:
-            raise ValueError(
-                    'Cannot find the requested files in the cached path and outgoing'
-                    ' traffic has been disabled. To enable model look-ups and downloads'
-                    " online, set 'local_files_only' to False.")
-        return cache.get_root_location()
-    else:
-        download_endpoint = get_endpoint(endpoint=endpoint)
-        if source == 'xet':
-            try:
-                import xet_core  # type: ignore
-            except Exception:
-                raise NotSupportError("xet source requires xet-core library to be installed")
-            return os.path.join(cache_dir, group_or_owner, name)
-        # make headers
-        # todo need to add cookies？
-        repo_info = utils.get_repo_info(repo_id,
-                                        repo_type=repo_type,
-                                        revision=revision,
-                                        token=token,
-                                        endpoint=download_endpoint,
-                                        source=source)
-        
-        assert repo_info.sha is not None, "Repo info returned from server must have a revision sha."
-        assert repo_info.siblings is not None, "Repo info returned from server must have a siblings list."
-        repo_files = list(
-                filter_repo_objects(
-                        items=[f.rfilename for f in repo_info.siblings],
-                        allow_patterns=allow_patterns,
-                        ignore_patterns=ignore_patterns,
-                )
-        )
-        
-        if dry_run:
-            infos = []
-            sizes = {}
-            try:
-                for s in getattr(repo_info, 'siblings', []) or []:
-                    if hasattr(s, 'rfilename') and hasattr(s, 'size'):
-                        sizes[s.rfilename] = getattr(s, 'size') or 0
-            except Exception:
-                pass
-            for f in repo_files:
-                infos.append(DryRunFileInfo(filename=f, file_size=sizes.get(f, 0), will_download=True))
-            return infos
-        
+    repo_files = _largest_first(repo_files, repo_file_sizes)
+    if max_workers is None:
+        max_workers = API_FILE_DOWNLOAD_MAX_WORKERS
+    max_connections = max_connections or API_FILE_DOWNLOAD_MAX_CONNECTIONS
+    file_connections = _large_file_connections(repo_files, repo_file_sizes, max_workers, max_connections)
+
+    try:
         with tempfile.TemporaryDirectory(dir=temporary_cache_dir) as temp_cache_dir:
             def _download_one(repo_file: str):
-                repo_file_info = pack_repo_file_info(repo_file, revision)
-                if not force_download and cache.exists(repo_file_info):
+                repo_file_info = pack_repo_file_info(repo_file, commit_id)
+                if not force_download and _is_cached(cache, repo_file_info, repo_file_sha256s.get(repo_file)):
                     file_name = os.path.basename(repo_file_info['Path'])
                     logger.info(f"File {file_name} already in '{cache.get_root_location()}', skip downloading!")
                     return
@@ -131,19 +143,28 @@ def snapshot_download(
                         endpoint=download_endpoint,
                         source=source)
                 logger.debug(f"Downloading {repo_file} from {url}")
-                http_get(
+                file_sha256 = http_get(
                         url=url,
                         local_dir=temp_cache_dir,
                         file_name=repo_file,
                         headers=headers,
                         cookies=cookies,
                         token=token,
-                        quiet=quiet)
+                        quiet=quiet,
+                        segment_size=segment_size,
+                        max_connections=file_connections.get(repo_file, max_connections),
+                        expected_sha256=repo_file_sha256s.get(repo_file) if verify else None,
+                        resume_dir=temporary_cache_dir,
+                        expected_size=repo_file_sizes.get(repo_file) or None)
                 temp_file = os.path.join(temp_cache_dir, repo_file)
-                savedFile = cache.put_file(repo_file_info, temp_file)
+                savedFile = cache.put_file(repo_file_info, temp_file, sha256=file_sha256)
                 logger.info(f"Saved file to '{savedFile}'")
-            
+
             if max_workers and max_workers > 1:
+                # size the shared connection pool for every worker and its range requests
+                get_session(download_endpoint,
+                            pool_maxsize=max_workers * max_connections + sum(
+                                    connections - max_connections for connections in file_connections.values()))
                 from concurrent.futures import ThreadPoolExecutor, as_completed
                 with ThreadPoolExecutor(max_workers=max_workers) as ex:
                     futures = {ex.submit(_download_one, f): f for f in repo_files}
@@ -156,6 +177,250 @@ def snapshot_download(
             else:
                 for f in repo_files:
                     _download_one(f)
-        
-        cache.save_model_version(revision_info={'Revision': revision})
-        return os.path.join(cache.get_root_location())
+    finally:
+        cache.close()
+    _save_ref(cache, revision, commit_id)
+    cache.save_model_version(revision_info={'Revision': revision})
+    return os.path.join(cache.get_root_location())
+
+
+async def asnapshot_download(
+        repo_id: str,
+        *,
+        repo_type: Optional[str] = None,
+        revision: Optional[str] = DEFAULT_REVISION,
+        cache_dir: Union[str, Path, None] = None,
+        local_dir: Union[str, Path, None] = None,
+        local_files_only: Optional[bool] = False,
+        cookies: Optional[CookieJar] = None,
+        allow_patterns: Optional[Union[List[str], str]] = None,
+        ignore_patterns: Optional[Union[List[str], str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        endpoint: Optional[str] = None,
+        token: Optional[str] = None,
+        source: Optional[str] = None,
+        dry_run: Optional[bool] = False,
+        force_download: Optional[bool] = False,
+        quiet: Optional[bool] = False,
+        max_concurrency: Optional[int] = None,
+        verify: Optional[bool] = False,
+) -> str:
+    """Asyncio variant of `snapshot_download`.
+
+    All files share one `httpx.AsyncClient` (HTTP/2 when the `h2` package is installed) and at most
+    `max_concurrency` files are in flight. The cache layout is the same as `snapshot_download`.
+    """
+    plan = await asyncio.to_thread(
+            _prepare_snapshot,
+            repo_id,
+            repo_type=repo_type,
+            revision=revision,
+            cache_dir=cache_dir,
+            local_dir=local_dir,
+            local_files_only=local_files_only,
+            allow_patterns=allow_patterns,
+            ignore_patterns=ignore_patterns,
+            endpoint=endpoint,
+            token=token,
+            source=source,
+            dry_run=dry_run,
+            force_download=force_download)
+    if not isinstance(plan, _SnapshotPlan):
+        return plan
+    cache, download_endpoint, temporary_cache_dir, commit_id, repo_files, repo_file_sha256s, repo_file_sizes = plan
+    if repo_type is None:
+        repo_type = REPO_TYPE_MODEL
+    # tasks acquire the semaphore in creation order
+    repo_files = _largest_first(repo_files, repo_file_sizes)
+    max_concurrency = max_concurrency or API_ASYNC_DOWNLOAD_CONCURRENCY
+
+    try:
+        with tempfile.TemporaryDirectory(dir=temporary_cache_dir) as temp_cache_dir:
+            async with new_async_client(max_connections=max_concurrency, cookies=cookies) as client:
+                semaphore = asyncio.Semaphore(max_concurrency)
+
+                # cache lookups and moving files into the cache run in worker threads, the cache is thread safe
+                async def _download_one(repo_file: str):
+                    async with semaphore:
+                        repo_file_info = pack_repo_file_info(repo_file, commit_id)
+                        if not force_download and await asyncio.to_thread(
+                                _is_cached, cache, repo_file_info, repo_file_sha256s.get(repo_file)):
+                            file_name = os.path.basename(repo_file_info['Path'])
+                            logger.info(f"File {file_name} already in '{cache.get_root_location()}', skip downloading!")
+                            return
+                        url = get_file_download_url(
+                                repo_id=repo_id,
+                                file_path=repo_file,
+                                repo_type=repo_type,
+                                revision=revision,
+                                endpoint=download_endpoint,
+                                source=source)
+                        logger.debug(f"Downloading {repo_file} from {url}")
+                        file_sha256 = await ahttp_get(
+                                client=client,
+                                url=url,
+                                local_dir=temp_cache_dir,
+                                file_name=repo_file,
+                                headers=headers,
+                                token=token,
+                                quiet=quiet,
+                                expected_sha256=repo_file_sha256s.get(repo_file) if verify else None)
+                        temp_file = os.path.join(temp_cache_dir, repo_file)
+                        savedFile = await asyncio.to_thread(
+                                cache.put_file, repo_file_info, temp_file, sha256=file_sha256)
+                        logger.info(f"Saved file to '{savedFile}'")
+
+                tasks = [asyncio.ensure_future(_download_one(f)) for f in repo_files]
+                try:
+                    await asyncio.gather(*tasks)
+                except BaseException:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+    finally:
+        cache.close()
+    await asyncio.to_thread(_save_ref, cache, revision, commit_id)
+    cache.save_model_version(revision_info={'Revision': revision})
+    return os.path.join(cache.get_root_location())
+
+
+def _prepare_snapshot(
+        repo_id: str,
+        *,
+        repo_type: Optional[str],
+        revision: Optional[str],
+        cache_dir: Union[str, Path, None],
+        local_dir: Union[str, Path, None],
+        local_files_only: Optional[bool],
+        allow_patterns: Optional[Union[List[str], str]],
+        ignore_patterns: Optional[Union[List[str], str]],
+        endpoint: Optional[str],
+        token: Optional[str],
+        source: Optional[str],
+        dry_run: Optional[bool],
+        force_download: Optional[bool],
+) -> Union[str, List[DryRunFileInfo], _SnapshotPlan]:
+    """Resolve the local cache and the files to download.
+
+    Returns the final result of the snapshot when nothing has to be downloaded
+    (local files only, xet source or dry run), otherwise a `_SnapshotPlan`.
+    """
+    if repo_type is None:
+        repo_type = REPO_TYPE_MODEL
+    if repo_type not in REPO_TYPES:
+        raise ValueError(f"Invalid repo type: {repo_type}. Accepted repo types are: {str(REPO_TYPES)}")
+    
+    if cache_dir is None:
+        cache_dir = get_cache_dir(repo_type=repo_type)
+    if isinstance(cache_dir, Path):
+        cache_dir = str(cache_dir)
+    
+    temporary_cache_dir = os.path.join(cache_dir, 'temp')
+    os.makedirs(temporary_cache_dir, exist_ok=True)
+    
+    if local_dir is None:
+        local_dir = os.path.join(os.getcwd(), repo_id)
+    if isinstance(local_dir, Path):
+        local_dir = str(local_dir)
+    
+    group_or_owner, name = model_id_to_group_owner_name(repo_id)
+    # name = name.replace('.', '___')
+    
+    cache = ModelFileSystemCache(cache_dir, group_or_owner, name, local_dir=local_dir)
+    
+    if local_files_only:
+        if len(cache.cached_files) == 0:
+            raise ValueError(
+                    'Cannot find the requested files in the cached path and outgoing'
+                    ' traffic has been disabled. To enable model look-ups and downloads'
+                    " online, set 'local_files_only' to False.")
+        return cache.get_root_location()
+
+    download_endpoint = get_endpoint(endpoint=endpoint)
+    if source == 'xet':
+        try:
+            import xet_core  # type: ignore
+        except Exception:
+            raise NotSupportError("xet source requires xet-core library to be installed")
+        return os.path.join(cache_dir, group_or_owner, name)
+    # make headers
+    # todo need to add cookies？
+    repo_info = utils.get_repo_info(repo_id,
+                                    repo_type=repo_type,
+                                    revision=revision,
+                                    files_metadata=True,
+                                    token=token,
+                                    endpoint=download_endpoint,
+                                    source=source)
+    
+    assert repo_info.sha is not None, "Repo info returned from server must have a revision sha."
+    assert repo_info.siblings is not None, "Repo info returned from server must have a siblings list."
+    repo_files = list(
+            filter_repo_objects(
+                    items=[f.rfilename for f in repo_info.siblings],
+                    allow_patterns=allow_patterns,
+                    ignore_patterns=ignore_patterns,
+            )
+    )
+    repo_file_sha256s = get_repo_file_sha256s(repo_info)
+    repo_file_sizes = get_repo_file_sizes(repo_info)
+
+    if dry_run:
+        infos = []
+        for f in repo_files:
+            # same decision as the download, without linking cached files
+            is_cached = cache.is_available(pack_repo_file_info(f, repo_info.sha), repo_file_sha256s.get(f))
+            infos.append(DryRunFileInfo(commit_hash=repo_info.sha,
+                                        file_size=repo_file_sizes.get(f, 0),
+                                        filename=f,
+                                        local_path=os.path.join(cache.get_root_location(), f),
+                                        is_cached=is_cached,
+                                        will_download=force_download or not is_cached))
+        return infos
+
+    return _SnapshotPlan(cache=cache,
+                         download_endpoint=download_endpoint,
+                         temporary_cache_dir=temporary_cache_dir,
+                         commit_id=repo_info.sha,
+                         repo_files=repo_files,
+                         repo_file_sha256s=repo_file_sha256s,
+                         repo_file_sizes=repo_file_sizes)
+
+
+def _largest_first(repo_files: List[str], repo_file_sizes: Dict[str, int]) -> List[str]:
+    """Order files by decreasing size (longest processing time first), small files fill the idle workers at the end."""
+    return sorted(repo_files, key=lambda f: repo_file_sizes.get(f, 0), reverse=True)
+
+
+def _large_file_connections(repo_files: List[str],
+                            repo_file_sizes: Dict[str, int],
+                            max_workers: Optional[int],
+                            max_connections: int) -> Dict[str, int]:
+    """Range connections of the files larger than a fair share (total size / workers) of the snapshot.
+
+    Such a file gets one `max_connections` per fair share it spans, up to the connections of all workers.
+    """
+    total_size = sum(repo_file_sizes.get(f, 0) for f in repo_files)
+    if not max_workers or max_workers <= 1 or max_connections <= 1 or total_size == 0:
+        return {}
+    fair_share = total_size / max_workers
+    file_connections = {}
+    for f in repo_files:
+        size = repo_file_sizes.get(f, 0)
+        if size > fair_share:
+            file_connections[f] = min(max_workers * max_connections, max_connections * math.ceil(size / fair_share))
+    return file_connections
+
+
+def _save_ref(cache: ModelFileSystemCache, revision: Optional[str], commit_id: str):
+    """Record the commit id a branch or tag resolved to, nothing to record when the revision is the commit id."""
+    if revision and revision != commit_id:
+        cache.save_ref(revision, commit_id)
+
+
+def _is_cached(cache: ModelFileSystemCache, repo_file_info: Dict[str, str], sha256: Optional[str]) -> bool:
+    """Whether the file is cached, files whose content is already in the blob store are linked instead of downloaded."""
+    if cache.exists(repo_file_info):
+        return True
+    return sha256 is not None and cache.put_file_from_blob(repo_file_info, sha256) is not None
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pycsghub import bandwidth, constants
+from pycsghub.bandwidth import (TokenBucket, ahost_connection, host_connection, parse_size,
+                                set_max_connections_per_host)
+
+
+class ParseSizeTest(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1048576'), 1048576)
+        self.assertEqual(parse_size('512K'), 512 * 1024)
+        self.assertEqual(parse_size('1.5m'), int(1.5 * 1024 * 1024))
+        self.assertEqual(parse_size('2GiB'), 2 * 1024 ** 3)
+        self.assertIsNone(parse_size('0'))
+        self.assertIsNone(parse_size(None))
+        with self.assertRaises(ValueError):
+            parse_size('fast')
+
+
+class EnvIntTest(unittest.TestCase):
+    def test_malformed_value_falls_back_to_default(self):
+        with mock.patch.dict('os.environ', {'CSGHUB_TEST_INT': '8'}):
+            self.assertEqual(constants._env_int('CSGHUB_TEST_INT', '0'), 8)
+        with mock.patch.dict('os.environ', {'CSGHUB_TEST_INT': 'eight'}):
+            self.assertEqual(constants._env_int('CSGHUB_TEST_INT', '0'), 0)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_reserve_waits_for_debt(self):
+        bucket = TokenBucket(1000)
+        # the burst of one second is free, the next second of traffic has to wait for it
+        self.assertEqual(bucket.reserve(1000), 0)
+        self.assertAlmostEqual(bucket.reserve(500), 0.5, delta=0.05)
+        self.assertAlmostEqual(bucket.reserve(500), 1.0, delta=0.05)
+
+
+class HostConnectionTest(unittest.TestCase):
+    def tearDown(self):
+        set_max_connections_per_host(None)
+
+    def test_max_connections_per_host(self):
+        set_max_connections_per_host(2)
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def _transfer(url):
+            with host_connection(url):
+                with lock:
+                    active.append(url)
+                    peak.append(sum(1 for u in active if u == url))
+                time.sleep(0.05)
+                with lock:
+                    active.remove(url)
+
+        threads = [threading.Thread(target=_transfer, args=(url,))
+                   for url in ['https://a.example.com/f'] * 6 + ['https://b.example.com/f'] * 2]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(max(peak), 2)
+
+    def test_async_max_connections_per_host(self):
+        set_max_connections_per_host(2)
+        active = []
+        peak = []
+
+        async def _transfer(url):
+            async with ahost_connection(url):
+                active.append(url)
+                peak.append(sum(1 for u in active if u == url))
+                await asyncio.sleep(0.01)
+                active.remove(url)
+
+        async def _main():
+            await asyncio.gather(*[_transfer(url) for url in ['https://a.example.com/f'] * 6])
+
+        asyncio.run(_main())
+        self.assertEqual(max(peak), 2)
+
+    def test_unlimited_by_default(self):
+        self.assertIsNone(bandwidth._max_connections_per_host)
+        with host_connection('https://a.example.com/f'):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from pycsghub import cache as cache_module
+from pycsghub.cache import FileSystemCache, ModelFileSystemCache
+
+
+class ModelFileSystemCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ModelFileSystemCache(self.tmp.name, 'owner', 'name')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _put(self, path, revision, content=b''):
+        fd, fn = tempfile.mkstemp(dir=self.tmp.name)
+        with open(fd, 'wb') as f:
+            f.write(content)
+        return self.cache.put_file({'Path': path, 'Revision': revision}, fn)
+
+    def test_revision_prefix_lookup(self):
+        self._put('a/model.bin', 'abcdef123456')
+        self.assertTrue(self.cache.exists({'Path': 'a/model.bin', 'Revision': 'abcdef'}))
+        self.assertTrue(self.cache.exists({'Path': 'a/model.bin', 'Revision': 'abcdef123456789'}))
+        self.assertFalse(self.cache.exists({'Path': 'a/model.bin', 'Revision': 'fedcba'}))
+        self.assertIsNotNone(self.cache.get_file_by_path_and_commit_id('a/model.bin', 'abc'))
+        self.assertIsNone(self.cache.get_file_by_path_and_commit_id('b/model.bin', 'abc'))
+
+    def test_put_file_replaces_revision(self):
+        self._put('model.bin', 'rev1')
+        self._put('model.bin', 'rev2')
+        self.assertEqual(self.cache.cached_files, [{'Path': 'model.bin', 'Revision': 'rev2'}])
+
+    def test_index_reloaded_from_disk(self):
+        self._put('model.bin', 'rev1')
+        self.cache.close()
+        reloaded = ModelFileSystemCache(self.tmp.name, 'owner', 'name')
+        self.assertIsNotNone(reloaded.get_file_by_info({'Path': 'model.bin', 'Revision': 'rev1'}))
+
+    def test_deleted_file_removed_from_index(self):
+        cached_path = self._put('model.bin', 'rev1')
+        os.remove(cached_path)
+        self.assertIsNone(self.cache.get_file_by_path('model.bin'))
+        self.assertEqual(self.cache.cached_files, [])
+
+    def test_journal_replayed_after_crash(self):
+        self._put('a.bin', 'rev1')
+        self._put('b.bin', 'rev1')
+        self.cache.flush()
+        journal = os.path.join(self.cache.cache_root_location, FileSystemCache.KEY_JOURNAL_FILE_NAME)
+        with open(journal, 'a', encoding='utf-8') as f:
+            f.write('{"op": "put", "key": {"Pa')
+        reloaded = ModelFileSystemCache(self.tmp.name, 'owner', 'name')
+        self.assertEqual(sorted(k['Path'] for k in reloaded.cached_files), ['a.bin', 'b.bin'])
+
+    def test_journal_compacted(self):
+        with mock.patch.object(cache_module, 'CACHE_INDEX_FLUSH_ENTRIES', 1), \
+                mock.patch.object(cache_module, 'CACHE_INDEX_COMPACT_ENTRIES', 3):
+            for i in range(4):
+                self._put('%d.bin' % i, 'rev1')
+        journal = os.path.join(self.cache.cache_root_location, FileSystemCache.KEY_JOURNAL_FILE_NAME)
+        with open(journal, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 1)
+        reloaded = ModelFileSystemCache(self.tmp.name, 'owner', 'name')
+        self.assertEqual(len(reloaded.cached_files), 4)
+
+    def test_concurrent_put_file(self):
+        threads = [threading.Thread(target=self._put, args=('%d.bin' % i, 'rev1')) for i in range(32)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.cache.close()
+        reloaded = ModelFileSystemCache(self.tmp.name, 'owner', 'name')
+        self.assertEqual(len(reloaded.cached_files), 32)
+
+    def test_blobs_shared_across_repos(self):
+        other = ModelFileSystemCache(self.tmp.name, 'owner', 'finetune')
+        first = self._put('model.bin', 'rev1', b'weights')
+        fd, fn = tempfile.mkstemp(dir=self.tmp.name)
+        with open(fd, 'wb') as f:
+            f.write(b'weights')
+        other.put_file({'Path': 'model.bin', 'Revision': 'rev1'}, fn)
+        self.assertEqual(os.listdir(self.cache.blobs_location), [cache_module.compute_hash(first)])
+        self.assertTrue(os.path.samefile(self.cache.get_snapshot_path({'Path': 'model.bin', 'Revision': 'rev1'}),
+                                         other.get_snapshot_path({'Path': 'model.bin', 'Revision': 'rev1'})))
+
+    def test_working_file_linked_to_blob_without_reflink(self):
+        with mock.patch.object(cache_module, '_reflink', side_effect=OSError):
+            cached_path = self._put('model.bin', 'rev1', b'weights')
+        blob_path = self.cache.get_blob_path(cache_module.compute_hash(cached_path))
+        self.assertEqual(os.listdir(self.cache.blobs_location), [os.path.basename(blob_path)])
+        self.assertEqual(os.stat(cached_path).st_ino, os.stat(blob_path).st_ino)
+        self.assertEqual(os.stat(blob_path).st_nlink, 3)
+
+    def test_remove_snapshot_prunes_blobs(self):
+        self._put('model.bin', 'rev1', b'v1')
+        self._put('model.bin', 'rev2', b'v2')
+        self._put('shared.bin', 'rev1', b'shared')
+        self._put('shared.bin', 'rev2', b'shared')
+        self.assertEqual(len(os.listdir(self.cache.blobs_location)), 3)
+        # blobs changed recently are kept
+        self.assertEqual(self.cache.remove_snapshot('rev1'), 0)
+        with mock.patch.object(cache_module, 'CACHE_BLOB_PRUNE_GRACE', -1):
+            self.assertEqual(self.cache.remove_snapshot('rev1'), 1)
+        self.assertEqual(sorted(os.listdir(self.cache.blobs_location)),
+                         sorted(cache_module.compute_hash(self.cache.get_snapshot_path({'Path': p, 'Revision': 'rev2'}))
+                                for p in ('model.bin', 'shared.bin')))
+
+    def test_moved_ref_removes_old_snapshot(self):
+        self._put('model.bin', 'rev1', b'v1')
+        self._put('model.bin', 'rev2', b'v2')
+        self.cache.save_ref('main', 'rev1')
+        self.cache.save_ref('v1', 'rev1')
+        with mock.patch.object(cache_module, 'CACHE_BLOB_PRUNE_GRACE', -1):
+            self.cache.save_ref('main', 'rev2')
+            self.assertTrue(os.path.exists(self.cache.get_snapshot_path({'Path': 'model.bin', 'Revision': 'rev1'})))
+            self.cache.save_ref('v1', 'rev2')
+        self.assertFalse(os.path.exists(self.cache.get_snapshot_path({'Path': 'model.bin', 'Revision': 'rev1'})))
+        self.assertEqual(len(os.listdir(self.cache.blobs_location)), 1)
+
+    def test_save_ref(self):
+        self.assertIsNone(self.cache.get_ref('release/v1'))
+        self.assertIsNone(self.cache.save_ref('release/v1', 'rev1'))
+        self.assertEqual(self.cache.save_ref('release/v1', 'rev2'), 'rev1')
+        self.assertEqual(ModelFileSystemCache(self.tmp.name, 'owner', 'name').get_ref('release/v1'), 'rev2')
+
+    def test_switch_revision_from_snapshot(self):
+        cached_path = self._put('model.bin', 'rev1', b'v1')
+        self._put('model.bin', 'rev2', b'v2')
+        self.assertTrue(self.cache.exists({'Path': 'model.bin', 'Revision': 'rev1'}))
+        with open(cached_path, 'rb') as f:
+            self.assertEqual(f.read(), b'v1')
+        self.assertEqual(self.cache.cached_files, [{'Path': 'model.bin', 'Revision': 'rev1'}])
+        self.assertFalse(self.cache.exists({'Path': 'model.bin', 'Revision': 'rev3'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
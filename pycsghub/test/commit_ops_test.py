@@ -0,0 +1,44 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pycsghub import commit_ops
+from pycsghub.commit_ops import CommitOperationAdd, CommitOperationDelete, build_payload
+
+
+class CommitBodyTest(unittest.TestCase):
+    def test_build_payload_streams_json(self):
+        content = os.urandom(1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, 'model.bin')
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            body = build_payload([
+                CommitOperationAdd(path_in_repo='dir/model.bin', path_or_fileobj=file_path),
+                CommitOperationDelete(path_in_repo='old "quoted".txt'),
+                CommitOperationAdd(path_in_repo='README.md', path_or_fileobj=b'# readme\n'),
+                CommitOperationAdd(path_in_repo='empty', path_or_fileobj=b''),
+            ], commit_message='add files')
+            with mock.patch.object(commit_ops, 'COMMIT_CONTENT_CHUNK_SIZE', 3 * 7):
+                chunks = list(body)
+                # the body can be sent again when the request is retried
+                self.assertEqual(list(body), chunks)
+
+        data = b''.join(chunks)
+        self.assertEqual(len(body), len(data))
+        self.assertEqual(json.loads(data), {
+            'message': 'add files',
+            'files': [
+                {'path': 'dir/model.bin', 'action': 'create', 'content': base64.b64encode(content).decode()},
+                {'path': 'old "quoted".txt', 'action': 'delete'},
+                {'path': 'README.md', 'action': 'create', 'content': base64.b64encode(b'# readme\n').decode()},
+                {'path': 'empty', 'action': 'create', 'content': ''},
+            ],
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
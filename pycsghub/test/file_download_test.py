@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar, List
+
+from pycsghub.errors import FileIntegrityError
+from pycsghub.file_download import ahttp_get, http_get
+from pycsghub.utils import new_async_client
+
+
+class _FileHandler(BaseHTTPRequestHandler):
+    content = b''
+    etag = '"v1"'
+    support_ranges = True
+    requested_ranges: ClassVar[List[str]] = []
+
+    def do_GET(self):
+        content = self.__class__.content
+        range_header = self.headers.get('Range')
+        match = re.match(r'bytes=(\d+)-(\d*)', range_header or '')
+        if_range = self.headers.get('If-Range')
+        if self.__class__.support_ranges and match and if_range in (None, self.__class__.etag):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(content) - 1
+            self.__class__.requested_ranges.append((start, end))
+            body = content[start:end + 1]
+            self.send_response(206)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(content)))
+        else:
+            body = content
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.__class__.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpGetTest(unittest.TestCase):
+    def setUp(self):
+        _FileHandler.content = os.urandom(1024 * 100 + 7)
+        _FileHandler.etag = '"v1"'
+        _FileHandler.support_ranges = True
+        _FileHandler.requested_ranges = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _FileHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/file.bin' % self.server.server_address[1]
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def _read(self, file_name):
+        with open(os.path.join(self.tmp.name, file_name), 'rb') as f:
+            return f.read()
+
+    def _sha256(self):
+        return hashlib.sha256(_FileHandler.content).hexdigest()
+
+    def test_segmented_download(self):
+        sha256 = http_get(url=self.url, local_dir=self.tmp.name, file_name='sub/file.bin',
+                 quiet=True, segment_size=1024 * 16, max_connections=4)
+        self.assertEqual(self._read('sub/file.bin'), _FileHandler.content)
+        # probe request + one request per segment
+        self.assertEqual(len(_FileHandler.requested_ranges), 1 + 7)
+        self.assertEqual(sha256, self._sha256())
+
+    def test_small_file_not_probed(self):
+        http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin', quiet=True,
+                 max_connections=4, expected_size=len(_FileHandler.content))
+        self.assertEqual(self._read('file.bin'), _FileHandler.content)
+        self.assertEqual(_FileHandler.requested_ranges, [])
+
+    def test_fallback_without_range_support(self):
+        _FileHandler.support_ranges = False
+        sha256 = http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin',
+                          quiet=True, segment_size=1024 * 16, max_connections=4)
+        self.assertEqual(self._read('file.bin'), _FileHandler.content)
+        self.assertEqual(sha256, self._sha256())
+
+    def test_single_connection(self):
+        http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin',
+                 quiet=True, segment_size=1024 * 16, max_connections=1)
+        self.assertEqual(self._read('file.bin'), _FileHandler.content)
+        self.assertEqual(_FileHandler.requested_ranges, [])
+
+    def test_verify_rejects_mismatch(self):
+        for max_connections in (1, 4):
+            with self.assertRaises(FileIntegrityError):
+                http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin', quiet=True,
+                         segment_size=1024 * 16, max_connections=max_connections, expected_sha256='0' * 64)
+            self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'file.bin')))
+            self.assertEqual([f for f in os.listdir(os.path.join(self.tmp.name, '.incomplete'))
+                              if not f.endswith('.lock')], [])
+
+    def _interrupted_download(self, ranges, etag='"v1"'):
+        # leave the incomplete file and sidecar of a killed process in the resume dir
+        resume_dir = os.path.join(self.tmp.name, 'resume')
+        os.makedirs(resume_dir)
+        incomplete_path = os.path.join(resume_dir, hashlib.sha256(self.url.encode()).hexdigest() + '.incomplete')
+        with open(incomplete_path, 'wb') as f:
+            f.write(b'\0' * len(_FileHandler.content))
+            for start, end in ranges:
+                f.seek(start)
+                f.write(_FileHandler.content[start:end + 1])
+        with open(incomplete_path + '.json', 'w') as f:
+            json.dump({'etag': etag, 'size': len(_FileHandler.content), 'ranges': ranges}, f)
+        return resume_dir
+
+    def test_resume_stream_download(self):
+        resume_dir = self._interrupted_download([[0, 999]])
+        sha256 = http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin',
+                          quiet=True, max_connections=1, resume_dir=resume_dir)
+        self.assertEqual(self._read('file.bin'), _FileHandler.content)
+        self.assertEqual(sha256, self._sha256())
+        self.assertEqual(_FileHandler.requested_ranges, [(1000, len(_FileHandler.content) - 1)])
+        self.assertEqual([f for f in os.listdir(resume_dir) if not f.endswith('.lock')], [])
+
+    def test_resume_segmented_download(self):
+        resume_dir = self._interrupted_download([[0, 1024 * 32 - 1], [1024 * 48, 1024 * 50 - 1]])
+        sha256 = http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin', quiet=True,
+                          segment_size=1024 * 16, max_connections=4, resume_dir=resume_dir)
+        self.assertEqual(self._read('file.bin'), _FileHandler.content)
+        self.assertEqual(sha256, self._sha256())
+        # probe + 4 missing segments + the rest of a partial segment
+        self.assertEqual(len(_FileHandler.requested_ranges), 1 + 5)
+        self.assertIn((1024 * 50, 1024 * 64 - 1), _FileHandler.requested_ranges)
+
+    def test_resume_changed_file_restarts(self):
+        resume_dir = self._interrupted_download([[0, 999]], etag='"v0"')
+        http_get(url=self.url, local_dir=self.tmp.name, file_name='file.bin',
+                 quiet=True, max_connections=1, resume_dir=resume_dir)
+        self.assertEqual(self._read('file.bin'), _FileHandler.content)
+
+    def test_async_download(self):
+        async def _download():
+            async with new_async_client(max_connections=4) as client:
+                return await ahttp_get(client=client, url=self.url, local_dir=self.tmp.name,
+                                       file_name='sub/file.bin', quiet=True, expected_sha256=self._sha256())
+        self.assertEqual(asyncio.run(_download()), self._sha256())
+        self.assertEqual(self._read('sub/file.bin'), _FileHandler.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
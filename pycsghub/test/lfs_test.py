@@ -0,0 +1,109 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar, Dict, Set
+from unittest import mock
+
+import requests
+
+from pycsghub.lfs import LfsUploadCommand, upload_part
+
+
+class _MultipartHandler(BaseHTTPRequestHandler):
+    parts: ClassVar[Dict[str, bytes]] = {}
+    failed: ClassVar[Set[str]] = set()
+    completion = None
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/expired':
+            self.failed.add(self.path)
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/part/2' and self.path not in self.failed:
+            # the first attempt of a part fails and has to be retried
+            self.failed.add(self.path)
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.parts[self.path] = body
+        self.send_response(200)
+        self.send_header('ETag', '"%s"' % self.path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        self.__class__.completion = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LfsUploadCommandTest(unittest.TestCase):
+    def setUp(self):
+        _MultipartHandler.parts = {}
+        _MultipartHandler.failed = set()
+        _MultipartHandler.completion = None
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _MultipartHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.content = os.urandom(1024 * 100 + 7)
+        self.file_path = os.path.join(self.tmp.name, 'model.bin')
+        with open(self.file_path, 'wb') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_upload_parts_concurrently(self):
+        chunk_size = 1024 * 32
+        header = {'chunk_size': str(chunk_size)}
+        header.update({'%05d' % i: '%s/part/%d' % (self.url, i) for i in range(1, 5)})
+        messages = [
+            {'event': 'init', 'operation': 'upload'},
+            {'event': 'upload', 'oid': 'abc', 'path': self.file_path,
+             'action': {'href': self.url + '/complete', 'header': header}},
+            {'event': 'terminate'},
+        ]
+        stdin = io.StringIO(''.join(json.dumps(m) + '\n' for m in messages))
+        stdout = io.StringIO()
+        with mock.patch('sys.stdin', stdin), mock.patch('sys.stdout', stdout):
+            with self.assertRaises(SystemExit) as cm:
+                LfsUploadCommand().run()
+        self.assertEqual(cm.exception.code, 0)
+
+        uploaded = b''.join(_MultipartHandler.parts['/part/%d' % i] for i in range(1, 5))
+        self.assertEqual(uploaded, self.content)
+        self.assertEqual(_MultipartHandler.completion['parts'],
+                         [{'etag': '"/part/%d"' % i, 'partNumber': i} for i in range(1, 5)])
+
+        events = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(events[-1], {'event': 'complete', 'oid': 'abc'})
+        progress = [e for e in events if e.get('event') == 'progress'][1:]
+        self.assertEqual(len(progress), 4)
+        self.assertEqual(progress[-1]['bytesSoFar'], len(self.content))
+        self.assertEqual(sum(e['bytesSinceLast'] for e in progress), len(self.content))
+
+    def test_client_error_not_retried(self):
+        with mock.patch('pycsghub.lfs.Retry.sleep') as sleep:
+            with self.assertRaises(requests.HTTPError) as cm:
+                upload_part(self.file_path, self.url + '/expired', 1, 1024)
+        self.assertEqual(cm.exception.response.status_code, 403)
+        sleep.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
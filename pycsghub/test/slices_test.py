@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import ClassVar, Dict
+
+from pycsghub.upload_large_folder.slices import slice_upload
+from pycsghub.upload_large_folder.status import SliceTask
+
+
+class _PartHandler(BaseHTTPRequestHandler):
+    received: ClassVar[Dict[str, bytes]] = {}
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.__class__.received[self.path] = body
+        self.send_response(200)
+        self.send_header('ETag', '"%s"' % self.path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SliceUploadTest(unittest.TestCase):
+    def setUp(self):
+        _PartHandler.received = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _PartHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.tmp = tempfile.TemporaryDirectory()
+        self.content = os.urandom(1024 * 100 + 7)
+        self.file_path = Path(self.tmp.name) / 'model.bin'
+        self.file_path.write_bytes(self.content)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_slice_upload_sends_file_window(self):
+        chunk_size = 1024 * 32
+        part_count = 4
+        for index in range(1, part_count + 1):
+            metadata = SimpleNamespace(size=len(self.content),
+                                       lfs_upload_chunk_size=chunk_size,
+                                       lfs_upload_part_count=part_count)
+            task = SliceTask(item=(SimpleNamespace(file_path=self.file_path), metadata),
+                             index=index, url='%s/part/%d' % (self.url, index))
+            headers = slice_upload(task)
+            self.assertEqual(headers['ETag'], '"/part/%d"' % index)
+        uploaded = b''.join(_PartHandler.received['/part/%d' % i] for i in range(1, part_count + 1))
+        self.assertEqual(uploaded, self.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,15 @@
+import hashlib
+import os
+import tempfile
+import threading
 import unittest
-from pycsghub.snapshot_download import snapshot_download
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import ClassVar, List
+from unittest.mock import patch
+from pycsghub.snapshot_download import _large_file_connections, snapshot_download
 from pycsghub.file_download import file_download
+from pycsghub.cache import ModelFileSystemCache
 from pycsghub.errors import InvalidParameter
 
 
@@ -58,5 +67,117 @@ class MyTestCase(unittest.TestCase):
         print(result)
 
 
+def _file_content(repo_file):
+    return repo_file.encode() * 100
+
+
+class _RepoFileHandler(BaseHTTPRequestHandler):
+    requested_paths: ClassVar[List[str]] = []
+
+    def do_GET(self):
+        self.__class__.requested_paths.append(self.path)
+        body = _file_content(self.path.split('/resolve/main/', 1)[1])
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SnapshotDownloadBackendTest(unittest.TestCase):
+    repo_files: ClassVar[List[str]] = ['config.json', 'tokenizer.json', 'shards/model-00001.safetensors']
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _RepoFileHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.tmp = tempfile.TemporaryDirectory()
+        _RepoFileHandler.requested_paths = []
+        # only the safetensors shard is stored with LFS
+        lfs_file = self.repo_files[-1]
+        lfs = SimpleNamespace(sha256=hashlib.sha256(_file_content(lfs_file)).hexdigest())
+        sizes = {'config.json': 10, 'tokenizer.json': 1000, lfs_file: 500}
+        self.repo_info = SimpleNamespace(sha='abc', siblings=[
+            SimpleNamespace(rfilename=f, size=sizes[f], lfs=lfs if f == lfs_file else None) for f in self.repo_files])
+        patcher = patch('pycsghub.utils.get_repo_info', return_value=self.repo_info)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def _snapshot(self, backend, local_dir, repo_id='ns/repo', **kwargs):
+        return snapshot_download(repo_id,
+                                 cache_dir=os.path.join(self.tmp.name, 'cache'),
+                                 local_dir=local_dir,
+                                 endpoint=self.endpoint,
+                                 token='token',
+                                 quiet=True,
+                                 backend=backend,
+                                 **kwargs)
+
+    def test_async_backend_matches_thread_backend(self):
+        for backend in ('thread', 'async'):
+            local_dir = os.path.join(self.tmp.name, backend)
+            self.assertEqual(self._snapshot(backend, local_dir), local_dir)
+            for repo_file in self.repo_files:
+                with open(os.path.join(local_dir, repo_file), 'rb') as f:
+                    self.assertEqual(f.read(), _file_content(repo_file))
+
+    def test_lfs_file_linked_from_blob(self):
+        self._snapshot('thread', os.path.join(self.tmp.name, 'base'))
+        _RepoFileHandler.requested_paths = []
+        local_dir = os.path.join(self.tmp.name, 'finetune')
+        self._snapshot('thread', local_dir, repo_id='ns/finetune')
+        self.assertEqual(set(_RepoFileHandler.requested_paths),
+                         {'/csg/ns/finetune/resolve/main/config.json', '/csg/ns/finetune/resolve/main/tokenizer.json'})
+        with open(os.path.join(local_dir, self.repo_files[-1]), 'rb') as f:
+            self.assertEqual(f.read(), _file_content(self.repo_files[-1]))
+
+    def test_moved_branch_not_served_from_old_snapshot(self):
+        local_dir = os.path.join(self.tmp.name, 'repo')
+        self._snapshot('thread', local_dir)
+        self.repo_info.sha = 'def'
+        _RepoFileHandler.requested_paths = []
+        self._snapshot('thread', local_dir)
+        # the LFS shard has the same oid in both commits and is linked from its blob
+        self.assertEqual(set(_RepoFileHandler.requested_paths),
+                         {'/csg/ns/repo/resolve/main/config.json', '/csg/ns/repo/resolve/main/tokenizer.json'})
+        cache = ModelFileSystemCache(os.path.join(self.tmp.name, 'cache'), 'ns', 'repo')
+        self.assertEqual(cache.get_ref('main'), 'def')
+        self.assertTrue(os.path.exists(cache.get_snapshot_path({'Path': 'config.json', 'Revision': 'def'})))
+
+    def test_dry_run_matches_download(self):
+        local_dir = os.path.join(self.tmp.name, 'repo')
+        self.assertTrue(all(info.will_download for info in self._snapshot('thread', local_dir, dry_run=True)))
+        self._snapshot('thread', local_dir)
+        self.assertFalse(any(info.will_download for info in self._snapshot('thread', local_dir, dry_run=True)))
+        self.assertTrue(all(info.will_download for info in self._snapshot(
+                'thread', local_dir, dry_run=True, force_download=True)))
+
+    def test_largest_file_first(self):
+        self._snapshot('thread', self.tmp.name, max_workers=1)
+        downloaded = [p.rsplit('/resolve/main/', 1)[1] for p in _RepoFileHandler.requested_paths]
+        self.assertEqual(list(dict.fromkeys(downloaded)),
+                         ['tokenizer.json', 'shards/model-00001.safetensors', 'config.json'])
+
+    def test_large_file_connections(self):
+        sizes = {'a': 30, 'b': 1, 'c': 1}
+        self.assertEqual(_large_file_connections(['a', 'b', 'c'], sizes, 4, 2), {'a': 8})
+        self.assertEqual(_large_file_connections(['a', 'b', 'c'], sizes, 4, 1), {})
+
+    def test_async_backend_rejects_range_options(self):
+        with self.assertRaises(ValueError):
+            self._snapshot('async', self.tmp.name, max_connections=8)
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            self._snapshot('process', self.tmp.name)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,421 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from pycsghub import hash_cache as hash_cache_module
+from pycsghub.hash_cache import HashCache
+
+from pycsghub.upload_large_folder.local_folder import (LocalUploadFileMetadata, SliceEtags, csghub_dir, get_local_upload_paths,
+                                                       get_upload_metadata_store, read_upload_metadata)
+from pycsghub.upload_large_folder.sha import git_hash, sha_file
+import requests
+
+from pycsghub.upload_large_folder.concurrency import AdaptiveLimit, CommitBudget, is_congestion_error
+from pycsghub.upload_large_folder.consts import DEFAULT_IGNORE_PATTERNS, REPO_LFS_TYPE, REPO_REGULAR_TYPE
+from pycsghub.upload_large_folder.jobs import _determine_next_job, _get_items_to_commit
+from pycsghub.upload_large_folder.main import _discover_files
+from pycsghub.upload_large_folder.path import walk_files
+from pycsghub.upload_large_folder.status import LargeUploadStatus, WorkerJob
+from pycsghub.upload_large_folder.workers import (_compute_sha256, _execute_job_get_upload_model,
+                                                  _execute_job_pre_upload_lfs, _hashing_job,
+                                                  _requeue_uploaded_lfs_file)
+
+
+class HashingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name) / 'folder'
+        self.folder.mkdir()
+        self.hash_cache = HashCache(Path(self.tmp.name) / 'hashes.sqlite')
+        patcher = mock.patch.object(hash_cache_module, '_hash_cache', self.hash_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        get_upload_metadata_store(self.folder).close()
+        self.hash_cache.close()
+        self.tmp.cleanup()
+
+    def _items(self, contents):
+        items = []
+        for name, content in contents.items():
+            (self.folder / name).write_bytes(content)
+            items.append((get_local_upload_paths(self.folder, name), read_upload_metadata(self.folder, name)))
+        return items
+
+    def test_sha_file(self):
+        content = os.urandom(1024 * 10 + 3)
+        (self.folder / 'model.bin').write_bytes(content)
+        sha256, sha1 = sha_file(self.folder / 'model.bin', len(content), chunk_size=1024)
+        self.assertEqual(sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(sha1, git_hash(content))
+
+    def _fetch_upload_modes(self, ignored=()):
+        def fetch_upload_modes(payload, **kwargs):
+            return {'data': {'files': [{'path': f['path'], 'isDir': False, 'uploadMode': REPO_LFS_TYPE,
+                                        'shouldIgnore': f['path'] in ignored, 'oid': None}
+                                       for f in payload['files']]}}
+        return mock.Mock(fetch_upload_modes=fetch_upload_modes)
+
+    def _get_upload_mode(self, status, api):
+        items = _determine_next_job(status)[1]
+        _execute_job_get_upload_model(items, status, api=api, repo_id='owner/name', repo_type='model',
+                                      revision='main', endpoint='', token='')
+
+    def test_hashing_job_routes_hashed_files(self):
+        contents = {'%d.bin' % i: os.urandom(1024 + i) for i in range(8)}
+        status = LargeUploadStatus(self._items(contents))
+        # the upload mode is resolved from the path and the size, before hashing
+        self.assertEqual(status.queue_get_upload_mode.qsize(), 8)
+        self._get_upload_mode(status, self._fetch_upload_modes())
+        self.assertEqual(status.queue_sha256.qsize(), 8)
+        _hashing_job(status)
+        self.assertEqual(status.queue_sha256.qsize(), 0)
+        self.assertEqual(status.nb_workers_sha256, 0)
+        self.assertEqual(status.queue_preupload_lfs.qsize(), 8)
+        for paths, metadata in status.items:
+            self.assertEqual(metadata.sha256, hashlib.sha256(contents[paths.path_in_repo]).hexdigest())
+        reloaded = read_upload_metadata(self.folder, '0.bin')
+        self.assertEqual(reloaded.sha256, hashlib.sha256(contents['0.bin']).hexdigest())
+
+
+    def test_ignored_files_not_hashed(self):
+        status = LargeUploadStatus(self._items({'model.bin': b'weights', 'ignored.bin': b'ignored'}))
+        self._get_upload_mode(status, self._fetch_upload_modes(ignored={'ignored.bin'}))
+        self.assertEqual([paths.path_in_repo for paths, _ in status.queue_sha256.queue], ['model.bin'])
+        with mock.patch('pycsghub.upload_large_folder.workers.sha_file', wraps=sha_file) as hashed:
+            _hashing_job(status)
+        self.assertEqual([call.args[0] for call in hashed.call_args_list], [self.folder / 'model.bin'])
+        self.assertIsNone(read_upload_metadata(self.folder, 'ignored.bin').sha256)
+
+
+    def test_hash_cache_skips_unchanged_files(self):
+        content = os.urandom(1024)
+        item = self._items({'model.bin': content})[0]
+        _compute_sha256(item)
+        expected = (hashlib.sha256(content).hexdigest(), git_hash(content))
+        self.assertEqual(self.hash_cache.get(os.stat(self.folder / 'model.bin')), expected)
+
+        # a new upload run of the same file reuses the cached hashes
+        _, metadata = item
+        metadata.sha256 = metadata.sha1 = None
+        with mock.patch('pycsghub.upload_large_folder.workers.sha_file', side_effect=AssertionError):
+            _compute_sha256(item)
+        self.assertEqual((metadata.sha256, metadata.sha1), expected)
+
+        # a modified file is hashed again
+        st = os.stat(self.folder / 'model.bin')
+        os.utime(self.folder / 'model.bin', ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertIsNone(self.hash_cache.get(os.stat(self.folder / 'model.bin')))
+
+
+    def test_file_resized_after_discovery(self):
+        item = self._items({'model.bin': b'weights'})[0]
+        content = b'new weights'
+        (self.folder / 'model.bin').write_bytes(content)
+        _compute_sha256(item)
+        _, metadata = item
+        self.assertEqual(metadata.size, len(content))
+        self.assertEqual((metadata.sha256, metadata.sha1), (hashlib.sha256(content).hexdigest(), git_hash(content)))
+        self.assertEqual(self.hash_cache.get(os.stat(self.folder / 'model.bin')), (metadata.sha256, metadata.sha1))
+
+
+    def test_waiting_worker_woken_by_new_item(self):
+        status = LargeUploadStatus(self._items({'model.bin': b'weights'}))
+        item = status.queue_get_upload_mode.get()
+        jobs = []
+        worker = threading.Thread(target=lambda: jobs.append(_determine_next_job(status)))
+        started = time.monotonic()
+        worker.start()
+        time.sleep(0.1)
+        self.assertEqual(status.nb_workers_waiting, 1)
+        status.queue_get_upload_mode.put(item)
+        worker.join()
+        # well before the wait timeout
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(jobs, [(WorkerJob.GET_UPLOAD_MODE, [item])])
+
+        self.assertFalse(status.is_done())
+        item[1].is_committed = True
+        status.mark_processed([item])
+        self.assertTrue(status.wait_done(timeout=0))
+        self.assertIsNone(_determine_next_job(status))
+
+
+    def test_previously_ignored_file_is_remaining(self):
+        item = self._items({'model.bin': b'weights'})[0]
+        item[1].should_ignore = True
+        status = LargeUploadStatus([item])
+        self.assertEqual(status.queue_get_upload_mode.qsize(), 1)
+        self.assertFalse(status.is_done())
+        # the server no longer ignores the file
+        self._get_upload_mode(status, self._fetch_upload_modes())
+        self.assertFalse(item[1].should_ignore)
+        self.assertFalse(status.is_done())
+
+
+    def test_hashing_job_waits_for_discovery(self):
+        status = LargeUploadStatus([], discovering=True)
+        hashing = threading.Thread(target=_hashing_job, args=(status,))
+        hashing.start()
+        for item in self._items({'a.bin': b'a', 'b.bin': b'b'}):
+            time.sleep(0.05)
+            status.add_item(item)
+        self.assertTrue(hashing.is_alive())
+        self.assertFalse(status.is_done())
+        status.finish_discovery()
+        # files waiting for their upload mode are still to be hashed
+        time.sleep(0.05)
+        self.assertTrue(hashing.is_alive())
+        self._get_upload_mode(status, self._fetch_upload_modes())
+        hashing.join(timeout=5)
+        self.assertFalse(hashing.is_alive())
+        self.assertEqual(status.queue_preupload_lfs.qsize(), 2)
+
+    def test_aborted_discovery_not_committed(self):
+        status = LargeUploadStatus([], discovering=True)
+        hashing = threading.Thread(target=_hashing_job, args=(status,))
+        hashing.start()
+        jobs = []
+        worker = threading.Thread(target=lambda: jobs.append(_determine_next_job(status)))
+        for item in self._items({'a.bin': b'a'}):
+            item[1].sha256, item[1].upload_mode, item[1].remote_oid = 'a' * 64, REPO_REGULAR_TYPE, 'oid'
+            status.add_item(item)
+        worker.start()
+        status.abort()
+        worker.join(timeout=5)
+        hashing.join(timeout=5)
+        self.assertFalse(worker.is_alive() or hashing.is_alive())
+        self.assertEqual(jobs, [None])
+        self.assertEqual(status.queue_commit.qsize(), 1)
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch('pycsghub.upload_large_folder.concurrency.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _window(self, limit, nbytes):
+        self.now += limit.window
+        limit.on_success(nbytes)
+
+    def test_grows_with_throughput_and_backs_off(self):
+        limit = AdaptiveLimit('test', initial=2, minimum=1, maximum=8)
+        self._window(limit, 100)
+        self._window(limit, 200)
+        self.assertEqual(limit.limit, 4)
+        # flat throughput holds the limit, a slower window steps back
+        self._window(limit, 200)
+        self.assertEqual(limit.limit, 4)
+        self._window(limit, 100)
+        self.assertEqual(limit.limit, 3)
+
+        limit.on_congestion()
+        self.assertEqual(limit.limit, 1)
+        limit.limit = 8
+        # at most one decrease per window
+        limit.on_congestion()
+        self.assertEqual(limit.limit, 8)
+        self.now += limit.window
+        limit.on_congestion()
+        self.assertEqual(limit.limit, 4)
+
+    def test_is_congestion_error(self):
+        def _http_error(status_code):
+            response = requests.Response()
+            response.status_code = status_code
+            return requests.HTTPError(response=response)
+
+        self.assertTrue(is_congestion_error(_http_error(429)))
+        self.assertTrue(is_congestion_error(_http_error(503)))
+        self.assertTrue(is_congestion_error(requests.ReadTimeout()))
+        self.assertFalse(is_congestion_error(_http_error(403)))
+        self.assertFalse(is_congestion_error(ValueError()))
+
+
+class CommitBatchingTest(unittest.TestCase):
+    def _queue(self, sizes, upload_mode='regular'):
+        queue = LargeUploadStatus([]).queue_commit
+        for i, size in enumerate(sizes):
+            queue.put(('%d.bin' % i, LocalUploadFileMetadata(size=size, upload_mode=upload_mode)))
+        return queue
+
+    def test_batches_by_payload_size(self):
+        budget = CommitBudget(max_files=150, initial_bytes=4000, min_bytes=1000)
+        queue = self._queue([1500, 1500, 1500, 6000, 10])
+        # base64 grows 1500 bytes to 2000
+        self.assertEqual(len(_get_items_to_commit(queue, budget)), 2)
+        self.assertEqual(len(_get_items_to_commit(queue, budget)), 1)
+        # a file larger than the budget is committed alone
+        self.assertEqual(len(_get_items_to_commit(queue, budget)), 1)
+        self.assertEqual(len(_get_items_to_commit(queue, budget)), 1)
+
+    def test_failed_commit_is_split(self):
+        budget = CommitBudget(max_files=150, target_latency=60)
+        queue = self._queue([10] * 40, upload_mode='lfs')
+        items = _get_items_to_commit(queue, budget)
+        self.assertEqual(len(items), 40)
+        budget.on_failure(len(items), 40 * 256)
+        for item in items:
+            queue.put(item)
+        self.assertEqual(len(_get_items_to_commit(queue, budget)), 20)
+
+        budget.on_success(20, 20 * 256, elapsed=1)
+        self.assertEqual(budget.max_files, 40)
+        budget.on_success(20, 20 * 256, elapsed=120)
+        self.assertEqual(budget.max_bytes, budget.min_bytes)
+
+
+class PreuploadLfsTest(unittest.TestCase):
+    def _batch_info(self, payload, **kwargs):
+        self.requests.append(payload)
+        return {'objects': [{'oid': o['oid'], 'actions': {
+            'upload': {'href': 'https://lfs/%s/complete' % o['oid'], 'header': {
+                'chunk_size': '4', '1': 'https://lfs/%s/1?uploadId=u' % o['oid'],
+                '2': 'https://lfs/%s/2?uploadId=u' % o['oid']}},
+            'verify': {'href': 'https://lfs/verify'}}} for o in payload['objects']]}
+
+    def test_batched_preupload(self):
+        self.requests = []
+        items = [(SimpleNamespace(file_path=Path('%d.bin' % i), path_in_repo='%d.bin' % i),
+                  LocalUploadFileMetadata(size=8, upload_mode=REPO_LFS_TYPE, sha256='%064d' % i)) for i in range(3)]
+        status = LargeUploadStatus([])
+        for item in items:
+            status.queue_preupload_lfs.put(item)
+        # the resumed upload is requested alone with its upload id
+        items[2][1].lfs_upload_id = 'resumed'
+        job, batch = _determine_next_job(status)
+        self.assertEqual((job, len(batch)), (WorkerJob.PREUPLOAD_LFS, 3))
+        _execute_job_pre_upload_lfs(batch, status, api=mock.Mock(fetch_lfs_batch_info=self._batch_info),
+                                    repo_id='owner/name', repo_type='model', revision='main', endpoint='', token='')
+        self.assertEqual([len(r['objects']) for r in self.requests], [1, 2])
+        self.assertEqual([r['upload_id'] for r in self.requests], ['resumed', None])
+        self.assertEqual(status.queue_uploading_lfs.qsize(), 6)
+        self.assertEqual(status.queue_preupload_lfs.qsize(), 0)
+
+        # a file is back for completion once all of its slices are uploaded
+        tasks = list(status.queue_uploading_lfs.queue)
+        self.assertEqual({id(task.item) for task in tasks}, {id(item) for item in items})
+        for task in tasks:
+            paths, _ = task.item
+            status.append_lfs_uploaded_slice_id(task.item, task.index, 'etag')
+            _requeue_uploaded_lfs_file(paths.file_path, status)
+        self.assertEqual(sorted(paths.path_in_repo for paths, _ in status.queue_preupload_lfs.queue),
+                         ['0.bin', '1.bin', '2.bin'])
+
+
+class WalkFilesTest(unittest.TestCase):
+    def test_walk_files_prunes_ignored_directories(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = Path(tmp)
+            for name in ['a.txt', 'sub/b.txt', 'sub/.git/config', '.git/HEAD', '.cache/csghub/upload.sqlite']:
+                (folder / name).parent.mkdir(parents=True, exist_ok=True)
+                (folder / name).write_text(name)
+            listed = []
+            real_scandir = os.scandir
+            with mock.patch('os.scandir', side_effect=lambda d: listed.append(d) or real_scandir(d)):
+                files = sorted(walk_files(folder, ignore_patterns=DEFAULT_IGNORE_PATTERNS))
+            self.assertEqual(files, ['a.txt', 'sub/b.txt'])
+            self.assertEqual(sorted(os.path.relpath(d, tmp) for d in listed), ['.', '.cache', 'sub'])
+
+
+class DiscoverFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        for name in ['a.bin', 'b.bin', 'c.bin']:
+            (self.folder / name).write_bytes(name.encode())
+        patcher = mock.patch('pycsghub.upload_large_folder.main._hashing_job')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        get_upload_metadata_store(self.folder).close()
+        self.tmp.cleanup()
+
+    def _discover(self):
+        hashing_threads = []
+        with mock.patch('os.cpu_count', return_value=2):
+            _discover_files(LargeUploadStatus([], discovering=True), self.folder, None, DEFAULT_IGNORE_PATTERNS,
+                            hashing_threads)
+        for thread in hashing_threads:
+            thread.join()
+        return hashing_threads
+
+    def test_hashing_threads_sized_to_files_to_hash(self):
+        self.assertEqual(len(self._discover()), 2)
+        for name in ['a.bin', 'b.bin', 'c.bin']:
+            metadata = read_upload_metadata(self.folder, name)
+            metadata.sha256 = 'a' * 64
+            metadata.save(get_local_upload_paths(self.folder, name))
+        self.assertEqual(self._discover(), [])
+
+
+class UploadMetadataStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self.tmp.name)
+        (self.folder / 'model.bin').write_bytes(b'weights')
+
+    def tearDown(self):
+        get_upload_metadata_store(self.folder).close()
+        self.tmp.cleanup()
+
+    def test_metadata_reloaded_after_close(self):
+        paths = get_local_upload_paths(self.folder, 'model.bin')
+        metadata = read_upload_metadata(self.folder, 'model.bin')
+        metadata.sha256 = 'a' * 64
+        metadata.upload_mode = 'lfs'
+        metadata.lfs_uploaded_ids.add(1, 'etag1')
+        metadata.lfs_uploaded_ids.add(3, 'etag3')
+        metadata.save(paths)
+        # the saved metadata is serialized when it is written
+        metadata.lfs_uploaded_ids.add(2, 'etag2')
+        paths.store.close()
+
+        reloaded = read_upload_metadata(self.folder, 'model.bin')
+        self.assertEqual(reloaded.sha256, 'a' * 64)
+        self.assertEqual(reloaded.upload_mode, 'lfs')
+        self.assertEqual(reloaded.lfs_uploaded_ids.serialize(), 'etag1,etag2,etag3')
+        self.assertFalse(reloaded.is_committed)
+        self.assertIsNone(reloaded.should_ignore)
+
+    def test_slice_etags(self):
+        etags = SliceEtags.parse('1:etag1,3:etag3')
+        self.assertEqual((len(etags), etags.get(1), etags.get(2), etags.get(3), etags.get(4)),
+                         (2, 'etag1', None, 'etag3', None))
+        etags.add(3, 'etag3')
+        self.assertEqual(len(etags), 2)
+        self.assertEqual(etags.serialize(), 'etag1,,etag3')
+        self.assertEqual(SliceEtags.parse(etags.serialize()).serialize(), 'etag1,,etag3')
+        self.assertIsNone(SliceEtags.parse(None).serialize())
+
+    def test_legacy_metadata_imported(self):
+        legacy = csghub_dir(self.folder) / 'upload' / 'sub'
+        legacy.mkdir(parents=True)
+        (self.folder / 'sub').mkdir()
+        (self.folder / 'sub' / 'a.bin').write_bytes(b'a')
+        (legacy / 'a.bin.metadata').write_text(
+            '[DEFAULT]\ntimestamp=%f\nsize=1\nshould_ignore=False\nsha256=%s\nsha1=\nupload_mode=regular\n'
+            'is_uploaded=False\nis_committed=True\nremote_oid=\nlfs_upload_id=\nlfs_part_count=\n'
+            'lfs_uploaded_ids=\n' % (time.time() + 10, 'b' * 64), encoding='utf-8')
+        (legacy / 'a.bin.lock').write_text('')
+
+        metadata = read_upload_metadata(self.folder, 'sub/a.bin')
+        self.assertEqual(metadata.sha256, 'b' * 64)
+        self.assertEqual(metadata.upload_mode, 'regular')
+        self.assertTrue(metadata.is_committed)
+        self.assertFalse(metadata.should_ignore)
+        self.assertFalse((csghub_dir(self.folder) / 'upload').exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
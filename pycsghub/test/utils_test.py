@@ -1,5 +1,7 @@
+import os
 import unittest
-from pycsghub.utils import model_info
+from pycsghub import utils
+from pycsghub.utils import model_info, get_session, reset_sessions
 
 class MyTestCase(unittest.TestCase):
     token = "your_access_token"
@@ -16,6 +18,42 @@ class MyTestCase(unittest.TestCase):
         print(fetched_model_info.siblings)
 
 
+class SessionTestCase(unittest.TestCase):
+    def tearDown(self):
+        reset_sessions()
+
+    def test_session_shared_per_host(self):
+        session = get_session("https://hub.opencsg.com/api/v1/models")
+        self.assertIs(session, get_session("https://hub.opencsg.com"))
+        self.assertIsNot(session, get_session("https://s3.example.com/bucket/object"))
+
+    def test_session_replaced_by_larger_pool(self):
+        session = get_session("https://hub.opencsg.com")
+        larger = get_session("https://hub.opencsg.com", pool_maxsize=session.csghub_pool_maxsize + 1)
+        self.assertIsNot(session, larger)
+        self.assertEqual(larger.get_adapter("https://hub.opencsg.com")._pool_maxsize,
+                         session.csghub_pool_maxsize + 1)
+        self.assertIs(larger, get_session("https://hub.opencsg.com", pool_maxsize=1))
+
+    def test_uploads_not_retried_by_session(self):
+        retry = get_session("https://hub.opencsg.com").get_adapter("https://hub.opencsg.com").max_retries
+        self.assertTrue(retry.is_retry("GET", 503))
+        self.assertFalse(retry.is_retry("PUT", 503))
+        self.assertFalse(retry.is_retry("POST", 429))
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_forked_child_gets_new_sessions(self):
+        session = get_session("https://hub.opencsg.com")
+        # the lock held by another thread at fork time must not deadlock the child
+        with utils._sessions_lock:
+            pid = os.fork()
+            if pid == 0:
+                ok = get_session("https://hub.opencsg.com") is not session
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        # the parent sessions are left open
+        self.assertIs(session, get_session("https://hub.opencsg.com"))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+"""Adaptive concurrency limits of the upload stages."""
+
+import logging
+import threading
+import time
+
+import requests
+
+from .consts import ADAPTIVE_DECREASE_TOLERANCE, ADAPTIVE_INCREASE_MIN_GAIN, ADAPTIVE_WINDOW_SECONDS
+from .consts import (COMMIT_PAYLOAD_INITIAL_SIZE, COMMIT_PAYLOAD_MAX_SIZE, COMMIT_PAYLOAD_MIN_SIZE,
+                     COMMIT_TARGET_LATENCY)
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit adjusted at runtime from the throughput of the finished jobs and the congestion errors.
+
+    The throughput is measured over windows of `window` seconds. The limit grows by one (additive increase) while
+    each window is faster than the previous one, goes back by one when a window got slower, and is halved
+    (multiplicative decrease) on a congestion error, at most once per window.
+    """
+
+    def __init__(self, name: str, initial: int, minimum: int, maximum: int, window: float = ADAPTIVE_WINDOW_SECONDS):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.window = window
+        self._lock = threading.Lock()
+        self._window_started = time.monotonic()
+        self._window_bytes = 0
+        self._last_throughput = 0.0
+        self._last_decrease = 0.0
+
+    def on_success(self, nbytes: int):
+        """Account the bytes of a finished job, adjusting the limit at the end of a window."""
+        with self._lock:
+            self._window_bytes += nbytes
+            now = time.monotonic()
+            elapsed = now - self._window_started
+            if elapsed < self.window:
+                return
+            throughput = self._window_bytes / elapsed
+            if throughput > self._last_throughput * (1 + ADAPTIVE_INCREASE_MIN_GAIN):
+                self._set_limit(self.limit + 1, f"throughput up to {throughput:.0f}B/s")
+            elif throughput < self._last_throughput * (1 - ADAPTIVE_DECREASE_TOLERANCE):
+                self._set_limit(self.limit - 1, f"throughput down to {throughput:.0f}B/s")
+            self._last_throughput = throughput
+            self._window_started = now
+            self._window_bytes = 0
+
+    def on_congestion(self):
+        """Halve the limit after a throttling, server or timeout error."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.window:
+                return
+            self._last_decrease = now
+            self._set_limit(self.limit // 2, "congestion")
+            # measure the new limit from scratch
+            self._window_started = now
+            self._window_bytes = 0
+            self._last_throughput = 0.0
+
+    def _set_limit(self, limit: int, reason: str):
+        limit = max(self.minimum, min(limit, self.maximum))
+        if limit != self.limit:
+            logger.debug(f"{self.name} concurrency {self.limit} -> {limit} ({reason})")
+            self.limit = limit
+
+
+class CommitBudget:
+    """
+    Maximum payload bytes and files of the next commit, adapted to the latency and the failures of the commits.
+
+    A commit slower than the target latency halves the byte budget, a commit that used at least half of the budget
+    in less than half of the target latency doubles it. A failed commit halves both the byte budget and the number
+    of files of the failed commit, so that its files are split over smaller commits when they are retried. The file
+    limit doubles back on every successful commit.
+    """
+
+    def __init__(
+        self,
+        max_files: int,
+        initial_bytes: int = COMMIT_PAYLOAD_INITIAL_SIZE,
+        min_bytes: int = COMMIT_PAYLOAD_MIN_SIZE,
+        max_bytes: int = COMMIT_PAYLOAD_MAX_SIZE,
+        target_latency: float = COMMIT_TARGET_LATENCY,
+    ):
+        self.max_files_limit = max_files
+        self.max_files = max_files
+        self.min_bytes = min_bytes
+        self.max_bytes_limit = max_bytes
+        self.max_bytes = max(min_bytes, min(initial_bytes, max_bytes))
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def on_success(self, nb_files: int, nbytes: int, elapsed: float):
+        with self._lock:
+            if elapsed > self.target_latency:
+                self._set_max_bytes(self.max_bytes // 2, f"commit took {elapsed:.1f}s")
+            elif elapsed < self.target_latency / 2 and nbytes >= self.max_bytes // 2:
+                self._set_max_bytes(self.max_bytes * 2, f"commit took {elapsed:.1f}s")
+            self.max_files = min(self.max_files_limit, max(self.max_files, nb_files) * 2)
+
+    def on_failure(self, nb_files: int, nbytes: int):
+        with self._lock:
+            self._set_max_bytes(min(self.max_bytes, nbytes) // 2, "commit failed")
+            self.max_files = max(1, nb_files // 2)
+
+    def _set_max_bytes(self, max_bytes: int, reason: str):
+        max_bytes = max(self.min_bytes, min(max_bytes, self.max_bytes_limit))
+        if max_bytes != self.max_bytes:
+            logger.debug(f"commit payload budget {self.max_bytes} -> {max_bytes} bytes ({reason})")
+            self.max_bytes = max_bytes
+
+
+def is_congestion_error(error: BaseException) -> bool:
+    """Whether `error` means the server or the network is overloaded: 429, 5xx, timeouts and dropped connections."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (requests.Timeout, requests.ConnectionError))
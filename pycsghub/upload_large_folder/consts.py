@@ -24,10 +24,35 @@ DEFAULT_IGNORE_PATTERNS = [
 
 FORBIDDEN_FOLDERS = [".git", ".cache"]
 
+# Concurrency of the slice uploads adapts to the throughput measured over windows of N seconds, it grows while
+# a window is 5% faster than the previous one and shrinks when it is 10% slower
+ADAPTIVE_WINDOW_SECONDS = 5.0
+ADAPTIVE_INCREASE_MIN_GAIN = 0.05
+ADAPTIVE_DECREASE_TOLERANCE = 0.10
+# Byte budget of the base64 content of a commit, adapted between the min and the max so that a commit takes less
+# than the target latency, a failed commit halves the budget and the number of files of the next commit
+COMMIT_PAYLOAD_INITIAL_SIZE = 64 * 1024 * 1024
+COMMIT_PAYLOAD_MIN_SIZE = 1024 * 1024
+COMMIT_PAYLOAD_MAX_SIZE = 512 * 1024 * 1024
+COMMIT_TARGET_LATENCY = 60.0  # seconds
+# Approximate base64 size of the LFS pointer committed for an LFS file
+LFS_POINTER_PAYLOAD_SIZE = 256
+
+# Concurrent metadata requests (upload mode, LFS preupload and commit)
+MAX_NB_METADATA_WORKERS = 4
+# LFS objects requested at once from the LFS batch endpoint
+MAX_NB_LFS_OBJECTS_PER_BATCH = 100
+
+# Buffered upload metadata is written to the folder database every N saved files or N seconds
+METADATA_FLUSH_ENTRIES = 256
+METADATA_FLUSH_INTERVAL = 1.0
+
 # Timeout of aquiring file lock and logging the attempt
 FILELOCK_LOG_EVERY_SECONDS = 10
 
 WAITING_TIME_IF_NO_TASKS = 3  # seconds
+# Large page aligned reads, hashlib releases the GIL while hashing them
+HASHING_CHUNK_SIZE = 8 * 1024 * 1024
 MAX_NB_REGULAR_FILES_PER_COMMIT = 75
 MAX_NB_LFS_FILES_PER_COMMIT = 150
 
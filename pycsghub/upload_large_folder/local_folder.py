@@ -1,10 +1,14 @@
 import logging
 import os
+import shutil
+import sqlite3
+import threading
 import time
 from configparser import ConfigParser
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
+from .consts import METADATA_FLUSH_ENTRIES, METADATA_FLUSH_INTERVAL
 from .fixes import WeakFileLock
 
 logger = logging.getLogger(__name__)
@@ -24,15 +28,212 @@ key_remote_oid = "remote_oid"
 
 cache_path = ".cache"
 cache_csghub = "csghub"
+upload_db_name = "upload.sqlite"
+# per file '<file>.metadata' properties of earlier versions, imported into the database
+legacy_upload_dir = "upload"
 
-@dataclass(frozen=True)
+_columns = (
+    "path", key_timestamp, key_size, key_should_ignore, key_sha256, key_sha1, key_upload_mode, key_is_uploaded,
+    key_is_committed, key_remote_oid, key_lfs_upload_id, key_lfs_part_count, key_lfs_uploaded_ids,
+)
+_schema = f"""
+CREATE TABLE IF NOT EXISTS upload_metadata (
+    path TEXT PRIMARY KEY,
+    {key_timestamp} REAL,
+    {key_size} INTEGER NOT NULL,
+    {key_should_ignore} INTEGER,
+    {key_sha256} TEXT,
+    {key_sha1} TEXT,
+    {key_upload_mode} TEXT,
+    {key_is_uploaded} INTEGER NOT NULL,
+    {key_is_committed} INTEGER NOT NULL,
+    {key_remote_oid} TEXT,
+    {key_lfs_upload_id} TEXT,
+    {key_lfs_part_count} INTEGER,
+    {key_lfs_uploaded_ids} TEXT
+)
+"""
+_select_sql = f"SELECT {', '.join(_columns)} FROM upload_metadata WHERE path = ?"
+_insert_sql = f"INSERT OR REPLACE INTO upload_metadata ({', '.join(_columns)}) VALUES ({', '.join('?' * len(_columns))})"
+
+
+class SliceEtags:
+    """Etags of the uploaded parts of an LFS file, in an array indexed by part number.
+
+    Recording a part and checking completion are O(1) and only hold the lock of the file. The etags are saved as
+    `etag1,etag2,,etag4`, an empty etag for a part not uploaded yet, earlier versions saved `1:etag1,2:etag2`.
+    """
+
+    __slots__ = ("_etags", "_count", "_lock")
+
+    def __init__(self):
+        self._etags: List[Optional[str]] = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, index: int, etag: str) -> None:
+        with self._lock:
+            if index > len(self._etags):
+                self._etags.extend([None] * (index - len(self._etags)))
+            if self._etags[index - 1] is None:
+                self._count += 1
+            self._etags[index - 1] = etag
+
+    def get(self, index: int) -> Optional[str]:
+        with self._lock:
+            return self._etags[index - 1] if index <= len(self._etags) else None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def serialize(self) -> Optional[str]:
+        with self._lock:
+            if self._count == 0:
+                return None
+            return ",".join(etag or "" for etag in self._etags)
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> "SliceEtags":
+        etags = cls()
+        if not value:
+            return etags
+        for index, entry in enumerate(value.split(","), start=1):
+            if ":" in entry:
+                part, entry = entry.split(":", 1)
+                index = int(part)
+            if entry:
+                etags.add(index, entry)
+        return etags
+
+
+class UploadMetadataStore:
+    """Upload state of the files of one local folder, kept in `<folder>/.cache/csghub/upload.sqlite`.
+
+    Saved metadata is buffered and written in a single transaction every `METADATA_FLUSH_ENTRIES` files or
+    `METADATA_FLUSH_INTERVAL` seconds, and on `flush()` / `close()`. The metadata is only turned into a row when
+    it is written, so a file saved again and again, e.g. after every uploaded part, is serialized once per flush.
+    Per file `.metadata` properties left by earlier versions are imported when the store is opened, then removed.
+    """
+
+    def __init__(self, local_dir: Path):
+        self.local_dir = local_dir
+        self.path = csghub_dir(local_dir) / upload_db_name
+        self._lock = threading.Lock()
+        self._pending: Dict[str, "LocalUploadFileMetadata"] = {}
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_schema)
+        legacy_dir = self.path.parent / legacy_upload_dir
+        if legacy_dir.is_dir():
+            self._import_legacy_metadata(legacy_dir)
+
+    def get(self, path_in_repo: str) -> Optional["LocalUploadFileMetadata"]:
+        with self._lock:
+            metadata = self._pending.get(path_in_repo)
+            if metadata is not None:
+                row = metadata.to_row(path_in_repo)
+            else:
+                row = self._conn.execute(_select_sql, (path_in_repo,)).fetchone()
+        return None if row is None else LocalUploadFileMetadata.from_row(row)
+
+    def save(self, path_in_repo: str, metadata: "LocalUploadFileMetadata") -> None:
+        with self._lock:
+            self._pending[path_in_repo] = metadata
+            if (len(self._pending) >= METADATA_FLUSH_ENTRIES
+                    or time.monotonic() - self._last_flush >= METADATA_FLUSH_INTERVAL):
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Write the buffered metadata to the database."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is None:
+                return
+            self._flush_locked()
+            self._conn.close()
+            self._conn = None
+        with _stores_lock:
+            if _stores.get(self.local_dir) is self:
+                del _stores[self.local_dir]
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        self._write([metadata.to_row(path_in_repo) for path_in_repo, metadata in self._pending.items()])
+        self._pending.clear()
+
+    def _write(self, rows, sql: str = _insert_sql) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(sql, rows)
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _import_legacy_metadata(self, legacy_dir: Path) -> None:
+        rows = []
+        for root, _, files in os.walk(legacy_dir):
+            for name in files:
+                if not name.endswith(".metadata"):
+                    continue
+                metadata_path = os.path.join(root, name)
+                path_in_repo = os.path.relpath(metadata_path, legacy_dir)[:-len(".metadata")].replace(os.sep, "/")
+                try:
+                    props = read_properties(metadata_path)
+                    rows.append((
+                        path_in_repo,
+                        float(props.get(key_timestamp)),
+                        int(props.get(key_size)),
+                        _optional_bool(props.get(key_should_ignore)),
+                        props.get(key_sha256) or None,
+                        props.get(key_sha1) or None,
+                        props.get(key_upload_mode) or None,
+                        props.get(key_is_uploaded).lower() == "true",
+                        props.get(key_is_committed).lower() == "true",
+                        props.get(key_remote_oid) or None,
+                        props.get(key_lfs_upload_id) or None,
+                        int(props.get(key_lfs_part_count)) if props.get(key_lfs_part_count) else None,
+                        props.get(key_lfs_uploaded_ids) or None,
+                    ))
+                except Exception as e:
+                    logger.warning(f"invalid metadata file {metadata_path}: {e}. Skipping it.")
+        # state saved in the database by a newer run wins over the legacy files
+        self._write(rows, sql=_insert_sql.replace("INSERT OR REPLACE", "INSERT OR IGNORE"))
+        logger.info(f"imported {len(rows)} legacy upload metadata files from {legacy_dir} into {self.path}")
+        shutil.rmtree(legacy_dir, ignore_errors=True)
+
+
+_stores: Dict[Path, UploadMetadataStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_upload_metadata_store(local_dir: Path) -> UploadMetadataStore:
+    """Get the process wide upload metadata store of `local_dir`, opened on first use."""
+    with _stores_lock:
+        store = _stores.get(local_dir)
+        if store is None:
+            store = _stores[local_dir] = UploadMetadataStore(local_dir)
+        return store
+
+
+def _optional_bool(value: Optional[str]) -> Optional[bool]:
+    return None if not value else value.lower() == "true"
+
+
+@dataclass(frozen=True, slots=True)
 class LocalUploadFilePaths:
     path_in_repo: str
     file_path: Path
-    lock_path: Path
-    metadata_path: Path
+    store: UploadMetadataStore = field(compare=False, repr=False)
     
-@dataclass
+@dataclass(slots=True)
 class LocalUploadFileMetadata:
     """Metadata for a file that is being uploaded to the hub."""
     size: int
@@ -47,102 +248,64 @@ class LocalUploadFileMetadata:
     
     remote_oid: Optional[str] = None # remote oid
     lfs_upload_id: Optional[str] = None # upload id, only used for multipart uploads
-    lfs_uploaded_ids: Optional[str] = None # uploaded ids
+    lfs_uploaded_ids: SliceEtags = field(default_factory=SliceEtags) # etags of uploaded parts
 
     # only for runtime
     lfs_upload_part_count: Optional[int] = None # total number of parts, only used for multipart uploads
-    lfs_upload_part_index: Optional[int] = None # index of part, only used for multipart uploads
-    lfs_upload_part_url: Optional[str] = None # upload url for part
-    lfs_upload_chunk_size: Optional[int] = None
+    lfs_upload_chunk_size: Optional[int] = None # size of parts, the last part holds the remainder
     lfs_upload_complete_url: Optional[str] = None # for merge multi-part
     lfs_upload_verify: Optional[Dict] = None # for verify
-    content_base64: str = ""
     
     def save(self, paths: LocalUploadFilePaths) -> None:
-        """Save the metadata to disk."""
-        with WeakFileLock(paths.lock_path):
-            new_timestamp = time.time()
-            metadata = {
-                key_timestamp: time.time(),
-                key_size: str(self.size),
-                key_should_ignore: "" if self.should_ignore is None else str(self.should_ignore),
-                key_sha256: "" if self.sha256 is None else self.sha256,
-                key_sha1: "" if self.sha1 is None else self.sha1,
-                key_upload_mode: "" if self.upload_mode is None else self.upload_mode,
-                key_is_uploaded: str(self.is_uploaded),
-                key_is_committed: str(self.is_committed),
-                key_remote_oid: "" if self.remote_oid is None else self.remote_oid,
-                key_lfs_upload_id: "" if self.lfs_upload_id is None else self.lfs_upload_id,
-                key_lfs_part_count: "" if self.lfs_upload_part_count is None else str(self.lfs_upload_part_count),
-                key_lfs_uploaded_ids: "" if self.lfs_uploaded_ids is None else self.lfs_uploaded_ids,
-            }
-            save_properties(paths.metadata_path, metadata)
-            self.timestamp = new_timestamp
+        """Save the metadata to the upload metadata store of the folder."""
+        self.timestamp = time.time()
+        paths.store.save(paths.path_in_repo, self)
+
+    def to_row(self, path_in_repo: str) -> Tuple:
+        return (
+            path_in_repo, self.timestamp, self.size, self.should_ignore, self.sha256, self.sha1, self.upload_mode,
+            self.is_uploaded, self.is_committed, self.remote_oid, self.lfs_upload_id, self.lfs_upload_part_count,
+            self.lfs_uploaded_ids.serialize(),
+        )
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "LocalUploadFileMetadata":
+        # remote oid and part count are runtime state, they are fetched again from the server on every run
+        (_, timestamp, size, should_ignore, sha256, sha1, upload_mode, is_uploaded, is_committed,
+         _, lfs_upload_id, _, lfs_uploaded_ids) = row
+        return cls(
+            timestamp=timestamp,
+            size=size,
+            should_ignore=None if should_ignore is None else bool(should_ignore),
+            sha256=sha256 or None,
+            sha1=sha1 or None,
+            upload_mode=upload_mode or None,
+            is_uploaded=bool(is_uploaded),
+            is_committed=bool(is_committed),
+            lfs_upload_id=lfs_upload_id or None,
+            lfs_uploaded_ids=SliceEtags.parse(lfs_uploaded_ids),
+        )
 
 def read_upload_metadata(local_dir: Path, filename: str) -> LocalUploadFileMetadata:
     paths = get_local_upload_paths(local_dir, filename)
-    with WeakFileLock(paths.lock_path):
-        if paths.metadata_path.exists():
-            try:
-                props = read_properties(paths.metadata_path)
-                
-                timestamp = float(props.get(key_timestamp))
-                
-                size = int(props.get(key_size))
-                
-                _should_ignore = props.get(key_should_ignore)
-                should_ignore = None if _should_ignore == "" else _should_ignore.lower() == "true"
-                
-                sha256 = props.get(key_sha256)
-                sha1 = props.get(key_sha1)
-                
-                _upload_mode = props.get(key_upload_mode)
-                upload_mode = None if _upload_mode == "" else _upload_mode
-                
-                is_uploaded = props.get(key_is_uploaded).lower() == "true"
-                is_committed = props.get(key_is_committed).lower() == "true"
-
-                _lfs_upload_id = props.get(key_lfs_upload_id)
-                lfs_upload_id = None if _lfs_upload_id == "" else _lfs_upload_id
-                _lfs_uploaded_ids = props.get(key_lfs_uploaded_ids)
-                lfs_uploaded_ids = None if _lfs_uploaded_ids == "" else _lfs_uploaded_ids
-                
-                metadata = LocalUploadFileMetadata(
-                    timestamp=timestamp,
-                    size=size,
-                    should_ignore=should_ignore,
-                    sha256=sha256,
-                    sha1=sha1,
-                    upload_mode=upload_mode,
-                    is_uploaded=is_uploaded,
-                    is_committed=is_committed,
-                    lfs_upload_id=lfs_upload_id,
-                    lfs_uploaded_ids=lfs_uploaded_ids,
-                )
-            except Exception as e:
-                # remove the metadata file if it is corrupted / not the right format
-                logger.warning(f"invalid metadata file {paths.metadata_path}: {e}. Removing it from disk and continue.")
-                try:
-                    paths.metadata_path.unlink()
-                except Exception as e:
-                    logger.warning(f"could not remove corrupted metadata file {paths.metadata_path}: {e}")
-
-            if (
-                metadata.timestamp is not None
-                and metadata.is_uploaded  # file was uploaded
-                and not metadata.is_committed  # but not committed
-                and time.time() - metadata.timestamp > 20 * 3600  # and it's been more than 20 hours
-            ):
-                metadata.is_uploaded = False
-
-            # check if the file exists and hasn't been modified since the metadata was saved
-            try:
-                if metadata.timestamp is not None and paths.file_path.stat().st_mtime <= metadata.timestamp:
-                    return metadata
-                logger.info(f"ignored metadata for '{filename}' (outdated) and will re-compute hash.")
-            except FileNotFoundError:
-                # file does not exist => metadata is outdated
-                pass
+    metadata = paths.store.get(filename)
+    if metadata is not None:
+        if (
+            metadata.timestamp is not None
+            and metadata.is_uploaded  # file was uploaded
+            and not metadata.is_committed  # but not committed
+            and time.time() - metadata.timestamp > 20 * 3600  # and it's been more than 20 hours
+        ):
+            metadata.is_uploaded = False
+
+        # check if the file exists and hasn't been modified since the metadata was saved
+        try:
+            if metadata.timestamp is not None and paths.file_path.stat().st_mtime <= metadata.timestamp:
+                return metadata
+            logger.info(f"ignored metadata for '{filename}' (outdated) and will re-compute hash.")
+        except FileNotFoundError:
+            # file does not exist => metadata is outdated
+            pass
 
     # empty metadata => we don't know anything expect its size
     return LocalUploadFileMetadata(size=paths.file_path.stat().st_size)
@@ -153,12 +316,6 @@ def read_properties(file_path):
         config.read_string(f.read())
     return dict(config['DEFAULT'])
 
-def save_properties(file_path: str, data: dict) -> None:
-    config = ConfigParser()
-    config['DEFAULT'] = data
-    with open(file_path, 'w', encoding='utf-8') as f:
-        config.write(f, space_around_delimiters=False)
-
 def get_local_upload_paths(local_dir: Path, filename: str) -> LocalUploadFilePaths:
     sanitized_filename = os.path.join(*filename.split("/"))
     if os.name == "nt":
@@ -168,21 +325,15 @@ def get_local_upload_paths(local_dir: Path, filename: str) -> LocalUploadFilePat
                 " owner to rename this file."
             )
     file_path = local_dir / sanitized_filename
-    metadata_path = csghub_dir(local_dir) / "upload" / f"{sanitized_filename}.metadata"
-    lock_path = metadata_path.with_suffix(".lock")
 
     # Some Windows versions do not allow for paths longer than 255 characters.
     # In this case, we must specify it as an extended path by using the "\\?\" prefix
     if os.name == "nt":
-        if not str(local_dir).startswith("\\\\?\\") and len(os.path.abspath(lock_path)) > 255:
+        if not str(local_dir).startswith("\\\\?\\") and len(os.path.abspath(file_path)) > 255:
             file_path = Path("\\\\?\\" + os.path.abspath(file_path))
-            lock_path = Path("\\\\?\\" + os.path.abspath(lock_path))
-            metadata_path = Path("\\\\?\\" + os.path.abspath(metadata_path))
 
-    file_path.parent.mkdir(parents=True, exist_ok=True)
-    metadata_path.parent.mkdir(parents=True, exist_ok=True)
     return LocalUploadFilePaths(
-        path_in_repo=filename, file_path=file_path, lock_path=lock_path, metadata_path=metadata_path
+        path_in_repo=filename, file_path=file_path, store=get_upload_metadata_store(local_dir)
     )
 
 
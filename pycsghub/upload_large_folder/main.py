@@ -3,15 +3,14 @@ import logging
 import threading
 import time
 from pathlib import Path
-from tqdm.auto import tqdm
 from typing import Optional, Union, List
 from pycsghub.cmd.repo_types import RepoType
 from pycsghub.utils import check_repo_type
 from pycsghub.constants import REPO_TYPE_MODEL, REPO_TYPE_DATASET, REPO_TYPE_SPACE, REPO_TYPE_CODE, REPO_TYPE_MCPSERVER, REPO_TYPE_SKILL
-from pycsghub.utils import get_endpoint
-from .path import filter_repo_objects
-from .local_folder import get_local_upload_paths, read_upload_metadata
-from .workers import _worker_job
+from pycsghub.utils import get_endpoint, get_session
+from .path import filter_repo_objects, walk_files
+from .local_folder import get_local_upload_paths, get_upload_metadata_store, read_upload_metadata
+from .workers import _hashing_job, _worker_job
 from .status import LargeUploadStatus
 from .consts import DEFAULT_IGNORE_PATTERNS
 from pycsghub.csghub_api import CsgHubApi
@@ -36,6 +35,7 @@ def upload_large_folder_internal(
     print_report: bool,
     print_report_every: int,
 ):
+    store = None
     try:
         folder_path = Path(local_path).expanduser().resolve()
         if not folder_path.is_dir():
@@ -54,26 +54,16 @@ def upload_large_folder_internal(
         if num_workers is None:
             nb_cores = os.cpu_count() or 1
             num_workers = max(nb_cores - 2, 2)
+        get_session(api_endpoint, pool_maxsize=num_workers)
         
         api = CsgHubApi()
         
         create_repo(api=api, repo_id=repo_id, repo_type=repo_type, revision=revision, endpoint=api_endpoint, token=token)
 
-        filtered_paths_list = filter_repo_objects(
-            (path.relative_to(folder_path).as_posix() for path in folder_path.glob("**/*") if path.is_file()),
-            allow_patterns=allow_patterns,
-            ignore_patterns=ignore_patterns,
-        )
-        
-        paths_list = [get_local_upload_paths(folder_path, relpath) for relpath in filtered_paths_list]
-        
-        items = [
-            (paths, read_upload_metadata(folder_path, paths.path_in_repo))
-            for paths in tqdm(paths_list, desc=f"recovering from cache metadata from {folder_path}/f{cache_path}")
-        ]
-        
+        # Files are discovered while the workers already hash and upload the ones found so far
+        status = LargeUploadStatus([], discovering=True, num_workers=num_workers)
+        store = get_upload_metadata_store(folder_path)
         logger.info(f"starting {num_workers} worker threads for upload tasks")
-        status = LargeUploadStatus(items)
         threads = [
             threading.Thread(
                 target=_worker_job,
@@ -93,16 +83,30 @@ def upload_large_folder_internal(
         for thread in threads:
             thread.start()
 
+        hashing_threads: List[threading.Thread] = []
+        try:
+            _discover_files(status, folder_path, allow_patterns, ignore_patterns, hashing_threads)
+        except Exception:
+            # a truncated listing must not be committed, keep the progress made so far for the next run
+            status.abort()
+            for thread in threads + hashing_threads:
+                thread.join()
+            store.flush()
+            raise
+        status.finish_discovery()
+        threads += hashing_threads
+
         if print_report:
             print('\n' + status.current_report())
         last_report_ts = time.time()
         while True:
-            time.sleep(1)
+            done = status.wait_done(timeout=1)
+            store.flush()
             if time.time() - last_report_ts >= print_report_every:
                 if print_report:
                     print(status.current_report())
                 last_report_ts = time.time()
-            if status.is_done():
+            if done:
                 logging.info("all files are done and exiting main loop")
                 break
 
@@ -111,6 +115,7 @@ def upload_large_folder_internal(
 
         print(status.current_report())
         logging.info("large folder upload process is complete!")
+        store.close()
 
         clean_path = os.path.join(folder_path, cache_path, cache_csghub)
         if os.path.exists(clean_path):
@@ -120,8 +125,38 @@ def upload_large_folder_internal(
                 logging.error(f"failed to remove cache path: {e}")
     except KeyboardInterrupt:
         print("Terminated by Ctrl+C")
+        if store is not None:
+            store.flush()
         os.kill(os.getpid(), signal.SIGTERM)
         
+def _discover_files(
+    status: LargeUploadStatus,
+    folder_path: Path,
+    allow_patterns: Optional[Union[List[str], str]],
+    ignore_patterns: List[str],
+    hashing_threads: List[threading.Thread],
+):
+    """Add the files of folder_path to status while the workers already process the ones found so far.
+
+    A hashing thread is started for each discovered file without a sha256, up to one per core, and appended to
+    `hashing_threads`: a resumed upload with every file already hashed starts none.
+    """
+    max_hashing_workers = os.cpu_count() or 1
+    for relpath in filter_repo_objects(
+        walk_files(folder_path, ignore_patterns=ignore_patterns),
+        allow_patterns=allow_patterns,
+        ignore_patterns=ignore_patterns,
+    ):
+        paths = get_local_upload_paths(folder_path, relpath)
+        metadata = read_upload_metadata(folder_path, relpath)
+        status.add_item((paths, metadata))
+        if not metadata.sha256 and len(hashing_threads) < max_hashing_workers:
+            thread = threading.Thread(target=_hashing_job, kwargs={"status": status})
+            thread.start()
+            hashing_threads.append(thread)
+    logger.info(f"started {len(hashing_threads)} hashing threads")
+
+
 def create_repo(
     api: CsgHubApi,
     repo_id: str,
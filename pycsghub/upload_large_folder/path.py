@@ -1,9 +1,13 @@
+import logging
+import os
 from fnmatch import fnmatch
 from pathlib import Path
 from typing import Callable, Generator, Iterable, List, Optional, TypeVar, Union
 
 T = TypeVar("T")
 
+logger = logging.getLogger(__name__)
+
 def filter_repo_objects(
     items: Iterable[T],
     *,
@@ -45,6 +49,49 @@ def filter_repo_objects(
         yield item
 
 
+def walk_files(
+    folder_path: Union[str, Path],
+    ignore_patterns: Optional[Union[List[str], str]] = None,
+) -> Generator[str, None, None]:
+    """
+    Lazily yield the paths of the files below `folder_path`, relative to it and `/` separated, walking it with
+    `os.scandir`. Symlinks to files are yielded, symlinks to directories are not walked into.
+
+    Directories whose whole content is ignored are skipped without being listed, i.e. directories matching the
+    prefix of an ignore pattern ending with `/`, `/*` or `/**` such as `.git/*`. The yielded paths still need to be
+    filtered with `filter_repo_objects`.
+    """
+    if isinstance(ignore_patterns, str):
+        ignore_patterns = [ignore_patterns]
+    pruned_patterns = []
+    for pattern in ignore_patterns or []:
+        pattern = _add_wildcard_to_directories(pattern)
+        if pattern.endswith("/**"):
+            pruned_patterns.append(pattern[:-3])
+        elif pattern.endswith("/*"):
+            pruned_patterns.append(pattern[:-2])
+
+    stack = [("", os.fspath(folder_path))]
+    while stack:
+        prefix, directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as e:
+            logger.warning(f"cannot list directory {directory}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                path = prefix + entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not any(fnmatch(path, p) for p in pruned_patterns):
+                            stack.append((path + "/", entry.path))
+                    elif entry.is_file():
+                        yield path
+                except OSError as e:
+                    logger.warning(f"cannot stat {entry.path}: {e}")
+
+
 def _add_wildcard_to_directories(pattern: str) -> str:
     if pattern[-1] == "/":
         return pattern + "*"
@@ -1,7 +1,9 @@
 """Utilities to efficiently compute the SHA 256 hash of a bunch of bytes."""
 
-from typing import BinaryIO, Optional, Tuple
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple, Union
 
+from .consts import HASHING_CHUNK_SIZE
 from .hashlib import sha1, sha256
 from tqdm import tqdm
 from .status import JOB_ITEM_T
@@ -40,6 +42,38 @@ def sha_fileobj(fileobj: BinaryIO, item: JOB_ITEM_T, chunk_size: Optional[int] =
     return (sha_256.digest().hex(), sha_1.hexdigest())
 
 
+def sha_file(path: Union[str, Path], size: int, chunk_size: Optional[int] = None) -> Tuple[str, str]:
+    """
+    Computes the sha256 and git-sha1 hash of the file at `path` without a progress bar.
+
+    The file is read unbuffered into one reused buffer of `chunk_size` bytes. hashlib releases the GIL while
+    hashing such large chunks, so files hashed from several threads are hashed on several cores.
+
+    Args:
+        path (`str` or `Path`):
+            The file to compute sha256 and sha1 for.
+        size (`int`):
+            The size of the file, part of the git-sha1 header.
+        chunk_size (`int`, *optional*):
+            The number of bytes to read at once, defaults to `HASHING_CHUNK_SIZE`.
+
+    Returns:
+        `Tuple[str, str]`: the sha256 and the git-sha1 of the file as hexadecimal strings
+    """
+    buffer = memoryview(bytearray(chunk_size or HASHING_CHUNK_SIZE))
+    sha_256 = sha256()
+    sha_1 = sha1()
+    sha_1.update(f'blob {size}\0'.encode('utf-8'))
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            sha_256.update(buffer[:n])
+            sha_1.update(buffer[:n])
+    return (sha_256.hexdigest(), sha_1.hexdigest())
+
+
 def git_hash(data: bytes) -> str:
     """
     Computes the git-sha1 hash of the given bytes, using the same algorithm as git.
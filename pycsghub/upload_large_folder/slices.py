@@ -1,63 +1,109 @@
 import io
-import requests
+import os
 from tqdm import tqdm
 import logging
-from .status import JOB_ITEM_T
-from typing import Dict
+from .status import JOB_ITEM_T, SliceTask
+from pycsghub.bandwidth import host_connection, throttle
+from pycsghub.utils import get_session
 
 logger = logging.getLogger(__name__)
 
-class UploadTracker(io.BytesIO):
-    def __init__(self, data, progress_bar):
-        super().__init__(data)
+class SliceUploadReader(io.RawIOBase):
+    """Read only window [offset, offset + length) of a file, streamed as a request body.
+
+    Data is read from the file on demand in the size asked by the http client, so an in-flight slice only holds
+    one buffer in memory instead of the whole part.
+    """
+
+    def __init__(self, file, offset: int, length: int, progress_bar):
+        self._file = file
+        self._offset = offset
+        self._length = length
+        self._position = 0
         self._progress_bar = progress_bar
 
+    def __len__(self):
+        # requests sends `len` as the Content-Length of file-like bodies
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+        self._position = max(0, min(offset, self._length))
+        return self._position
+
     def read(self, size=-1):
-        chunk = super().read(size)
+        remaining = self._length - self._position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            return b''
+        self._file.seek(self._offset + self._position)
+        chunk = self._file.read(size)
+        self._position += len(chunk)
+        throttle(len(chunk))
         self._progress_bar.update(len(chunk))
         return chunk
 
-def slice_upload(item: JOB_ITEM_T):
-    paths, metadata = item
-    upload_desc = f"uploading {paths.file_path}({metadata.lfs_upload_part_index}/{metadata.lfs_upload_part_count})"
-    
-    read_chunk_size = metadata.lfs_upload_chunk_size
-    if metadata.lfs_upload_part_index == metadata.lfs_upload_part_count:
-        read_chunk_size = metadata.size - (metadata.lfs_upload_part_count - 1) * metadata.lfs_upload_chunk_size
-    
-    chunk_data = None
-    with paths.file_path.open('rb') as f:
-        f.seek((metadata.lfs_upload_part_index - 1) * metadata.lfs_upload_chunk_size)
-        chunk_data = f.read(read_chunk_size)
+    def readinto(self, buffer):
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+def get_slice_size(metadata, index: int) -> int:
+    """Size of the slice `index` of a file, the last slice holds the remainder."""
+    if index == metadata.lfs_upload_part_count:
+        return metadata.size - (metadata.lfs_upload_part_count - 1) * metadata.lfs_upload_chunk_size
+    return metadata.lfs_upload_chunk_size
 
-    total = len(chunk_data)
+def slice_upload(task: SliceTask):
+    paths, metadata = task.item
+    upload_desc = f"uploading {paths.file_path}({task.index}/{metadata.lfs_upload_part_count})"
+    
+    total = get_slice_size(metadata, task.index)
     headers = {
         "Content-Type": "application/octet-stream",
         "Content-Length": str(total)
     }
-    with tqdm(initial=0, total=total, desc=upload_desc, unit="B", unit_scale=True, dynamic_ncols=True) as pbar:
-        upload_data = UploadTracker(chunk_data, pbar)
-        response = requests.put(
-            url=metadata.lfs_upload_part_url,
-            headers=headers,
-            data=upload_data,
-        )
+    with paths.file_path.open('rb') as f, \
+            tqdm(initial=0, total=total, desc=upload_desc, unit="B", unit_scale=True, dynamic_ncols=True) as pbar:
+        upload_data = SliceUploadReader(f,
+                                        offset=(task.index - 1) * metadata.lfs_upload_chunk_size,
+                                        length=total,
+                                        progress_bar=pbar)
+        with host_connection(task.url):
+            response = get_session(task.url).put(
+                url=task.url,
+                headers=headers,
+                data=upload_data,
+            )
         if response.status_code != 200:
-            logger.error(f"LFS slice {paths.file_path}({metadata.lfs_upload_part_index}/{metadata.lfs_upload_part_count}) upload on {metadata.lfs_upload_part_url} response: {response.text}")
+            logger.error(f"LFS slice {paths.file_path}({task.index}/{metadata.lfs_upload_part_count}) upload on {task.url} response: {response.text}")
         response.raise_for_status()
         return response.headers
 
-def slices_upload_complete(item: JOB_ITEM_T, uploaded_ids_map: Dict):
+def slices_upload_complete(item: JOB_ITEM_T):
     paths, metadata = item
     payload = {
         "oid": metadata.sha256,
         "uploadId": metadata.lfs_upload_id,
         "parts": [
-            {"partNumber": i+1, "etag": f"{uploaded_ids_map.get(str(i+1))}"}
-            for i in range(metadata.lfs_upload_part_count)
+            {"partNumber": i, "etag": f"{metadata.lfs_uploaded_ids.get(i)}"}
+            for i in range(1, metadata.lfs_upload_part_count + 1)
         ]
     }
-    response = requests.post(metadata.lfs_upload_complete_url, json=payload)
+    response = get_session(metadata.lfs_upload_complete_url).post(metadata.lfs_upload_complete_url, json=payload)
     if response.status_code != 200 and (response.status_code < 400 or response.status_code >= 500):
         logger.error(f"LFS {paths.file_path} merge all uploaded slices complete on {metadata.lfs_upload_complete_url} response: {response.text}")
     if response.status_code < 400 or response.status_code >= 500:
@@ -72,8 +118,8 @@ def slices_upload_verify(item: JOB_ITEM_T):
     }
     verify_url = metadata.lfs_upload_verify.get("href")
     verify_header = metadata.lfs_upload_verify.get("header")
-    response = requests.post(verify_url, headers=verify_header, json=payload)
+    response = get_session(verify_url).post(verify_url, headers=verify_header, json=payload)
     if response.status_code != 200:
-        logger.error(f"LFS {paths.file_path} slices uploaded verify on {verify_url} response: {response.text}, delete file {paths.metadata_path} and retry")
+        logger.error(f"LFS {paths.file_path} slices uploaded verify on {verify_url} response: {response.text}, delete {paths.store.path} and retry")
     response.raise_for_status()
     return response.text
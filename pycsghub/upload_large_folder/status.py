@@ -1,50 +1,63 @@
 import enum
 import queue
 import logging
-from threading import Lock
+from threading import Condition, Event, RLock
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional, Tuple
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 from .local_folder import LocalUploadFileMetadata, LocalUploadFilePaths
-from .consts import REPO_LFS_TYPE, REPO_REGULAR_TYPE
-import base64
-from io import BytesIO
-from tqdm import tqdm
+from .consts import REPO_LFS_TYPE, REPO_REGULAR_TYPE, MAX_NB_LFS_FILES_PER_COMMIT
 from .consts import META_FILE_IDENTIFIER, META_FILE_OID_PREFIX
+from .concurrency import AdaptiveLimit, CommitBudget
 
 logger = logging.getLogger(__name__)
 
 JOB_ITEM_T = Tuple[LocalUploadFilePaths, LocalUploadFileMetadata]
 
+@dataclass(slots=True)
+class SliceTask:
+    """Upload of the part `index` of an LFS file, all parts share the paths and metadata of the file."""
+    item: JOB_ITEM_T
+    index: int
+    url: str
+
 class WorkerJob(enum.Enum):
-    SHA256 = enum.auto()
     GET_UPLOAD_MODE = enum.auto()
     PREUPLOAD_LFS = enum.auto()
     UPLOADING_LFS = enum.auto()
     COMMIT = enum.auto()
-    WAIT = enum.auto()  # if no tasks are available but we don't want to exit
-
-class ProgressReader:
-    def __init__(self, fileobj, progress_bar):
-        self.fileobj = fileobj
-        self.progress_bar = progress_bar
-    
-    def read(self, size=-1):
-        data = self.fileobj.read(size)
-        if data:
-            self.progress_bar.update(len(data))
-        return data
+
+class JobQueue(queue.Queue):
+    """Queue of items waiting for a job, putting an item wakes up the workers waiting for a job."""
+
+    def __init__(self, job_available: Condition):
+        super().__init__()
+        self.job_available = job_available
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        with self.job_available:
+            self.job_available.notify_all()
 
 class LargeUploadStatus:
     """Contains information, queues and tasks for a large upload process."""
 
-    def __init__(self, items: List[JOB_ITEM_T]):
-        self.items = items
-        self.queue_sha256: "queue.Queue[JOB_ITEM_T]" = queue.Queue()
-        self.queue_get_upload_mode: "queue.Queue[JOB_ITEM_T]" = queue.Queue()
-        self.queue_preupload_lfs: "queue.Queue[JOB_ITEM_T]" = queue.Queue()
-        self.queue_uploading_lfs: "queue.Queue[JOB_ITEM_T]" = queue.Queue()
-        self.queue_commit: "queue.Queue[JOB_ITEM_T]" = queue.Queue()
-        self.lock = Lock()
+    def __init__(self, items: List[JOB_ITEM_T], discovering: bool = False, num_workers: int = 1):
+        """
+        `items` are the files known upfront. With `discovering`, more files are added with `add_item` while the
+        workers already process the queues, until `finish_discovery` is called. Up to `num_workers` workers upload
+        LFS slices at once, depending on the measured throughput.
+        """
+        self.items: List[JOB_ITEM_T] = []
+        # reentrant, queues notify the waiting workers while the lock may already be held
+        self.lock = RLock()
+        self.job_available = Condition(self.lock)
+        self.queue_sha256: "queue.Queue[JOB_ITEM_T]" = JobQueue(self.job_available)
+        self.queue_get_upload_mode: "queue.Queue[JOB_ITEM_T]" = JobQueue(self.job_available)
+        self.queue_preupload_lfs: "queue.Queue[JOB_ITEM_T]" = JobQueue(self.job_available)
+        self.queue_uploading_lfs: "queue.Queue[SliceTask]" = JobQueue(self.job_available)
+        self.queue_commit: "queue.Queue[JOB_ITEM_T]" = JobQueue(self.job_available)
 
         self.nb_workers_sha256: int = 0
         self.nb_workers_get_upload_mode: int = 0
@@ -53,45 +66,81 @@ class LargeUploadStatus:
         self.nb_workers_commit: int = 0
         self.nb_workers_waiting: int = 0
         self.last_commit_attempt: Optional[float] = None
+        self.discovering: bool = True
+        # set when discovery failed, the files found so far must not be committed as the whole folder
+        self.aborted: bool = False
+        self.slice_upload_limit = AdaptiveLimit(
+            "slice upload", initial=max(1, num_workers // 2), minimum=1, maximum=num_workers)
+        self.commit_budget = CommitBudget(max_files=MAX_NB_LFS_FILES_PER_COMMIT)
 
         self._started_at = datetime.now()
-        self._lfs_uploaded_ids = dict()
+        # LFS files whose slices are uploading, by file path
+        self._lfs_uploading_items: Dict[Path, JOB_ITEM_T] = {}
+        # files neither committed nor ignored yet, completion is tracked without scanning all items
+        self._remaining = set()
+        self._done = Event()
+        self._nb_uploaded_and_committed = 0
 
-        # Setup queues
-        num_uploaded_and_commited = 0
-        for item in self.items:
-            paths, metadata = item
-            self._lfs_uploaded_ids[paths.file_path] = metadata.lfs_uploaded_ids
-            
+        for item in items:
+            self.add_item(item)
+        if not discovering:
+            self.finish_discovery()
+
+    def add_item(self, item: JOB_ITEM_T):
+        """Add a discovered file and put it in the queue of its next job."""
+        paths, metadata = item
+        with self.lock:
+            self.items.append(item)
+            # every queued file is remaining until it is committed or ignored, even a file ignored by an earlier
+            # run is queued again when its upload mode has to be resolved, and may no longer be ignored
             if (metadata.upload_mode is not None and metadata.upload_mode == REPO_LFS_TYPE
                 and metadata.is_uploaded and metadata.is_committed):
-                num_uploaded_and_commited += 1
+                self._nb_uploaded_and_committed += 1
             elif (metadata.upload_mode is not None and metadata.upload_mode == REPO_REGULAR_TYPE
                   and metadata.is_committed):
-                num_uploaded_and_commited += 1
-            elif (metadata.sha256 is None or metadata.sha256 == ""):
-                self.queue_sha256.put(item)
-            elif (metadata.upload_mode is None or metadata.upload_mode == "" 
+                self._nb_uploaded_and_committed += 1
+            # the upload mode only needs the path and the size, files are hashed once it is known
+            elif (metadata.sha256 is None or metadata.sha256 == ""
+                  or metadata.upload_mode is None or metadata.upload_mode == "" 
                   or metadata.remote_oid is None or metadata.remote_oid == ""):
+                self._remaining.add(paths.path_in_repo)
                 self.queue_get_upload_mode.put(item)
             elif (metadata.upload_mode == REPO_LFS_TYPE and not metadata.is_uploaded):
+                self._remaining.add(paths.path_in_repo)
                 self.queue_preupload_lfs.put(item)
             elif (not metadata.is_committed):
+                self._remaining.add(paths.path_in_repo)
                 self.queue_commit.put(item)
             else:
-                num_uploaded_and_commited += 1
+                self._nb_uploaded_and_committed += 1
                 logger.debug(f"skipping file {paths.path_in_repo} because they are already uploaded and committed")
-                
-        log_msg = "init upload status"
-        if num_uploaded_and_commited > 0:
-            log_msg = f"{log_msg}, found {len(items)} files, {num_uploaded_and_commited} of which are already uploaded and committed"
-        else:
-            log_msg = f"{log_msg}, found {len(items)} files"
-        log_msg = f"{log_msg}, queue(sha): {self.queue_sha256.qsize()}"
-        log_msg = f"{log_msg}, queue(mode): {self.queue_get_upload_mode.qsize()}"
-        log_msg = f"{log_msg}, queue(preupload): {self.queue_preupload_lfs.qsize()}"
-        log_msg = f"{log_msg}, queue(commit): {self.queue_commit.qsize()}"
-        logger.info(log_msg)
+
+    def finish_discovery(self):
+        """Mark that all files have been added, workers may exit once they are processed."""
+        with self.lock:
+            self.discovering = False
+            self._check_done()
+            self.job_available.notify_all()
+
+            log_msg = "file discovery finished"
+            if self._nb_uploaded_and_committed > 0:
+                log_msg = f"{log_msg}, found {len(self.items)} files, {self._nb_uploaded_and_committed} of which are already uploaded and committed"
+            else:
+                log_msg = f"{log_msg}, found {len(self.items)} files"
+            log_msg = f"{log_msg}, queue(sha): {self.queue_sha256.qsize()}"
+            log_msg = f"{log_msg}, queue(mode): {self.queue_get_upload_mode.qsize()}"
+            log_msg = f"{log_msg}, queue(preupload): {self.queue_preupload_lfs.qsize()}"
+            log_msg = f"{log_msg}, queue(commit): {self.queue_commit.qsize()}"
+            logger.info(log_msg)
+
+    def abort(self):
+        """Stop the upload after a discovery error: workers finish their current job and exit."""
+        with self.lock:
+            self.aborted = True
+            self.discovering = False
+            self._done.set()
+            self.job_available.notify_all()
+            logger.warning(f"upload aborted after discovering {len(self.items)} files")
 
     def current_report(self) -> str:
         """Generate a report of the current status of the large upload."""
@@ -153,83 +202,73 @@ class LargeUploadStatus:
             message += f"hashing: {self.nb_workers_sha256} | "
             message += f"get upload mode: {self.nb_workers_get_upload_mode} | "
             message += f"pre-uploading: {self.nb_workers_preupload_lfs} | "
-            message += f"slices-uploading: {self.nb_workers_uploading_lfs} | "
+            message += f"slices-uploading: {self.nb_workers_uploading_lfs}/{self.slice_upload_limit.limit} | "
             message += f"committing: {self.nb_workers_commit} | "
             message += f"waiting: {self.nb_workers_waiting}\n"
             message += "-" * 51
 
             return message
 
-    def is_done(self) -> bool:
+    def hashing_pending(self) -> bool:
+        """Whether files may still be queued for hashing: files are discovered or wait for their upload mode."""
         with self.lock:
-            return all(metadata.is_committed or metadata.should_ignore for _, metadata in self.items)
+            return not self.aborted and (
+                self.discovering or self.queue_get_upload_mode.qsize() > 0 or self.nb_workers_get_upload_mode > 0)
 
-    def get_lfs_uploaded_slice_ids(self, file_path: str) -> str:
-        with self.lock:
-            return self._lfs_uploaded_ids.get(file_path)
+    def is_done(self) -> bool:
+        return self._done.is_set()
 
-    def append_lfs_uploaded_slice_id(self, file_path: str, id: int, etag: str):
+    def wait_done(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for all files to be committed or ignored, return whether they are."""
+        return self._done.wait(timeout)
+
+    def mark_processed(self, items: List[JOB_ITEM_T]):
+        """Count the items that are now committed or ignored, and wake up the workers waiting for a job."""
         with self.lock:
-            old_ids = self._lfs_uploaded_ids.get(file_path)
-            id_map = self.convert_uploaded_ids_to_map(old_ids)
-            new_ids = ""
-            if len(id_map) == 0:
-                new_ids = f"{id}:{etag}"
-            else:
-                if id_map.get(str(id)) is None:
-                    new_ids = f"{old_ids},{id}:{etag}"
-                else:
-                    new_ids = old_ids
-            self._lfs_uploaded_ids[file_path] = new_ids
-    
-    def convert_uploaded_ids_to_map(self, ids: str):
-        id_map = {}
-        if ids is None or ids == "":
-            return id_map
-        for item in ids.split(','):
-            idx, etag = item.split(':', 2)
-            id_map[idx] = etag
-        return id_map
-            
-    
+            for paths, metadata in items:
+                if metadata.is_committed or metadata.should_ignore:
+                    self._remaining.discard(paths.path_in_repo)
+            self._check_done()
+            self.job_available.notify_all()
+
+    def _check_done(self):
+        if not self.discovering and not self._remaining:
+            self._done.set()
+
+    def append_lfs_uploaded_slice_id(self, item: JOB_ITEM_T, index: int, etag: str):
+        """Record the etag of an uploaded part, only the etags of the file are locked."""
+        _, metadata = item
+        metadata.lfs_uploaded_ids.add(index, etag)
+
     def is_lfs_upload_completed(self, item: JOB_ITEM_T) -> bool:
-        paths, metadata = item
+        _, metadata = item
+        return (metadata.lfs_upload_id is not None and
+                metadata.lfs_upload_part_count is not None and
+                len(metadata.lfs_uploaded_ids) == metadata.lfs_upload_part_count)
+
+    def add_lfs_uploading_item(self, item: JOB_ITEM_T):
+        """Keep an LFS file while its slices are uploading, instead of cycling it through the preupload queue."""
+        paths, _ = item
+        with self.lock:
+            self._lfs_uploading_items[paths.file_path] = item
+
+    def pop_lfs_uploading_item(self, file_path: Path) -> Optional[JOB_ITEM_T]:
+        """Return the LFS file of file_path once all of its slices are uploaded, only once."""
         with self.lock:
-            uploaded_ids = self._lfs_uploaded_ids.get(paths.file_path)
-            if (uploaded_ids is not None and
-                metadata.lfs_upload_id is not None and
-                metadata.lfs_upload_part_count is not None and 
-                len(uploaded_ids.split(",")) == metadata.lfs_upload_part_count):
-                    metadata.lfs_uploaded_ids = uploaded_ids
-                    return True
-        return False
-
-    def compute_file_base64(self, item: JOB_ITEM_T):
-        _, meta = item
+            item = self._lfs_uploading_items.get(file_path)
+            if item is None or not self.is_lfs_upload_completed(item):
+                return None
+            return self._lfs_uploading_items.pop(file_path)
+
+    def get_commit_content(self, item: JOB_ITEM_T) -> Union[Path, bytes]:
+        """Content committed for a file: the LFS pointer of LFS files, the file itself for regular files."""
+        paths, meta = item
         if meta.upload_mode == REPO_LFS_TYPE:
-            self._compute_lfs_file_base64(item=item)
+            content = f"{META_FILE_IDENTIFIER}\n{META_FILE_OID_PREFIX}{meta.sha256}\nsize {meta.size}\n"
+            return content.encode('utf-8')
         elif meta.upload_mode == REPO_REGULAR_TYPE:
-            self._compute_regular_file_base64(item=item)
-    
-    def _compute_lfs_file_base64(self, item: JOB_ITEM_T):
-        _, meta = item
-        content = f"{META_FILE_IDENTIFIER}\n{META_FILE_OID_PREFIX}{meta.sha256}\nsize {meta.size}\n"
-        content_bytes = content.encode('utf-8')
-        meta.content_base64 = base64.b64encode(content_bytes).decode('utf-8')
-    
-    def _compute_regular_file_base64(self, item: JOB_ITEM_T):
-        paths, meta = item
-        # with open(paths.file_path, 'rb') as f, BytesIO() as b64_buffer:
-        #     base64.encode(f, b64_buffer)
-        #     meta.content_base64 = b64_buffer.getvalue().decode("utf-8")
-        
-        desc = f"converting {paths.file_path} to base64"
-        with tqdm(total=meta.size, desc=desc, unit="B", unit_scale=True, dynamic_ncols=True) as pbar:
-            with open(paths.file_path, 'rb') as f, BytesIO() as b64_buffer:
-                progress_reader = ProgressReader(f, pbar)
-                base64.encode(progress_reader, b64_buffer)
-                b64_buffer.seek(0)
-                meta.content_base64 = b64_buffer.getvalue().decode("utf-8")
+            return paths.file_path
+        return b""
 
 def _format_size(num: int) -> str:
     """Format size in bytes into a human-readable string.
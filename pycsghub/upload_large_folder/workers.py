@@ -1,13 +1,14 @@
 import logging
+import queue
 import traceback
 import time
-import copy
 from typing import Optional, List, Tuple, Dict
-from .status import LargeUploadStatus, WorkerJob, JOB_ITEM_T
-from .consts import WAITING_TIME_IF_NO_TASKS
-from .jobs import _determine_next_job
-from .sha import sha_fileobj
+from .status import LargeUploadStatus, WorkerJob, JOB_ITEM_T, SliceTask
+from .jobs import _determine_next_job, get_commit_payload_size
+from .sha import sha_file
+from pycsghub.commit_ops import CommitBody
 from pycsghub.csghub_api import CsgHubApi
+from pycsghub.hash_cache import get_hash_cache
 from .utils import unquote
 from .consts import (
     REPO_REGULAR_TYPE, 
@@ -18,7 +19,8 @@ from .consts import (
     KEY_UPLOADID
 )
 from urllib.parse import urlparse, parse_qs
-from .slices import slice_upload, slices_upload_complete, slices_upload_verify
+from .slices import get_slice_size, slice_upload, slices_upload_complete, slices_upload_verify
+from .concurrency import is_congestion_error
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +35,7 @@ def _worker_job(
 ):
     """
     Main process for a worker. The worker will perform tasks based on the priority list until all files are uploaded
-    and committed. If no tasks are available, the worker will wait for 10 seconds before checking again.
+    and committed. If no tasks are available, the worker waits until a queue gains an item or another worker finishes.
 
     If a task fails for any reason, the item(s) are put back in the queue for another worker to pick up.
     """
@@ -47,9 +49,7 @@ def _worker_job(
         job, items = next_job
         logger.debug(f"next job: {job}")
         # Perform task
-        if job == WorkerJob.SHA256:
-            _execute_job_compute_sha256(items=items, status=status)
-        elif job == WorkerJob.GET_UPLOAD_MODE:
+        if job == WorkerJob.GET_UPLOAD_MODE:
             _execute_job_get_upload_model(
                 items=items, status=status,
                 api=api, endpoint=endpoint, token=token,
@@ -66,8 +66,25 @@ def _worker_job(
                 items=items, status=status,
                 api=api, endpoint=endpoint, token=token,
                 repo_id=repo_id, repo_type=repo_type, revision=revision)
-        elif job == WorkerJob.WAIT:
-            _execute_job_waiting(status=status)
+
+def _hashing_job(status: LargeUploadStatus):
+    """
+    Main process for a hashing worker. Hashing workers are dedicated to the sha256 queue, files are only hashed once
+    their upload mode is known and are handed to their next job as soon as they are hashed. The worker exits once the
+    sha256 queue is empty and no more file can be queued for hashing.
+    """
+    while True:
+        with status.lock:
+            while status.queue_sha256.qsize() == 0 and status.hashing_pending():
+                status.job_available.wait()
+            if status.aborted:
+                return
+            try:
+                item = status.queue_sha256.get_nowait()
+            except queue.Empty:
+                return
+            status.nb_workers_sha256 += 1
+        _execute_job_compute_sha256(items=[item], status=status)
 
 def _execute_job_compute_sha256(
     items: List[JOB_ITEM_T], 
@@ -78,7 +95,8 @@ def _execute_job_compute_sha256(
     try:
         _compute_sha256(item)
         logger.debug(f"computing sha256 for {item[0].file_path} successfully")
-        status.queue_get_upload_mode.put(item)
+        if _route_item(item=item, status=status):
+            logger.debug(f"skipped {paths.path_in_repo} because it is identical to the remote server")
     except KeyboardInterrupt:
         raise
     except Exception as e:
@@ -88,6 +106,7 @@ def _execute_job_compute_sha256(
 
     with status.lock:
         status.nb_workers_sha256 -= 1
+        status.job_available.notify_all()
 
 def _execute_job_get_upload_model(
     items: List[JOB_ITEM_T], 
@@ -112,7 +131,8 @@ def _execute_job_get_upload_model(
         traceback.format_exc()
 
     # Items are either:
-    # - dropped (if should_ignore)
+    # - dropped (if should_ignore), without ever being hashed
+    # - put in sha256 queue (if not hashed yet)
     # - put in LFS queue (if LFS)
     # - put in commit queue (if regular)
     # - or put back (if error occurred).
@@ -123,19 +143,13 @@ def _execute_job_get_upload_model(
         if metadata.should_ignore:
             ignore_num += 1
             continue
-        if ((metadata.upload_mode == REPO_REGULAR_TYPE and metadata.sha1 == metadata.remote_oid) or
-            (metadata.upload_mode == REPO_LFS_TYPE and metadata.sha256 == metadata.remote_oid)):
-            metadata.is_uploaded = True
-            metadata.is_committed = True
-            metadata.save(paths)
-            same_with_remote_num += 1
+        if metadata.upload_mode is not None and metadata.sha256 is None:
+            status.queue_sha256.put(item)
             continue
-        if metadata.upload_mode == REPO_LFS_TYPE:
-            status.queue_preupload_lfs.put(item)
-        elif metadata.upload_mode == REPO_REGULAR_TYPE:
-            status.queue_commit.put(item)
-        else:
-            status.queue_get_upload_mode.put(item)
+        if _route_item(item=item, status=status):
+            same_with_remote_num += 1
+
+    status.mark_processed(items)
 
     if ignore_num > 0:
         logger.info(f"ignored {ignore_num} files because should_ignore is true from remote server")
@@ -145,6 +159,28 @@ def _execute_job_get_upload_model(
     
     with status.lock:
         status.nb_workers_get_upload_mode -= 1
+        status.job_available.notify_all()
+
+def _route_item(item: JOB_ITEM_T, status: LargeUploadStatus) -> bool:
+    """
+    Put a hashed item in the queue of its next job according to its upload mode. Return True if the file is identical
+    to the remote one, the item is then committed already.
+    """
+    paths, metadata = item
+    if ((metadata.upload_mode == REPO_REGULAR_TYPE and metadata.sha1 == metadata.remote_oid) or
+        (metadata.upload_mode == REPO_LFS_TYPE and metadata.sha256 == metadata.remote_oid)):
+        metadata.is_uploaded = True
+        metadata.is_committed = True
+        metadata.save(paths)
+        status.mark_processed([item])
+        return True
+    if metadata.upload_mode == REPO_LFS_TYPE:
+        status.queue_preupload_lfs.put(item)
+    elif metadata.upload_mode == REPO_REGULAR_TYPE:
+        status.queue_commit.put(item)
+    else:
+        status.queue_get_upload_mode.put(item)
+    return False
 
 def _execute_job_pre_upload_lfs(
     items: List[JOB_ITEM_T], 
@@ -156,50 +192,85 @@ def _execute_job_pre_upload_lfs(
     endpoint: str,
     token: str,
 ):
-    item = items[0]  # single item every time
-    paths, metadata = item
-    action = "preupload"
-    try:
-        if status.is_lfs_upload_completed(item):
-            action = f"{action} check complete"
+    # Items are either:
+    # - completed (all slices uploaded) and put in commit queue
+    # - requested in LFS batches, their slices are then uploaded and they come back once all slices are uploaded
+    # - or put back (if error occurred).
+    to_fetch: List[JOB_ITEM_T] = []
+    for item in items:
+        paths, metadata = item
+        if not status.is_lfs_upload_completed(item):
+            to_fetch.append(item)
+            continue
+        try:
             _preupload_lfs_done(item=item, status=status)
             status.queue_commit.put(item)
-        else:
-            action = f"{action} fetch batch info"
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            logger.error(f"failed to preupload check complete lfs {paths.file_path}: {e}")
+            traceback.format_exc()
+            status.queue_preupload_lfs.put(item)
+
+    for batch in _get_lfs_batches(to_fetch):
+        try:
             _preupload_lfs(
-                item=item, status=status,
+                items=batch, status=status,
                 api=api, endpoint=endpoint, token=token,
                 repo_id=repo_id, repo_type=repo_type, revision=revision)
-            # keep in queue preupload
-            status.queue_preupload_lfs.put(item)
-    except KeyboardInterrupt:
-        raise
-    except Exception as e:
-        logger.error(f"failed to {action} lfs {paths.file_path}: {e}")
-        traceback.format_exc()
-        status.queue_preupload_lfs.put(item)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            logger.error(f"failed to preupload fetch batch info of {len(batch)} lfs files: {e}")
+            traceback.format_exc()
+            for item in batch:
+                status.queue_preupload_lfs.put(item)
 
     with status.lock:
-        status.nb_workers_preupload_lfs -= 1   
+        status.nb_workers_preupload_lfs -= 1
+        status.job_available.notify_all()
+
+def _get_lfs_batches(items: List[JOB_ITEM_T]) -> List[List[JOB_ITEM_T]]:
+    """
+    Group LFS files into batch requests. Resumed multipart uploads are requested one by one with their upload id,
+    as are files with the same content as another file of the batch, the others are requested together.
+    """
+    batches: List[List[JOB_ITEM_T]] = []
+    batch: List[JOB_ITEM_T] = []
+    oids = set()
+    for item in items:
+        _, metadata = item
+        if metadata.lfs_upload_id is not None or metadata.sha256 in oids:
+            batches.append([item])
+        else:
+            batch.append(item)
+            oids.add(metadata.sha256)
+    if batch:
+        batches.append(batch)
+    return batches
 
 def _execute_job_uploading_lfs(
-    items: List[JOB_ITEM_T], 
+    items: List[SliceTask], 
     status: LargeUploadStatus,
 ):
-    item = items[0] # single item every time
-    paths, metadata = item
+    task = items[0] # single slice every time
+    paths, metadata = task.item
     try:
-        etag = _perform_lfs_slice_upload(item)
-        status.append_lfs_uploaded_slice_id(paths.file_path, metadata.lfs_upload_part_index, etag)
-        metadata.lfs_uploaded_ids = status.get_lfs_uploaded_slice_ids(paths.file_path)
+        etag = _perform_lfs_slice_upload(task)
+        status.append_lfs_uploaded_slice_id(task.item, task.index, etag)
         metadata.save(paths)
+        status.slice_upload_limit.on_success(get_slice_size(metadata, task.index))
+        _requeue_uploaded_lfs_file(paths.file_path, status)
     except Exception as e:
-        logger.error(f"failed to preupload LFS {paths.file_path} slice {metadata.lfs_upload_part_index}/{metadata.lfs_upload_part_count}: {e}")
+        if is_congestion_error(e):
+            status.slice_upload_limit.on_congestion()
+        logger.error(f"failed to preupload LFS {paths.file_path} slice {task.index}/{metadata.lfs_upload_part_count}: {e}")
         traceback.format_exc()
-        status.queue_uploading_lfs.put(item)
+        status.queue_uploading_lfs.put(task)
         
     with status.lock:
         status.nb_workers_uploading_lfs -= 1
+        status.job_available.notify_all()
 
 def _execute_job_commit(
     items: List[JOB_ITEM_T],
@@ -211,40 +282,45 @@ def _execute_job_commit(
     endpoint: str,
     token: str,
 ):
+    payload_size = sum(get_commit_payload_size(metadata) for _, metadata in items)
     try:
-        for item in items:
-            status.compute_file_base64(item=item)
-        
-        _commit(items, api=api, endpoint=endpoint, token=token,
+        started = time.monotonic()
+        _commit(items, status=status, api=api, endpoint=endpoint, token=token,
             repo_id=repo_id, repo_type=repo_type, revision=revision)
+        status.commit_budget.on_success(len(items), payload_size, time.monotonic() - started)
         logger.info(f"committed {len(items)} items")
+        status.mark_processed(items)
     except KeyboardInterrupt:
         raise
     except Exception as e:
-        logger.error(f"failed to commit: {e}")
+        logger.error(f"failed to commit {len(items)} items ({payload_size} bytes): {e}")
         traceback.format_exc()
+        # the items are split over smaller commits when they are retried
+        status.commit_budget.on_failure(len(items), payload_size)
         for item in items:
             status.queue_commit.put(item)
 
     with status.lock:
         status.last_commit_attempt = time.time()
         status.nb_workers_commit -= 1
-
-def _execute_job_waiting(
-    status: LargeUploadStatus,
-):
-    time.sleep(WAITING_TIME_IF_NO_TASKS)
-    with status.lock:
-        status.nb_workers_waiting -= 1    
+        status.job_available.notify_all()
 
 def _compute_sha256(item: JOB_ITEM_T) -> None:
     """Compute sha256 of a file and save it in metadata."""
     paths, metadata = item
     if metadata.sha256 is None:
-        with paths.file_path.open("rb") as f:
-             sha256, sha1 = sha_fileobj(fileobj=f, item=item)
-             metadata.sha256 = sha256
-             metadata.sha1 = sha1
+        # unchanged files hashed by an earlier run, of any folder or repo, are not hashed again
+        hash_cache = get_hash_cache()
+        st = paths.file_path.stat()
+        if st.st_size != metadata.size:
+            # the file changed since it was discovered, the hashes and the upload are for its current content
+            logger.info(f"{paths.file_path} size changed from {metadata.size} to {st.st_size} since discovery")
+            metadata.size = st.st_size
+        hashes = hash_cache.get(st)
+        if hashes is None:
+            hashes = sha_file(paths.file_path, st.st_size)
+            hash_cache.put(paths.file_path, st, *hashes)
+        metadata.sha256, metadata.sha1 = hashes
              
     metadata.save(paths)
 
@@ -308,9 +384,7 @@ def _preupload_lfs_done(
     status: LargeUploadStatus,
 ):
     paths, metadata = item
-    uploaded_ids = status.get_lfs_uploaded_slice_ids(paths.file_path)
-    uploaded_ids_map = status.convert_uploaded_ids_to_map(uploaded_ids)
-    complete_resp = slices_upload_complete(item=item, uploaded_ids_map=uploaded_ids_map)
+    complete_resp = slices_upload_complete(item=item)
     logger.debug(f"LFS file {paths.file_path} merge {metadata.lfs_upload_part_count} uploaded slices complete response: {complete_resp}")
     verify_resp = slices_upload_verify(item=item)
     logger.debug(f"LFS file {paths.file_path} uploaded verify response: {verify_resp}")
@@ -319,7 +393,7 @@ def _preupload_lfs_done(
     logger.debug(f"LFS file {paths.file_path} - all {metadata.lfs_upload_part_count} slices uploaded successfully")
 
 def _preupload_lfs(
-    item: JOB_ITEM_T,
+    items: List[JOB_ITEM_T],
     status: LargeUploadStatus,
     api: CsgHubApi, 
     repo_id: str, 
@@ -328,12 +402,9 @@ def _preupload_lfs(
     endpoint: str,
     token: str,
 ):
-    """Preupload LFS file and update metadata."""
-    paths, metadata = item
-    
-    if metadata.lfs_upload_part_count is not None and metadata.lfs_upload_part_count > 0:
-        return
-    
+    """Preupload LFS files with a single batch request and queue the upload of their slices."""
+    upload_id = items[0][1].lfs_upload_id if len(items) == 1 else None
+    local_file = items[0][0].file_path if len(items) == 1 else f"{len(items)} files"
     payload: Dict = {
         "operation": "upload",
         "transfers": ["basic", "multipart"],
@@ -342,22 +413,38 @@ def _preupload_lfs(
                 "oid": metadata.sha256,
                 "size": metadata.size,
             }
+            for _, metadata in items
         ],
         "hash_algo": "sha256",
-        "upload_id": metadata.lfs_upload_id,
+        "upload_id": upload_id,
     }
     if revision is not None:
         payload["ref"] = {"name": unquote(revision)}  # revision has been previously 'quoted'
         
     batch_resp = api.fetch_lfs_batch_info(
         payload=payload, endpoint=endpoint, token=token,
-        repo_id=repo_id, repo_type=repo_type, revision=revision, local_file=paths.file_path,
-        upload_id=metadata.lfs_upload_id)
+        repo_id=repo_id, repo_type=repo_type, revision=revision, local_file=local_file,
+        upload_id=upload_id)
     
     objects = batch_resp.get("objects", None)
     if not isinstance(objects, list) or len(objects) < 1:
-        raise ValueError(f"LFS {paths.file_path} malformed batch response objects is not list from server: {batch_resp}")
-    object = objects[0]
+        raise ValueError(f"LFS {local_file} malformed batch response objects is not list from server: {batch_resp}")
+    if len(items) == 1:
+        objects_by_oid = {items[0][1].sha256: objects[0]}
+    else:
+        objects_by_oid = {object.get("oid"): object for object in objects if isinstance(object, dict)}
+
+    for item in items:
+        paths, metadata = item
+        try:
+            _queue_lfs_slices(item=item, object=objects_by_oid.get(metadata.sha256), status=status)
+        except ValueError as e:
+            logger.error(f"failed to preupload fetch batch info lfs {paths.file_path}: {e}")
+            status.queue_preupload_lfs.put(item)
+
+def _queue_lfs_slices(item: JOB_ITEM_T, object: Optional[Dict], status: LargeUploadStatus):
+    """Update metadata of an LFS file from its object of the batch response and queue its slices not uploaded yet."""
+    paths, metadata = item
     
     search_key = "actions"
     if not isinstance(object, dict) or search_key not in object:
@@ -386,12 +473,13 @@ def _preupload_lfs(
     if not isinstance(object_upload_header, Dict):
         raise ValueError(f"incorrect lfs {paths.file_path} slices upload address from server: {object}")
     
-    chunk_size = object_upload_header.pop("chunk_size")
+    chunk_size = object_upload_header.pop("chunk_size", None)
     if chunk_size is None:
         raise ValueError(f"no chunk size found for lfs slices upload of file {paths.file_path}")
     
     total_count = len(object_upload_header)
     metadata.lfs_upload_part_count = total_count
+    metadata.lfs_upload_chunk_size = int(chunk_size)
     metadata.lfs_upload_complete_url = object_upload[href_key]
     metadata.lfs_upload_verify = object_verify
     
@@ -400,23 +488,22 @@ def _preupload_lfs(
     query_params = parse_qs(parsed_url.query)
     metadata.lfs_upload_id = query_params.get(KEY_UPLOADID, [None])[0]
     
-    uploaded_ids = status.get_lfs_uploaded_slice_ids(paths.file_path)
-    existing_ids = status.convert_uploaded_ids_to_map(uploaded_ids)
-    for _, key in enumerate(sorted_keys):
-        if existing_ids.get(key) is not None:
+    status.add_lfs_uploading_item(item)
+    for key in sorted_keys:
+        if metadata.lfs_uploaded_ids.get(int(key)) is not None:
             continue
-        upload_url = object_upload_header.get(key)
-        slice_metadata = copy.deepcopy(metadata)
-        slice_metadata.lfs_upload_part_count = total_count
-        slice_metadata.lfs_upload_part_index = int(key)
-        slice_metadata.lfs_upload_part_url = upload_url
-        slice_metadata.lfs_upload_chunk_size = int(chunk_size)
-        item_slice = [paths, slice_metadata]
-        status.queue_uploading_lfs.put(item_slice)
+        status.queue_uploading_lfs.put(SliceTask(item=item, index=int(key), url=object_upload_header.get(key)))
     logger.debug(f"get LFS {paths.file_path} slices batch info successfully")
+    # all slices may be uploaded already
+    _requeue_uploaded_lfs_file(paths.file_path, status)
+
+def _requeue_uploaded_lfs_file(file_path, status: LargeUploadStatus):
+    item = status.pop_lfs_uploading_item(file_path)
+    if item is not None:
+        status.queue_preupload_lfs.put(item)
 
-def _perform_lfs_slice_upload(item: JOB_ITEM_T):
-    resp_header = slice_upload(item=item)
+def _perform_lfs_slice_upload(task: SliceTask):
+    resp_header = slice_upload(task=task)
     logger.debug(f"slice upload response header: {resp_header}")
     # ('eTag', '"c681604308d0749e988746229fc16b25"')
     etag = resp_header.get("etag")
@@ -426,6 +513,7 @@ def _perform_lfs_slice_upload(item: JOB_ITEM_T):
 
 def _commit(
     items: List[JOB_ITEM_T],
+    status: LargeUploadStatus,
     api: CsgHubApi, 
     repo_id: str, 
     repo_type: str, 
@@ -433,19 +521,19 @@ def _commit(
     endpoint: str,
     token: str,
 ) -> None:
-    """Commit files to the repo."""
+    """Commit files to the repo, their content is base64 encoded while the request is sent."""
     commit_message="Add files using upload-large-folder tool"
-    payload: Dict = {
-        "message": commit_message,
-        "files": [
-            {
-                "path": paths.path_in_repo,
-                "action": COMMIT_ACTION_CREATE if meta.remote_oid is None else COMMIT_ACTION_UPDATE,
-                "content": meta.content_base64,
-            }
+    payload = CommitBody(
+        message=commit_message,
+        files=[
+            (
+                paths.path_in_repo,
+                COMMIT_ACTION_CREATE if meta.remote_oid is None else COMMIT_ACTION_UPDATE,
+                status.get_commit_content((paths, meta)),
+            )
             for paths, meta in items
-        ]
-    }
+        ],
+    )
     
     commit_resp = api.create_commit(
         payload=payload, endpoint=endpoint, token=token,
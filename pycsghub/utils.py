@@ -7,6 +7,7 @@ from pycsghub.constants import OPERATION_ACTION_API, OPERATION_ACTION_GIT, XNET_
 from pycsghub.constants import REPO_TYPE_MODEL, REPO_TYPE_DATASET, REPO_TYPE_SPACE, REPO_TYPE_CODE, REPO_TYPE_MCPSERVER, REPO_TYPE_SKILL
 from pycsghub.constants import REPO_SOURCE_CSG, REPO_SOURCE_HF, REPO_SOURCE_MS, REPO_SOURCE_XET
 import requests
+import httpx
 from huggingface_hub.hf_api import ModelInfo, DatasetInfo, SpaceInfo
 import urllib
 import hashlib
@@ -14,6 +15,9 @@ from pycsghub.errors import FileIntegrityError
 from pycsghub._token import _get_token_from_file, _get_token_from_environment
 from urllib.parse import quote, urlparse
 from pycsghub.constants import S3_INTERNAL
+from pycsghub.constants import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_RETRY_TIMES, API_FILE_DOWNLOAD_TIMEOUT
+from requests.adapters import HTTPAdapter, Retry
+import threading
 import logging
 from huggingface_hub.hf_api import ModelInfo as CodeInfo
 from huggingface_hub.hf_api import ModelInfo as McpserverInfo
@@ -21,17 +25,93 @@ from huggingface_hub.hf_api import ModelInfo as SkillInfo
 
 logger = logging.getLogger(__name__)
 
-def get_session() -> requests.Session:
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(endpoint: Optional[str] = None, pool_maxsize: Optional[int] = None) -> requests.Session:
+    """Get the process-wide pooled session for the host of `endpoint`.
+
+    Sessions are created once per `scheme://host` and reused by every thread, so
+    connections (and TLS handshakes) are kept alive across requests.
+
+    Args:
+        endpoint (str, optional): Any url of the host to talk to. Defaults to the csghub endpoint.
+        pool_maxsize (int, optional): Minimum number of pooled connections per host, typically the
+            number of concurrent workers. The session is replaced by a larger one if needed.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    parsed = urlparse(endpoint or get_endpoint())
+    key = f"{parsed.scheme}://{parsed.netloc}"
+    pool_maxsize = max(pool_maxsize or 0, HTTP_POOL_MAXSIZE)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.csghub_pool_maxsize < pool_maxsize:
+            # a larger pool replaces the session instead of remounting adapters of a session in use
+            session = _new_session(pool_maxsize=pool_maxsize)
+            _sessions[key] = session
+        return session
+
+
+def _new_session(pool_maxsize: int) -> requests.Session:
+    # retry connection errors and throttled/unavailable responses of downloads and lookups only, streamed
+    # upload bodies can't be replayed and uploads have their own retry loops
+    retry = Retry(
+        total=HTTP_RETRY_TIMES,
+        backoff_factor=0.5,
+        status_forcelist=[429, 502, 503, 504],
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=pool_maxsize, max_retries=retry)
     session = requests.Session()
-    # if constants.HF_HUB_OFFLINE:
-    #     session.mount("http://", OfflineAdapter())
-    #     session.mount("https://", OfflineAdapter())
-    # else:
-    #     session.mount("http://", UniqueRequestIdAdapter())
-    #     session.mount("https://", UniqueRequestIdAdapter())
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.csghub_pool_maxsize = pool_maxsize
     return session
 
 
+def reset_sessions() -> None:
+    """Close and drop all pooled sessions."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _reset_sessions_after_fork() -> None:
+    # the lock may have been held by another thread of the parent at fork time, and the sockets of the pooled
+    # sessions belong to the parent: start over with a new lock and no session, without closing anything
+    global _sessions, _sessions_lock
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_sessions_after_fork)
+
+
+def new_async_client(max_connections: int, cookies=None) -> httpx.AsyncClient:
+    """Create an `httpx.AsyncClient` for concurrent downloads.
+
+    HTTP/2 is used when the optional `h2` package is installed (`pip install httpx[http2]`),
+    so many in-flight requests can be multiplexed over few connections.
+    """
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(http2=http2,
+                             limits=limits,
+                             cookies=cookies,
+                             follow_redirects=True,
+                             timeout=httpx.Timeout(API_FILE_DOWNLOAD_TIMEOUT))
+
+
 def get_token_to_send(token: Optional[str] = None) -> Optional[str]:
     if token:
         return token
@@ -234,7 +314,7 @@ def dataset_info(
     params = {}
     if files_metadata:
         params["blobs"] = True
-    r = requests.get(path, headers=headers, timeout=timeout, params=params)
+    r = get_session(path).get(path, headers=headers, timeout=timeout, params=params)
     if r.status_code != 200:
         logger.error(f"get dataset meta info from {path} response: {r.text}")
     r.raise_for_status()
@@ -297,7 +377,7 @@ def space_info(
     params = {}
     if files_metadata:
         params["blobs"] = True
-    r = requests.get(path, headers=headers, timeout=timeout, params=params)
+    r = get_session(path).get(path, headers=headers, timeout=timeout, params=params)
     if r.status_code != 200:
         logger.error(f"get space meta info from {path} response: {r.text}")
     r.raise_for_status()
@@ -366,7 +446,7 @@ def model_info(
         params["securityStatus"] = True
     if files_metadata:
         params["blobs"] = True
-    r = requests.get(path, headers=headers, timeout=timeout, params=params)
+    r = get_session(path).get(path, headers=headers, timeout=timeout, params=params)
     if r.status_code != 200:
         logger.error(f"get model meta info from {path} response: {r.text}")
     r.raise_for_status()
@@ -395,7 +475,7 @@ def code_info(
         params["securityStatus"] = True
     if files_metadata:
         params["blobs"] = True
-    r = requests.get(path, headers=headers, timeout=timeout, params=params)
+    r = get_session(path).get(path, headers=headers, timeout=timeout, params=params)
     if r.status_code != 200:
         logger.error(f"get code meta info from {path} response: {r.text}")
     r.raise_for_status()
@@ -424,7 +504,7 @@ def mcpserver_info(
         params["securityStatus"] = True
     if files_metadata:
         params["blobs"] = True
-    r = requests.get(path, headers=headers, timeout=timeout, params=params)
+    r = get_session(path).get(path, headers=headers, timeout=timeout, params=params)
     if r.status_code != 200:
         logger.error(f"get mcpserver meta info from {path} response: {r.text}")
     r.raise_for_status()
@@ -453,7 +533,7 @@ def skill_info(
         params["securityStatus"] = True
     if files_metadata:
         params["blobs"] = True
-    r = requests.get(path, headers=headers, timeout=timeout, params=params)
+    r = get_session(path).get(path, headers=headers, timeout=timeout, params=params)
     if r.status_code != 200:
         logger.error(f"get skill meta info from {path} response: {r.text}")
     r.raise_for_status()
@@ -588,6 +668,32 @@ def compute_hash(file_path) -> str:
     return sha256_hash.hexdigest()
 
 
+def get_repo_file_sha256s(repo_info) -> Dict[str, str]:
+    """Map the LFS files of a repo info fetched with `files_metadata=True` to their sha256 (LFS oid)."""
+    sha256s = {}
+    for sibling in getattr(repo_info, 'siblings', None) or []:
+        lfs = getattr(sibling, 'lfs', None)
+        if isinstance(lfs, dict):
+            sha256 = lfs.get('sha256') or lfs.get('oid')
+        else:
+            sha256 = getattr(lfs, 'sha256', None)
+        if sha256:
+            sha256s[sibling.rfilename] = sha256
+    return sha256s
+
+
+def get_repo_file_sizes(repo_info) -> Dict[str, int]:
+    """Map the files of a repo info fetched with `files_metadata=True` to their size, missing sizes are 0."""
+    sizes = {}
+    for sibling in getattr(repo_info, 'siblings', None) or []:
+        size = getattr(sibling, 'size', None)
+        if size is None:
+            lfs = getattr(sibling, 'lfs', None)
+            size = lfs.get('size') if isinstance(lfs, dict) else getattr(lfs, 'size', None)
+        sizes[sibling.rfilename] = size or 0
+    return sizes
+
+
 def pack_repo_file_info(repo_file_path,
                         revision) -> Dict[str, str]:
     repo_file_info = {'Path': repo_file_path,